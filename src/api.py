@@ -8,6 +8,7 @@ import logging
 import json
 
 import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, status, HTTPException, BackgroundTasks
 
@@ -22,10 +23,37 @@ import webbrowser
 
 from feedback_colletor import FeedbackColletor
 from browser_service import BrowserService
+from http_client import close_backend_clients
+from capture_worker import close_screen_capture
+from progress_stream import stop_progress_streams
+from health import (
+    start_backend_health_checks,
+    stop_backend_health_checks,
+    get_backend_readiness,
+)
+from personal_analytics import (
+    get_personal_analytics_client,
+    close_personal_analytics_client,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The backend is checked in the background, so a slow or unreachable backend
+    # does not delay the startup of the local server
+    start_backend_health_checks()
+    yield
+    await stop_backend_health_checks()
+    stop_progress_streams()
+    # Closes the pooled connections to the backend on shutdown
+    await close_backend_clients()
+    await close_personal_analytics_client()
+    # Stops the encoder process, so its shared memory does not outlive the server
+    await close_screen_capture()
 
 
 def create_app(connection: Connection) -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     global stop_collection
     stop_collection = False
@@ -36,14 +64,11 @@ def create_app(connection: Connection) -> FastAPI:
 
     @app.get("/checkPA")
     async def check_pa() -> bool:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    "http://localhost:57827/intervention_status"
-                )
-                return True
-            except:
-                return False
+        return await get_personal_analytics_client().is_available()
+
+    @app.get("/readiness")
+    async def get_readiness() -> list[dict]:
+        return get_backend_readiness()
 
     @app.post("/session")
     async def set_session(session: IamSession) -> None:
@@ -162,24 +187,28 @@ def create_app(connection: Connection) -> FastAPI:
 
     async def chrome_comeback_worker(wid: int):
         global current_worker_id, stop_collection
-        # logging.info("Chrome comeback sob")
-        while current_worker_id == wid and not stop_collection:
-            # logging.info("Chrome comeback sob")
-            await asyncio.sleep(1)
-            try:
-                finished = await connection.check_user_has_finished_homework()
-            except:
-                continue
-            if finished:
-                # logging.info("Checking if user has to return to survey ... Yes")
-                if os.getenv("ENV", None) == "dev":
-                    webbrowser.open("http://localhost:5173/?autoclose=true")
-                else:
-                    frontend_url = os.getenv("FRONTEND_URL")
-                    url = f"{frontend_url}?autoclose=true"
-                    webbrowser.open(url)
-                break
-            # logging.info("Checking if user has to return to survey ... No")
+        # The workers of every session share the poller of the progress hub
+        updates = connection.progress_hub.subscribe()
+        try:
+            while current_worker_id == wid and not stop_collection:
+                try:
+                    # Wakes up every second to notice when the worker is replaced
+                    student = await asyncio.wait_for(updates.get(), timeout=1)
+                    finished = Connection.has_finished_homework(student)
+                except Exception:
+                    continue
+                if finished:
+                    # logging.info("Checking if user has to return to survey ... Yes")
+                    if os.getenv("ENV", None) == "dev":
+                        webbrowser.open("http://localhost:5173/?autoclose=true")
+                    else:
+                        frontend_url = os.getenv("FRONTEND_URL")
+                        url = f"{frontend_url}?autoclose=true"
+                        webbrowser.open(url)
+                    break
+                # logging.info("Checking if user has to return to survey ... No")
+        finally:
+            connection.progress_hub.unsubscribe(updates)
         logging.info("Chrome comeback worker finished")
 
     async def worker(wid: int):
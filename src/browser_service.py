@@ -7,11 +7,34 @@ from asyncio import Lock
 
 import webbrowser
 
-from services import SessionService
+from services import SessionService, SessionProgress
+from circuit_breaker import CircuitOpenError
 
 
 class BrowserService:
-    def __init__(self, session_service: SessionService):
+    DEFAULT_POLL_SECONDS = 1
+    DEFAULT_FINAL_SECONDS = 10
+    DEFAULT_MAX_SLEEP_SECONDS = 300
+
+    def __init__(
+        self,
+        session_service: SessionService,
+        poll_seconds: float | None = None,
+        final_seconds: float | None = None,
+        max_sleep_seconds: float | None = None,
+    ):
+        """The worker sleeps until shortly before the homework ends according to
+        the remaining time, and only polls every poll_seconds in the final
+        seconds. A sleep never exceeds max_sleep_seconds, so that a session that
+        is extended or ended early is noticed.
+
+        This class performs data validation for the following environment variables
+        - FRONTEND_URL
+        - ENV
+        - BROWSER_POLL_SECONDS (optional)
+        - BROWSER_FINAL_SECONDS (optional)
+        - BROWSER_MAX_SLEEP_SECONDS (optional)
+        """
         self.lock = Lock()
         self.is_running = False
         self.session_service = session_service
@@ -25,11 +48,56 @@ class BrowserService:
             raise ValueError(
                 "[ BrowserService.__init__ ] The ENV environment variable was not set"
             )
+        if poll_seconds is None:
+            poll_seconds = float(
+                os.getenv("BROWSER_POLL_SECONDS", BrowserService.DEFAULT_POLL_SECONDS)
+            )
+        if final_seconds is None:
+            final_seconds = float(
+                os.getenv("BROWSER_FINAL_SECONDS", BrowserService.DEFAULT_FINAL_SECONDS)
+            )
+        if max_sleep_seconds is None:
+            max_sleep_seconds = float(
+                os.getenv(
+                    "BROWSER_MAX_SLEEP_SECONDS",
+                    BrowserService.DEFAULT_MAX_SLEEP_SECONDS,
+                )
+            )
+        if poll_seconds <= 0 or max_sleep_seconds < poll_seconds:
+            raise ValueError(
+                "[ BrowserService.__init__ ] The polling interval has to be positive and at most the maximum sleep"
+            )
+        if final_seconds < 0:
+            raise ValueError(
+                "[ BrowserService.__init__ ] The final seconds cannot be negative"
+            )
+        self.poll_seconds = poll_seconds
+        self.final_seconds = final_seconds
+        self.max_sleep_seconds = max_sleep_seconds
+
+    def get_wakeup_delay(self, session_progress: SessionProgress) -> float:
+        seconds_left = session_progress.get_seconds_until_homework_finishes()
+        if seconds_left <= self.final_seconds:
+            return self.poll_seconds
+        return min(
+            max(seconds_left - self.final_seconds, self.poll_seconds),
+            self.max_sleep_seconds,
+        )
+
+    async def _get_session_progress(self) -> SessionProgress:
+        """Waits for the backend to come back while its circuit is open, instead of
+        polling it."""
+        while True:
+            try:
+                return await self.session_service.get_session_progress()
+            except CircuitOpenError as e:
+                logging.info(f"[ BrowserService._get_session_progress ] {e}")
+                await asyncio.sleep(max(e.retry_after, self.poll_seconds))
 
     async def start_browser_worker(self):
         """
-        Starts a loop to periodically check if the browser needs to be opened to take
-        the post survey after homework
+        Starts a loop to check if the browser needs to be opened to take the post
+        survey after homework, waking up from the remaining time of the session
 
         Pre-conditions
         - A session was started
@@ -44,11 +112,11 @@ class BrowserService:
                 )
             self.is_running = True
 
-        session_progress = await self.session_service.get_session_progress()
+        session_progress = await self._get_session_progress()
 
         while not session_progress.has_finished_homework():
-            await asyncio.sleep(1)
-            session_progress = await self.session_service.get_session_progress()
+            await asyncio.sleep(self.get_wakeup_delay(session_progress))
+            session_progress = await self._get_session_progress()
 
         if self.env == "dev":
             webbrowser.open("http://localhost:5173/?autoclose=true")
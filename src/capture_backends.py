@@ -0,0 +1,427 @@
+import os
+import ctypes
+import logging
+
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from typing import NamedTuple
+
+import numpy as np
+
+from frame_buffer import FrameBuffer
+
+
+class Frame(NamedTuple):
+    # BGRA pixels, 4 bytes per pixel, row after row
+    raw: bytes | memoryview
+    # (width, height)
+    size: tuple[int, int]
+
+
+class CaptureMode(StrEnum):
+    # The whole monitor under the cursor
+    MONITOR = "monitor"
+    # The foreground window, cropped to the monitor under the cursor
+    WINDOW = "window"
+    # A fixed region of the virtual screen
+    REGION = "region"
+
+
+def intersect(a: dict, b: dict) -> dict | None:
+    """Intersection of two rectangles given as mss monitor dicts (left, top, width
+    and height), or None if they do not overlap."""
+    left = max(a["left"], b["left"])
+    top = max(a["top"], b["top"])
+    right = min(a["left"] + a["width"], b["left"] + b["width"])
+    bottom = min(a["top"] + a["height"], b["top"] + b["height"])
+    if right <= left or bottom <= top:
+        return None
+    return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+
+def parse_region(region: str) -> dict:
+    """Parses a region given as "left,top,width,height"."""
+    try:
+        left, top, width, height = [int(v) for v in region.split(",")]
+    except ValueError:
+        raise ValueError(
+            f"[ parse_region ] The region has to be left,top,width,height: {region}"
+        )
+    if width <= 0 or height <= 0:
+        raise ValueError("[ parse_region ] The region size has to be positive")
+    return {"left": left, "top": top, "width": width, "height": height}
+
+
+class CaptureBackend(ABC):
+    """Source of the raw frames grabbed by screenshot.ScreenCapture.
+
+    Backends are created and used by a single thread (the grab thread), since
+    platform handles such as GDI device contexts cannot be shared across threads.
+    """
+
+    @abstractmethod
+    def grab(self) -> Frame:
+        """Returns the frame to capture, usually the monitor under the cursor."""
+
+    def grab_into(self, frame_buffer: FrameBuffer) -> None:
+        """Grabs the frame into the given buffer. Backends that can write straight
+        into the buffer override this to avoid copying the frame."""
+        frame = self.grab()
+        frame_buffer.write(frame.raw, frame.size)
+
+    def get_stats(self) -> dict:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+class MssCaptureBackend(CaptureBackend):
+    """Grabs the screen with mss. Windows only.
+
+    The mss grabber is kept open between grabs and the monitors are only
+    enumerated again when the display layout changes (monitor plugged/unplugged,
+    resolution change).
+
+    In window mode only the foreground window is grabbed, cropped to the monitor
+    under the cursor, and in region mode only the configured region. Both fall
+    back to the whole monitor under the cursor when the window cannot be resolved
+    or the region is not on screen.
+    """
+
+    # Windows smaller than this (in either dimension) are not worth cropping to,
+    # and are usually tooltips, popups or the desktop itself
+    MIN_WINDOW_SIZE = 64
+
+    def __init__(
+        self, mode: CaptureMode = CaptureMode.MONITOR, region: dict | None = None
+    ) -> None:
+        # Imported here so that the rest of the capture pipeline can be imported
+        # on any platform
+        import mss
+        import mss.exception
+        import win32api
+        import win32con
+        import win32gui
+
+        if mode == CaptureMode.REGION and region is None:
+            raise ValueError(
+                "[ MssCaptureBackend.__init__ ] A region is required in region mode"
+            )
+
+        self.mss = mss
+        self.win32api = win32api
+        self.win32con = win32con
+        self.win32gui = win32gui
+        self.mode = mode
+        self.region = region
+
+        self.sct = None
+        self.monitors: list[dict] = []
+        self.display_signature = None
+        self.monitor_refresh_count = 0
+
+        self.cropped_grab_count = 0
+        self.fallback_grab_count = 0
+        self.pixels_grabbed = 0
+        self.pixels_available = 0
+
+    def _get_display_signature(self) -> tuple:
+        return (
+            self.win32api.GetSystemMetrics(self.win32con.SM_CMONITORS),
+            self.win32api.GetSystemMetrics(self.win32con.SM_XVIRTUALSCREEN),
+            self.win32api.GetSystemMetrics(self.win32con.SM_YVIRTUALSCREEN),
+            self.win32api.GetSystemMetrics(self.win32con.SM_CXVIRTUALSCREEN),
+            self.win32api.GetSystemMetrics(self.win32con.SM_CYVIRTUALSCREEN),
+        )
+
+    def _refresh_monitors(self) -> None:
+        # mss caches the monitor list internally, so the only reliable way to
+        # re-enumerate is to reopen the grabber
+        if self.sct is not None:
+            self.sct.close()
+        self.sct = self.mss.mss()
+        self.monitors = self.sct.monitors
+        self.display_signature = self._get_display_signature()
+        self.monitor_refresh_count += 1
+        logging.info(
+            f"[ MssCaptureBackend._refresh_monitors ] Found {len(self.monitors) - 1} monitor(s)"
+        )
+
+    def _ensure_monitors(self) -> None:
+        if self.sct is None or self._get_display_signature() != self.display_signature:
+            self._refresh_monitors()
+
+    def _find_monitor(self, x: int, y: int) -> dict:
+        # Find which monitor the mouse is on
+        monitor_index = 1  # default to first monitor if none matched
+        for i, monitor in enumerate(self.monitors[1:], start=1):
+            if (
+                monitor["left"] <= x < monitor["left"] + monitor["width"]
+                and monitor["top"] <= y < monitor["top"] + monitor["height"]
+            ):
+                monitor_index = i
+                break
+        return self.monitors[monitor_index]
+
+    def _get_foreground_window_rect(self) -> dict | None:
+        try:
+            hwnd = self.win32gui.GetForegroundWindow()
+            if hwnd == 0 or self.win32gui.IsIconic(hwnd):
+                return None
+            left, top, right, bottom = self.win32gui.GetWindowRect(hwnd)
+        except Exception:
+            return None
+        return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+    def _get_capture_area(self, monitor: dict) -> dict | None:
+        """Returns the part of the screen to grab for the current mode, or None to
+        grab the whole monitor."""
+        if self.mode == CaptureMode.WINDOW:
+            window = self._get_foreground_window_rect()
+            if window is None:
+                return None
+            area = intersect(window, monitor)
+            if (
+                area is None
+                or area["width"] < MssCaptureBackend.MIN_WINDOW_SIZE
+                or area["height"] < MssCaptureBackend.MIN_WINDOW_SIZE
+            ):
+                return None
+            return area
+        elif self.mode == CaptureMode.REGION:
+            # monitors[0] is the bounding box of all monitors
+            return intersect(self.region, self.monitors[0])
+        return None
+
+    def _select_area(self, mouse_x: int, mouse_y: int) -> dict:
+        monitor = self._find_monitor(mouse_x, mouse_y)
+        area = self._get_capture_area(monitor)
+        if area is None:
+            if self.mode != CaptureMode.MONITOR:
+                self.fallback_grab_count += 1
+            area = monitor
+        else:
+            self.cropped_grab_count += 1
+        self.pixels_grabbed += area["width"] * area["height"]
+        self.pixels_available += monitor["width"] * monitor["height"]
+        return area
+
+    def _grab_area_into(self, area: dict, frame_buffer: FrameBuffer) -> None:
+        """Grabs the area straight into the frame buffer with GetDIBits.
+
+        This mirrors the Windows grabber of mss, which copies the pixels into a new
+        bytearray on every grab, and reuses its device contexts and bitmap. Falls
+        back to a regular mss grab (and a copy) if the grabber does not look like
+        the one this was written against."""
+        handles = getattr(self.sct, "_handles", None)
+        gdi = getattr(self.sct, "gdi32", None)
+        if handles is None or gdi is None or not hasattr(handles, "bmi"):
+            screenshot = self.sct.grab(area)
+            frame_buffer.write(screenshot.raw, screenshot.size)
+            return
+
+        from mss.windows import CAPTUREBLT, DIB_RGB_COLORS, SRCCOPY
+
+        width, height = area["width"], area["height"]
+        if handles.region_width_height != (width, height):
+            handles.region_width_height = (width, height)
+            handles.bmi.bmiHeader.biWidth = width
+            # Negative height gives a top-down bitmap
+            handles.bmi.bmiHeader.biHeight = -height
+            # Kept so that a regular mss grab of the same size still works
+            handles.data = ctypes.create_string_buffer(width * height * 4)
+            if handles.bmp:
+                gdi.DeleteObject(handles.bmp)
+            handles.bmp = gdi.CreateCompatibleBitmap(handles.srcdc, width, height)
+            gdi.SelectObject(handles.memdc, handles.bmp)
+
+        frame_buffer.set_size(width, height)
+        gdi.BitBlt(
+            handles.memdc,
+            0,
+            0,
+            width,
+            height,
+            handles.srcdc,
+            area["left"],
+            area["top"],
+            SRCCOPY | CAPTUREBLT,
+        )
+        data = (ctypes.c_char * frame_buffer.nbytes).from_buffer(frame_buffer.view)
+        try:
+            bits = gdi.GetDIBits(
+                handles.memdc,
+                handles.bmp,
+                0,
+                height,
+                data,
+                handles.bmi,
+                DIB_RGB_COLORS,
+            )
+        finally:
+            # The ctypes array pins the buffer, which could not be released
+            del data
+        if bits != height:
+            raise self.mss.exception.ScreenShotError(
+                "[ MssCaptureBackend._grab_area_into ] gdi32.GetDIBits() failed"
+            )
+
+    def grab(self) -> Frame:
+        frame_buffer = FrameBuffer()
+        self.grab_into(frame_buffer)
+        return Frame(frame_buffer.view, frame_buffer.size)
+
+    def grab_into(self, frame_buffer: FrameBuffer) -> None:
+        self._ensure_monitors()
+        mouse_x, mouse_y = self.win32api.GetCursorPos()
+        try:
+            self._grab_area_into(self._select_area(mouse_x, mouse_y), frame_buffer)
+        except self.mss.exception.ScreenShotError:
+            # The display changed between the signature check and the grab
+            logging.error(
+                "[ MssCaptureBackend.grab_into ] Grab failed, refreshing monitors and retrying"
+            )
+            self._refresh_monitors()
+            self._grab_area_into(self._select_area(mouse_x, mouse_y), frame_buffer)
+
+    def get_stats(self) -> dict:
+        return {
+            "monitor_refresh_count": self.monitor_refresh_count,
+            "capture_mode": self.mode.value,
+            "cropped_grab_count": self.cropped_grab_count,
+            "fallback_grab_count": self.fallback_grab_count,
+            # Fraction of the monitor pixels that were actually grabbed
+            "pixel_fraction": (
+                self.pixels_grabbed / self.pixels_available
+                if self.pixels_available > 0
+                else None
+            ),
+        }
+
+    def close(self) -> None:
+        if self.sct is not None:
+            self.sct.close()
+            self.sct = None
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    """Deterministic generator of screen-like frames, used to profile and load test
+    the capture pipeline on machines without a display (or without Windows).
+
+    Frames look like a document: a light background with rows of dark text-like
+    noise, which compresses like a real screen. The entropy (0 to 1) controls how
+    much of the frame changes between grabs: a band of that fraction of the rows is
+    rewritten with random pixels, and a cursor-sized block moves around. An entropy
+    of 0 gives identical frames (an idle student), 1 gives frames of pure noise (the
+    worst case for the encoder). The same seed always gives the same frames.
+
+    A region can be given to benchmark region of interest capture, in which case
+    only that part of the frame is returned.
+    """
+
+    LINE_HEIGHT = 12
+    LINE_SPACING = 8
+    CURSOR_SIZE = 16
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        entropy: float = 0.1,
+        seed: int = 0,
+        region: dict | None = None,
+    ) -> None:
+        if width <= 0 or height <= 0:
+            raise ValueError(
+                "[ SyntheticCaptureBackend.__init__ ] The resolution has to be positive"
+            )
+        if entropy < 0 or entropy > 1:
+            raise ValueError(
+                "[ SyntheticCaptureBackend.__init__ ] The entropy has to be between 0 and 1"
+            )
+        self.width = width
+        self.height = height
+        self.entropy = entropy
+        self.region = None
+        if region is not None:
+            self.region = intersect(
+                region, {"left": 0, "top": 0, "width": width, "height": height}
+            )
+        self.rng = np.random.default_rng(seed)
+        self.frame_count = 0
+
+        self.frame = np.full((height, width, 4), 245, dtype=np.uint8)
+        period = (
+            SyntheticCaptureBackend.LINE_HEIGHT + SyntheticCaptureBackend.LINE_SPACING
+        )
+        for top in range(SyntheticCaptureBackend.LINE_SPACING, height, period):
+            self._write_text(
+                top, min(top + SyntheticCaptureBackend.LINE_HEIGHT, height)
+            )
+
+    def _write_text(self, top: int, bottom: int) -> None:
+        ink = self.rng.random((bottom - top, self.width)) < 0.3
+        self.frame[top:bottom, :, :3][ink] = 30
+
+    def _next_frame(self) -> np.ndarray:
+        """Updates the frame and returns a view of the part to capture."""
+        self.frame_count += 1
+        changed_rows = int(self.entropy * self.height)
+        if changed_rows > 0:
+            top = int(self.rng.integers(0, self.height - changed_rows + 1))
+            self.frame[top : top + changed_rows, :, :3] = self.rng.integers(
+                0, 256, (changed_rows, self.width, 3), dtype=np.uint8
+            )
+            size = min(SyntheticCaptureBackend.CURSOR_SIZE, self.width, self.height)
+            y = int(self.rng.integers(0, self.height - size + 1))
+            x = int(self.rng.integers(0, self.width - size + 1))
+            self.frame[y : y + size, x : x + size, :3] = 0
+        if self.region is not None:
+            r = self.region
+            return self.frame[
+                r["top"] : r["top"] + r["height"],
+                r["left"] : r["left"] + r["width"],
+            ]
+        return self.frame
+
+    def grab(self) -> Frame:
+        frame = np.ascontiguousarray(self._next_frame())
+        return Frame(frame.data.cast("B"), (frame.shape[1], frame.shape[0]))
+
+    def grab_into(self, frame_buffer: FrameBuffer) -> None:
+        frame = self._next_frame()
+        frame_buffer.set_size(frame.shape[1], frame.shape[0])
+        np.copyto(frame_buffer.array, frame)
+
+    def get_stats(self) -> dict:
+        return {"synthetic_frame_count": self.frame_count}
+
+
+def create_capture_backend() -> CaptureBackend:
+    """Creates the backend selected by CAPTURE_BACKEND: mss (the default) or
+    synthetic. The synthetic backend is configured through
+    SYNTHETIC_CAPTURE_WIDTH, SYNTHETIC_CAPTURE_HEIGHT, SYNTHETIC_CAPTURE_ENTROPY
+    and SYNTHETIC_CAPTURE_SEED.
+
+    CAPTURE_MODE selects what is grabbed: monitor (the default), window or region.
+    The region is given by CAPTURE_REGION as left,top,width,height."""
+    backend = os.getenv("CAPTURE_BACKEND", "mss").lower()
+    mode = CaptureMode(os.getenv("CAPTURE_MODE", CaptureMode.MONITOR).lower())
+    region = None
+    if os.getenv("CAPTURE_REGION"):
+        region = parse_region(os.getenv("CAPTURE_REGION"))
+    if backend == "mss":
+        return MssCaptureBackend(mode, region)
+    elif backend == "synthetic":
+        return SyntheticCaptureBackend(
+            width=int(os.getenv("SYNTHETIC_CAPTURE_WIDTH", 1920)),
+            height=int(os.getenv("SYNTHETIC_CAPTURE_HEIGHT", 1080)),
+            entropy=float(os.getenv("SYNTHETIC_CAPTURE_ENTROPY", 0.1)),
+            seed=int(os.getenv("SYNTHETIC_CAPTURE_SEED", 0)),
+            region=region if mode == CaptureMode.REGION else None,
+        )
+    else:
+        raise ValueError(
+            f"[ create_capture_backend ] Unknown capture backend: {backend}"
+        )
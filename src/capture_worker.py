@@ -0,0 +1,213 @@
+import time
+import logging
+import traceback
+
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+from frame_buffer import BoxDownscaler, FrameBuffer
+from screenshot import (
+    ScreenCapture,
+    EncodingOptions,
+    EncodedScreenshot,
+    encode_frame,
+)
+
+
+def _encoder_main(conn, options: EncodingOptions) -> None:
+    """Entry point of the encoder process. Receives frame descriptors through the
+    pipe, reads the pixels from the shared memory block named in the descriptor and
+    replies with the encoded screenshot."""
+    shm = None
+    frame = None
+    delta_encoder = options.create_delta_encoder()
+    downscaler = BoxDownscaler()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            # The parent process exited without closing the encoder
+            break
+        if request is None:
+            break
+
+        shm_name, width, height, force_keyframe = request
+        try:
+            if delta_encoder is not None and force_keyframe:
+                delta_encoder.request_keyframe()
+            if shm is None or shm.name != shm_name:
+                frame = None
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=shm_name)
+                frame = FrameBuffer(shm.buf, allocator=None)
+            frame.set_size(width, height)
+            start = time.perf_counter()
+            fp, phash, manifest = encode_frame(
+                frame, options, delta_encoder, downscaler
+            )
+            conn.send(("ok", time.perf_counter() - start, phash, manifest))
+            # send_bytes writes the buffer straight to the pipe, skipping pickle
+            conn.send_bytes(fp.getbuffer())
+        except Exception:
+            conn.send(("err", traceback.format_exc(), None, None))
+
+    frame = None
+    if shm is not None:
+        shm.close()
+    conn.close()
+
+
+class AsyncScreenCapture:
+    """Async front end for screen capture that keeps the event loop free.
+
+    The grab runs on a dedicated thread (GDI handles are bound to the thread that
+    created them) and writes the raw frame straight into a shared memory block. A
+    separate process then encodes the frame from that block, so the expensive
+    encoding runs on another core and the pixels are never copied between the grab
+    and the encoder.
+    """
+
+    def __init__(self, screen_capture: ScreenCapture | None = None) -> None:
+        self.screen_capture = screen_capture
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = asyncio.Lock()
+
+        self.process = None
+        self.conn = None
+        self.shm = None
+        self.frame_buffer = FrameBuffer(allocator=self._allocate_shared_memory)
+
+        self.force_keyframe = False
+
+        self.last_grab_seconds: float | None = None
+        self.last_encode_seconds: float | None = None
+
+    def _get_screen_capture(self) -> ScreenCapture:
+        if self.screen_capture is None:
+            self.screen_capture = ScreenCapture()
+        return self.screen_capture
+
+    def _start(self) -> None:
+        # Spawn is the only start method on Windows, and using it everywhere keeps
+        # the encoder from inheriting the event loop and open sockets
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_encoder_main,
+            args=(child_conn, self._get_screen_capture().encoding_options),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        logging.info(
+            f"[ AsyncScreenCapture._start ] Encoder process started with PID {self.process.pid}"
+        )
+
+    def _allocate_shared_memory(self, size: int) -> memoryview:
+        """Allocator of the frame buffer. Called when a frame does not fit in the
+        current block."""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        return self.shm.buf
+
+    def _grab_into_shared_memory(self) -> tuple[int, int, str]:
+        start = time.perf_counter()
+        self._get_screen_capture().grab_into(self.frame_buffer)
+        width, height = self.frame_buffer.size
+        self.last_grab_seconds = time.perf_counter() - start
+        return width, height, self.screen_capture.new_screenshot_path()
+
+    def request_keyframe(self) -> None:
+        """Makes the next delta encoded frame a full frame. Used when the previous
+        frame did not reach the backend."""
+        self.force_keyframe = True
+
+    def _encode(self, width: int, height: int) -> tuple[bytes, int, dict | None]:
+        self.conn.send((self.shm.name, width, height, self.force_keyframe))
+        self.force_keyframe = False
+        status, result, phash, manifest = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(
+                f"[ AsyncScreenCapture._encode ] Encoder process failed: {result}"
+            )
+        data = self.conn.recv_bytes()
+        self.last_encode_seconds = result
+        self.screen_capture.encoding_stats.register(len(data), result)
+        return data, phash, manifest
+
+    async def capture(self) -> EncodedScreenshot:
+        """Grabs and encodes the monitor under the cursor without blocking the
+        event loop."""
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self._start()
+            start = time.perf_counter()
+            width, height, filepath = await loop.run_in_executor(
+                self.executor, self._grab_into_shared_memory
+            )
+            data, phash, manifest = await loop.run_in_executor(
+                self.executor, self._encode, width, height
+            )
+            self.screen_capture.register_capture(time.perf_counter() - start)
+        return EncodedScreenshot(
+            filepath=filepath, data=data, phash=phash, manifest=manifest
+        )
+
+    def get_timing_stats(self) -> dict:
+        stats = {
+            "last_grab_seconds": self.last_grab_seconds,
+            "last_encode_seconds": self.last_encode_seconds,
+        }
+        if self.screen_capture is not None:
+            stats.update(self.screen_capture.get_timing_stats())
+        return stats
+
+    def close(self) -> None:
+        """Stops the encoder process and frees the shared memory block. The next
+        capture starts them again."""
+        if self.process is not None:
+            if self.process.is_alive():
+                self.conn.send(None)
+                self.process.join(timeout=5)
+            self.conn.close()
+            self.process = None
+        self.frame_buffer = FrameBuffer(allocator=self._allocate_shared_memory)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        self.executor.submit(self._close_screen_capture)
+        self.executor.shutdown(wait=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def aclose(self) -> None:
+        """Closes the capture once the capture in progress, if any, is done."""
+        async with self.lock:
+            await asyncio.to_thread(self.close)
+
+    def _close_screen_capture(self) -> None:
+        if self.screen_capture is not None:
+            self.screen_capture.close()
+
+
+_async_screen_capture: AsyncScreenCapture | None = None
+
+
+async def capture_screenshot() -> EncodedScreenshot:
+    global _async_screen_capture
+    if _async_screen_capture is None:
+        _async_screen_capture = AsyncScreenCapture()
+    return await _async_screen_capture.capture()
+
+
+async def close_screen_capture() -> None:
+    """Stops the encoder process and frees its shared memory. Called when the local
+    server shuts down."""
+    if _async_screen_capture is not None:
+        await _async_screen_capture.aclose()
@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+
+
+class CircuitOpenError(ConnectionError):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(
+            f"The backend is unavailable, the next attempt is allowed in {retry_after:.1f} seconds"
+        )
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails the calls to a backend fast while it is down.
+
+    The circuit is closed while the backend answers. After failure_threshold
+    consecutive failures it opens: every call is rejected with a CircuitOpenError
+    without reaching the backend. After reset_seconds it is half-open: a single
+    call is let through as a probe. The circuit closes if the probe succeeds and
+    opens again if it fails.
+
+    The breaker is configured through CIRCUIT_FAILURE_THRESHOLD and
+    CIRCUIT_RESET_SECONDS.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_SECONDS = 30
+
+    def __init__(
+        self,
+        failure_threshold: int | None = None,
+        reset_seconds: float | None = None,
+    ) -> None:
+        if failure_threshold is None:
+            failure_threshold = int(
+                os.getenv(
+                    "CIRCUIT_FAILURE_THRESHOLD",
+                    CircuitBreaker.DEFAULT_FAILURE_THRESHOLD,
+                )
+            )
+        if reset_seconds is None:
+            reset_seconds = float(
+                os.getenv("CIRCUIT_RESET_SECONDS", CircuitBreaker.DEFAULT_RESET_SECONDS)
+            )
+        if failure_threshold <= 0:
+            raise ValueError(
+                "[ CircuitBreaker.__init__ ] The failure threshold has to be positive"
+            )
+        if reset_seconds < 0:
+            raise ValueError(
+                "[ CircuitBreaker.__init__ ] The reset duration cannot be negative"
+            )
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.state = CircuitBreaker.CLOSED
+        self.failure_count = 0
+        self.opened_at: float | None = None
+        self.probe_in_flight = False
+
+        self.open_count = 0
+        self.rejected_count = 0
+
+    def get_state(self) -> str:
+        if (
+            self.state == CircuitBreaker.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_seconds
+        ):
+            self.state = CircuitBreaker.HALF_OPEN
+        return self.state
+
+    def before_call(self) -> None:
+        """Raises a CircuitOpenError if the call is not allowed."""
+        state = self.get_state()
+        if state == CircuitBreaker.CLOSED:
+            return
+        if state == CircuitBreaker.HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return
+        self.rejected_count += 1
+        retry_after = 0
+        if state == CircuitBreaker.OPEN:
+            retry_after = self.reset_seconds - (time.monotonic() - self.opened_at)
+        raise CircuitOpenError(retry_after)
+
+    def on_success(self) -> None:
+        if self.state != CircuitBreaker.CLOSED:
+            logging.info("[ CircuitBreaker ] The backend is back, closing the circuit")
+        self.state = CircuitBreaker.CLOSED
+        self.failure_count = 0
+        self.probe_in_flight = False
+
+    def on_failure(self) -> None:
+        self.failure_count += 1
+        if (
+            self.state == CircuitBreaker.HALF_OPEN
+            or self.failure_count >= self.failure_threshold
+        ):
+            if self.state != CircuitBreaker.OPEN:
+                self.open_count += 1
+                logging.error(
+                    f"[ CircuitBreaker ] Opening the circuit after {self.failure_count} failures"
+                )
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+    def release(self) -> None:
+        """Called when an allowed call ended without an answer of the backend, for
+        instance because it was cancelled."""
+        self.probe_in_flight = False
+
+    def get_stats(self) -> dict:
+        return {
+            "state": self.get_state(),
+            "failure_count": self.failure_count,
+            "open_count": self.open_count,
+            "rejected_count": self.rejected_count,
+        }
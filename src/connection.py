@@ -3,16 +3,13 @@ import traceback
 import logging
 
 import httpx
-import requests
 import json
 
 from session import IamSession, User
-from feedback import Feedback
-
-
-class HealthCheckError(Exception):
-    def __init__(self) -> None:
-        super().__init__("Health Check Error. Could not connect to the server")
+from feedback import Feedback, get_screenshot_upload
+from http_client import get_backend_client
+from health import get_backend_health
+from progress_hub import SessionProgressHub
 
 
 class Connection:
@@ -29,17 +26,18 @@ class Connection:
         port = int(os.getenv("BACKEND_PORT"))
         path_prefix = os.getenv("PATH_PREFIX", "")
         self.base_url = f"http{'s' if port == 443 else ''}://{host}:{port}{path_prefix}"
-        if os.getenv("env", "prod") == "prod":
-            try:
-                response = requests.get(f"{self.base_url}/health_check")
-            except requests.exceptions.ConnectionError:
-                raise HealthCheckError()
-            if response.status_code != 200 or response.json()["status"] != "ok":
-                raise HealthCheckError()
+        self.http_client = get_backend_client(self.base_url)
+        # Checked in the background once the local server is started, see
+        # start_backend_health_checks
+        self.health = get_backend_health(self.base_url)
+        # The sessions of the student are read through the hub, so the workers
+        # waiting for the end of the homework share one poller
+        self.progress_hub = SessionProgressHub(self._get_student)
         self.session = None
 
     def set_session(self, session: IamSession) -> None:
         self.session = session
+        self.progress_hub.invalidate()
 
     def get_session(self) -> IamSession:
         return self.session
@@ -72,24 +70,22 @@ class Connection:
         return True
 
     async def _get_session_progress(self) -> dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/session_execution/students/{self.session.user.username}/session"
-            )
-            return response.json()
+        response = await self.http_client.get(
+            f"{self.base_url}/session_execution/students/{self.session.user.username}/session"
+        )
+        return response.json()
 
     async def connect(self) -> None:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/iam/session/{self.session.token}"
-            )
-            if (
-                response.status_code == 200
-                and response.json()["token"] == self.session.token
-            ):
-                logging.info("Connected")
-            else:
-                raise ConnectionError("It was not possible to connect to the backend")
+        response = await self.http_client.get(
+            f"{self.base_url}/iam/session/{self.session.token}"
+        )
+        if (
+            response.status_code == 200
+            and response.json()["token"] == self.session.token
+        ):
+            logging.info("Connected")
+        else:
+            raise ConnectionError("It was not possible to connect to the backend")
 
     async def send_feedback(self, feedback: Feedback) -> bool:
         """Returns a flag if session is still active and false otherwise.
@@ -98,9 +94,12 @@ class Connection:
         response = None
         try:
             pa_feedback_str = json.dumps(feedback.personal_analytics_data.model_dump())
-            with open(feedback.screenshot, "rb") as screenshot_file:
-                logging.info("Sending feedback")
-                response = await self._send_feedback(pa_feedback_str, screenshot_file)
+            logging.info("Sending feedback")
+            response = await self._send_feedback(
+                pa_feedback_str,
+                get_screenshot_upload(feedback),
+                feedback.screenshot_manifest,
+            )
         except httpx.TimeoutException:
             raise TimeoutError()
         except json.JSONDecodeError:
@@ -124,29 +123,36 @@ class Connection:
             return False
         return True
 
-    async def _send_feedback(self, pa_feedback_str: str, screenshot_file) -> dict:
-        async with httpx.AsyncClient(timeout=Connection.TIMEOUT_SECONDS) as client:
-            response = await client.post(
-                f"{self.base_url}/session_execution/student/{self.session.user.username}/session/feedback",
-                headers={"Authorization": f"Bearer {self.session.token}"},
-                params={
-                    "pa_feedback_str": pa_feedback_str,
-                },
-                files={"screenshot_file": screenshot_file},
-            )
+    async def _send_feedback(
+        self, pa_feedback_str: str, screenshot_file, tile_manifest: dict | None = None
+    ) -> dict:
+        params = {
+            "pa_feedback_str": pa_feedback_str,
+        }
+        # A delta encoded screenshot only holds the tiles that changed, the
+        # backend needs the manifest to rebuild the full screenshot
+        if tile_manifest is not None:
+            params["tile_manifest"] = json.dumps(tile_manifest)
+        response = await self.http_client.post(
+            f"{self.base_url}/session_execution/student/{self.session.user.username}/session/feedback",
+            headers={"Authorization": f"Bearer {self.session.token}"},
+            params=params,
+            files={"screenshot_file": screenshot_file},
+            endpoint="ingest_feedback",
+            timeout=Connection.TIMEOUT_SECONDS,
+        )
         return response.json()
 
     async def get_current_feedback(self) -> dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/session_execution/student/{self.session.user.username}/session/feedback",
-                headers={"Authorization": f"Bearer {self.session.token}"},
-            )
-            try:
-                return response.json()
-            except:
-                logging.info("[ get_current_feedback ] returning none")
-                return None
+        response = await self.http_client.get(
+            f"{self.base_url}/session_execution/student/{self.session.user.username}/session/feedback",
+            headers={"Authorization": f"Bearer {self.session.token}"},
+        )
+        try:
+            return response.json()
+        except:
+            logging.info("[ get_current_feedback ] returning none")
+            return None
 
     # async def check_user_has_active_session(self) -> bool:
     #     async with httpx.AsyncClient() as client:
@@ -167,29 +173,35 @@ class Connection:
     #                 return True
     #             return False
 
+    async def _get_student(self) -> dict | None:
+        response = await self.http_client.get(
+            f"{self.base_url}/session_execution/student",
+            params={"student_name": self.session.user.username},
+        )
+        if response.status_code != 200:
+            logging.info(
+                f"Received status code {response.status_code} in Connection.check_user_has_finished_homework()"
+            )
+            return None
+        return response.json()
+
     async def check_user_has_finished_homework(self) -> bool:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/session_execution/student",
-                params={"student_name": self.session.user.username},
+        return Connection.has_finished_homework(await self.progress_hub.get())
+
+    @staticmethod
+    def has_finished_homework(student: dict | None) -> bool:
+        if student is None:
+            return False
+        assert "sessions" in student
+        if len(student["sessions"]) == 0:
+            logging.error(
+                "[ Connection.check_user_has_finished_homework() ] Tried to check if user has finished homework but user does not even have an active session"
             )
-            if response.status_code != 200:
-                logging.info(
-                    f"Received status code {response.status_code} in Connection.check_user_has_finished_homework()"
-                )
-                return False
-            else:
-                student = response.json()
-                assert "sessions" in student
-                if len(student["sessions"]) == 0:
-                    logging.error(
-                        "[ Connection.check_user_has_finished_homework() ] Tried to check if user has finished homework but user does not even have an active session"
-                    )
-                    raise RuntimeError("Student does not have an active session")
-                return (
-                    student["sessions"][-1]["stage"] == "homework"
-                    and student["sessions"][-1]["remaining_time_seconds"] < 5
-                ) or student["sessions"][-1]["stage"] == "survey"
+            raise RuntimeError("Student does not have an active session")
+        return (
+            student["sessions"][-1]["stage"] == "homework"
+            and student["sessions"][-1]["remaining_time_seconds"] < 5
+        ) or student["sessions"][-1]["stage"] == "survey"
 
     # async def upload_tracking_user_input_batch(
     #     self, student_name: str, batch: list[dict]
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+# Size of the difference hash. The frame is shrunk to (HASH_SIZE + 1) x HASH_SIZE
+# cells and every cell is compared to its right neighbour, giving a 64-bit hash.
+HASH_SIZE = 8
+# Pixels sampled along each axis of a cell
+HASH_SAMPLES = 4
+
+
+def perceptual_hash(pixels: np.ndarray) -> int:
+    """Difference hash (dHash) of a (height, width, channels) frame, in RGB or BGR
+    order. Frames that look alike have hashes with a small hamming distance,
+    regardless of small changes in compression or rendering."""
+    height, width = pixels.shape[:2]
+    rows = HASH_SIZE * HASH_SAMPLES
+    cols = (HASH_SIZE + 1) * HASH_SAMPLES
+    # Only a sparse grid of pixels is read from the frame, which is usually a view
+    # of the capture buffer, and the channels are summed with equal weights so the
+    # hash does not depend on their order
+    ys = (np.arange(rows) * height) // rows
+    xs = (np.arange(cols) * width) // cols
+    grid = pixels[ys[:, None], xs[None, :], :3].sum(axis=2, dtype=np.uint32)
+    cells = grid.reshape(HASH_SIZE, HASH_SAMPLES, HASH_SIZE + 1, HASH_SAMPLES).sum(
+        axis=(1, 3)
+    )
+    bits = cells[:, :-1] > cells[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class FrameDeduplicator:
+    """Decides whether a frame has to be uploaded by comparing its perceptual hash
+    to the hash of the last frame the backend received.
+
+    Deduplication is disabled unless SCREENSHOT_DEDUP_DISTANCE is set. Frames whose
+    distance to the reference is less than or equal to that value are considered
+    unchanged.
+    """
+
+    def __init__(self, max_distance: int | None = None) -> None:
+        if max_distance is None and os.getenv("SCREENSHOT_DEDUP_DISTANCE"):
+            max_distance = int(os.getenv("SCREENSHOT_DEDUP_DISTANCE"))
+        if max_distance is not None and max_distance < 0:
+            raise ValueError(
+                "[ FrameDeduplicator.__init__ ] The maximum distance cannot be negative"
+            )
+        self.max_distance = max_distance
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the reference frame and the counters. Called at the start of
+        every session, since the backend evaluates sessions independently."""
+        self.reference_seqnum: int | None = None
+        self.reference_hash: int | None = None
+        self.reference_screenshot: str | None = None
+        self.frames_uploaded = 0
+        self.frames_skipped = 0
+        self.bytes_saved = 0
+
+    def find_duplicate(self, phash: int) -> int | None:
+        """Returns the seqnum of the reference frame if the frame with the given hash
+        is unchanged since then, or None if it has to be uploaded."""
+        if self.max_distance is None or self.reference_hash is None:
+            return None
+        if hamming_distance(phash, self.reference_hash) > self.max_distance:
+            return None
+        return self.reference_seqnum
+
+    def register_upload(self, seqnum: int, phash: int, screenshot: str) -> None:
+        self.frames_uploaded += 1
+        # Backfilled frames arrive after newer ones and do not replace the reference
+        if self.reference_seqnum is not None and seqnum < self.reference_seqnum:
+            return
+        self.reference_seqnum = seqnum
+        self.reference_hash = phash
+        self.reference_screenshot = screenshot
+
+    def register_skip(self, nbytes: int) -> None:
+        self.frames_skipped += 1
+        self.bytes_saved += nbytes
+
+    def get_stats(self) -> dict:
+        return {
+            "frames_uploaded": self.frames_uploaded,
+            "frames_skipped": self.frames_skipped,
+            "bytes_saved": self.bytes_saved,
+        }
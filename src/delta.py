@@ -0,0 +1,131 @@
+import math
+
+import numpy as np
+
+
+class TileDeltaEncoder:
+    """Splits frames into square tiles and keeps only the tiles that changed since
+    the previous frame.
+
+    The changed tiles are packed into an atlas (a grid of tiles, in the order they
+    appear in the manifest) that is encoded like a regular screenshot. The manifest
+    tells where each tile of the atlas goes in the full frame, so the frame can be
+    rebuilt from the previous one. A full keyframe is produced for the first frame,
+    whenever the resolution changes, every keyframe_interval frames, when a keyframe
+    is requested (the previous frame was not delivered) and when so many tiles
+    changed that the delta would not be smaller than the frame.
+    """
+
+    # Above this fraction of changed tiles a keyframe is sent instead of a delta
+    MAX_CHANGED_FRACTION = 0.5
+
+    def __init__(self, tile_size: int, keyframe_interval: int) -> None:
+        if tile_size <= 0:
+            raise ValueError(
+                "[ TileDeltaEncoder.__init__ ] The tile size has to be positive"
+            )
+        if keyframe_interval <= 0:
+            raise ValueError(
+                "[ TileDeltaEncoder.__init__ ] The keyframe interval has to be positive"
+            )
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+
+        self.size: tuple[int, int] | None = None
+        # Frames are padded to a multiple of the tile size and kept as 32-bit pixels,
+        # so comparing two frames is a single vectorized comparison
+        self.current: np.ndarray | None = None
+        self.previous: np.ndarray | None = None
+
+        self.frame_index = 0
+        self.frames_since_keyframe = 0
+        self.force_keyframe = True
+
+    def request_keyframe(self) -> None:
+        self.force_keyframe = True
+
+    def _allocate(self, size: tuple[int, int]) -> None:
+        width, height = size
+        padded_height = math.ceil(height / self.tile_size) * self.tile_size
+        padded_width = math.ceil(width / self.tile_size) * self.tile_size
+        self.size = size
+        self.current = np.zeros((padded_height, padded_width), dtype=np.uint32)
+        self.previous = np.zeros((padded_height, padded_width), dtype=np.uint32)
+        self.force_keyframe = True
+
+    def _tiles(self, frame: np.ndarray) -> np.ndarray:
+        """View of the frame as a (rows, cols, tile_size, tile_size) array."""
+        rows = frame.shape[0] // self.tile_size
+        cols = frame.shape[1] // self.tile_size
+        return frame.reshape(rows, self.tile_size, cols, self.tile_size).swapaxes(1, 2)
+
+    def find_changed_tiles(self) -> np.ndarray:
+        """Returns the (row, col) coordinates of the tiles that differ between the
+        current and the previous frame."""
+        changed = self._tiles(self.current != self.previous).any(axis=(2, 3))
+        return np.argwhere(changed)
+
+    def _build_atlas(self, coords: np.ndarray) -> np.ndarray:
+        count = len(coords)
+        cols = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / cols)
+        tiles = self._tiles(self.current)[coords[:, 0], coords[:, 1]]
+        if rows * cols > count:
+            padding = np.zeros(
+                (rows * cols - count, self.tile_size, self.tile_size), dtype=np.uint32
+            )
+            tiles = np.concatenate((tiles, padding))
+        return (
+            tiles.reshape(rows, cols, self.tile_size, self.tile_size)
+            .swapaxes(1, 2)
+            .reshape(rows * self.tile_size, cols * self.tile_size)
+        )
+
+    def encode(self, raw, size: tuple[int, int]) -> tuple[dict, np.ndarray]:
+        """Compares the raw BGRA frame to the previous one. Returns the manifest and
+        the pixels to encode, as 32-bit BGRA pixels: the full frame for keyframes or
+        the atlas of changed tiles for deltas."""
+        width, height = size
+        if self.size != size:
+            self._allocate(size)
+
+        frame = np.frombuffer(raw, dtype=np.uint32, count=width * height)
+        self.current[:height, :width] = frame.reshape(height, width)
+
+        self.frame_index += 1
+        manifest = {
+            "frame_index": self.frame_index,
+            "width": width,
+            "height": height,
+            "tile_size": self.tile_size,
+        }
+
+        coords = None
+        keyframe = (
+            self.force_keyframe or self.frames_since_keyframe >= self.keyframe_interval
+        )
+        if not keyframe:
+            coords = self.find_changed_tiles()
+            total_tiles = (self.current.shape[0] // self.tile_size) * (
+                self.current.shape[1] // self.tile_size
+            )
+            keyframe = len(coords) > total_tiles * TileDeltaEncoder.MAX_CHANGED_FRACTION
+
+        if keyframe:
+            manifest["keyframe"] = True
+            # Keyframes are encoded straight from the raw frame, without a copy
+            pixels = frame.reshape(height, width)
+            self.frames_since_keyframe = 0
+            self.force_keyframe = False
+        else:
+            manifest["keyframe"] = False
+            manifest["reference_frame_index"] = self.frame_index - 1
+            manifest["tiles"] = coords.tolist()
+            if len(coords) > 0:
+                pixels = self._build_atlas(coords)
+            else:
+                pixels = np.zeros((1, 1), dtype=np.uint32)
+            self.frames_since_keyframe += 1
+
+        self.current, self.previous = self.previous, self.current
+        return manifest, pixels
@@ -1,14 +1,17 @@
 from __future__ import annotations
 import os
+import mimetypes
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from enum import StrEnum, auto
 
 import random
+import asyncio
 
 from personal_analytics import get_feedback_personal_analytics
-from screenshot import take_screenshot
+from capture_worker import capture_screenshot
+from screenshot import ScreenshotArchive
 
 
 class Feedback(BaseModel):
@@ -25,6 +28,21 @@ class Feedback(BaseModel):
 
     screenshot: str
 
+    # Encoded screenshot kept in memory from capture to upload. The screenshot field
+    # above only names the file it is archived to, which may not exist (yet).
+    screenshot_data: Optional[bytes] = Field(default=None, exclude=True, repr=False)
+
+    screenshot_hash: Optional[int] = None
+
+    # Tile manifest when the screenshot only holds the tiles that changed since the
+    # previous screenshot (see delta.TileDeltaEncoder)
+    screenshot_manifest: Optional[dict] = None
+
+    # Set when the screen did not change since the feedback with this seqnum was
+    # uploaded. The screenshot is then not uploaded again and the screenshot field
+    # points to the one of the referenced feedback.
+    unchanged_since: Optional[int] = None
+
 
 class PaFeedback(BaseModel):
     isFocused: int
@@ -34,9 +52,16 @@ class PaFeedback(BaseModel):
     keyboardStrokes: int
 
 
+_screenshot_archive = ScreenshotArchive()
+
+
 async def collect_feedback() -> Feedback:
-    pa_feedback = await get_feedback_personal_analytics()
-    screenshot = take_screenshot()
+    pa_feedback, screenshot = await asyncio.gather(
+        get_feedback_personal_analytics(), capture_screenshot()
+    )
+    _screenshot_archive.schedule(
+        screenshot.filepath, screenshot.data, screenshot.manifest
+    )
     feedback = Feedback(
         personal_analytics_data=PaFeedback(
             numMouseClicks=pa_feedback.clickTotal,
@@ -45,10 +70,29 @@ async def collect_feedback() -> Feedback:
             mouseScrollDistance=pa_feedback.scrollDelta,
             isFocused=pa_feedback.isFocused,
         ),
-        screenshot=screenshot,
+        screenshot=screenshot.filepath,
+        screenshot_data=screenshot.data,
+        screenshot_hash=screenshot.phash,
+        screenshot_manifest=screenshot.manifest,
     )
     return feedback
 
 
+def get_screenshot_upload(feedback: Feedback) -> tuple:
+    """Returns the multipart file tuple for the feedback screenshot. Screenshots
+    loaded back from the repository only have their path, so those are read from
+    the archive."""
+    data = feedback.screenshot_data
+    if data is None:
+        with open(feedback.screenshot, "rb") as screenshot_file:
+            data = screenshot_file.read()
+    return (
+        os.path.basename(feedback.screenshot),
+        data,
+        mimetypes.guess_type(feedback.screenshot)[0] or "application/octet-stream",
+    )
+
+
 def clean(feedback: Feedback) -> None:
-    os.remove(feedback.screenshot)
+    if os.path.exists(feedback.screenshot):
+        os.remove(feedback.screenshot)
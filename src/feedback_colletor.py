@@ -1,24 +1,51 @@
+import os
 import json
+import time
 import logging
 
 import asyncio
 
 import traceback
+from collections import deque
 
 from feedback import (
     Feedback,
     PaFeedback,
     get_feedback_personal_analytics,
-    take_screenshot,
 )
 from feedback_repository import FeedbackRepository
+from capture_worker import AsyncScreenCapture
+from screenshot import ScreenshotArchive
+from deduplication import FrameDeduplicator
+from storage import ScreenshotStorage
+from outbox import UploadOutbox
+from pipeline import PipelineStage
 from timing import TimingService
 from services import SessionService, IamService
 
 
 class FeedbackColletor:
     """This class will take care of collecting the feedback data from the laptop,
-    including both personal analytics and screenshots."""
+    including both personal analytics and screenshots.
+
+    The collection runs as a pipeline, so the capture of a feedback overlaps the
+    upload and the local writes of the previous ones:
+    - capture: the collection loop, paced by the timing service, collects the
+      personal analytics data and the screenshot and checks that the session is
+      still active. The three run concurrently, so an iteration takes as long as
+      the slowest of them instead of their sum
+    - queue: registers the screenshot in the storage and queues the feedback in
+      the outbox. Runs in order, since the outbox uploads in queueing order
+    - persist: saves the feedback in the local database. Runs with
+      PIPELINE_PERSIST_CONCURRENCY workers
+    - upload: the outbox uploader sends the queued feedbacks to the backend
+    Stages are connected by queues of PIPELINE_QUEUE_SIZE feedbacks. When a stage
+    falls behind, the stages feeding it wait for room in its queue.
+    """
+
+    DEFAULT_QUEUE_SIZE = 4
+    DEFAULT_PERSIST_CONCURRENCY = 2
+    HISTORY_SIZE = 10
 
     def __init__(
         self,
@@ -26,6 +53,13 @@ class FeedbackColletor:
         iam_service: IamService,
         repository: FeedbackRepository,
         timing_service: TimingService,
+        screen_capture: AsyncScreenCapture | None = None,
+        screenshot_archive: ScreenshotArchive | None = None,
+        deduplicator: FrameDeduplicator | None = None,
+        storage: ScreenshotStorage | None = None,
+        outbox: UploadOutbox | None = None,
+        queue_size: int | None = None,
+        persist_concurrency: int | None = None,
     ):
         self.session_service = session_service
         self.iam_service = iam_service
@@ -37,8 +71,46 @@ class FeedbackColletor:
         ), "[ FeedbackCollector.start_collecting ] TimingService cannot be None"
         self.repository = repository
         self.timing_service = timing_service
+        # The capture engine (and its encoder process) is created lazily on the
+        # first iteration and reused across iterations. It is closed when the
+        # collection ends and started again by the next one
+        self.screen_capture = screen_capture
+        self.screenshot_archive = screenshot_archive or ScreenshotArchive()
+        self.deduplicator = deduplicator or FrameDeduplicator()
+        # Without a storage manager, archived screenshots are kept forever
+        self.storage = storage
+        # Feedbacks are uploaded in the background, so the collection loop does
+        # not wait for the backend
+        self.outbox = outbox or UploadOutbox()
+
+        if queue_size is None:
+            queue_size = int(
+                os.getenv("PIPELINE_QUEUE_SIZE", FeedbackColletor.DEFAULT_QUEUE_SIZE)
+            )
+        if persist_concurrency is None:
+            persist_concurrency = int(
+                os.getenv(
+                    "PIPELINE_PERSIST_CONCURRENCY",
+                    FeedbackColletor.DEFAULT_PERSIST_CONCURRENCY,
+                )
+            )
+        self.queue_size = queue_size
+        self.persist_concurrency = persist_concurrency
+        self.queue_stage: PipelineStage | None = None
+        self.persist_stage: PipelineStage | None = None
+
+        # Durations of the steps of the current iteration, and how long the recent
+        # iterations took compared to running their steps one after the other
+        self.step_durations: dict[str, float] = {}
+        self.previous_iterations: deque[float] = deque(
+            maxlen=FeedbackColletor.HISTORY_SIZE
+        )
+        self.previous_sequential_iterations: deque[float] = deque(
+            maxlen=FeedbackColletor.HISTORY_SIZE
+        )
 
         self.feedback_count = 0
+        self.session_still_active = False
         self.worker_is_running = False
         self.lock_worker_is_running = asyncio.Lock()
 
@@ -51,7 +123,9 @@ class FeedbackColletor:
 
         Post-conditions:
             - At least 1 feedback was collected
-            - All collected feedbacks were sent to the backend, but no guarantees are made. The collector will try once
+            - All collected feedbacks were queued for upload, and the outbox was given OUTBOX_DRAIN_SECONDS to
+                upload them. The ones the backend did not receive by then stay in the outbox and are uploaded when
+                the collection of the session starts again
             - All collected feedbacks were saved in the local database
             - The session is over
 
@@ -61,12 +135,12 @@ class FeedbackColletor:
                 while it is still running should raise an exception
 
         Uses the timing service to implement the proper collection frequency.
-        Proceeds to the next iteration if the server is not able to respond in time
-        Uses the backend to
-            - Send the data to the server
-            - Receive the computed feedback back
-            - Determine loop condition
+        Uses the outbox to send the data to the server in the background, retrying
+        the uploads that fail. The backend response to the uploads determines the
+        loop condition.
         If there is no active session, the loop should not run
+        If collecting the data of a feedback fails, the iteration is skipped. If the loop fails, the stages and
+            the uploader are stopped all the same, so the collection can be started again.
         Uses the database module to create a local copy of the feedback data that
             is sent to the server.
         """
@@ -75,20 +149,61 @@ class FeedbackColletor:
                 raise RuntimeError()
             self.worker_is_running = True
 
+        try:
+            await self._run_pipeline()
+        finally:
+            # Also when the collection failed, so it can be started again
+            await self._stop_pipeline()
+            async with self.lock_worker_is_running:
+                self.worker_is_running = False
+
+        await self.screenshot_archive.flush()
+        if self.storage is not None:
+            self.storage.schedule_maintenance(self.iam_service.get_iam_session())
+
+        logging.info(
+            "Session worker exited. Initiating personal analytics database dump"
+        )
+
+    async def _run_pipeline(self) -> None:
         # Pre-condition checks
         if self.iam_service.get_iam_session() is None:
             raise AttributeError(
                 "The session object must be set in the backend in order to start feedback collection"
             )
 
-        session_still_active = await self.session_service.is_session_active()
-        if not session_still_active:
+        self.session_still_active = await self.session_service.is_session_active()
+        if not self.session_still_active:
             raise RuntimeError(
                 "A session must be active in order to start feedback collection"
             )
 
+        # Carries on with the seqnums of the feedbacks collected for the session
+        # before a restart, which the outbox may still upload
+        self.feedback_count = await self._get_last_seqnum()
+
+        self.deduplicator.reset()
+        if self.storage is not None:
+            self.storage.schedule_maintenance(self.iam_service.get_iam_session())
+        self.queue_stage = PipelineStage(
+            "queue", self._queue_feedback, queue_size=self.queue_size
+        )
+        self.persist_stage = PipelineStage(
+            "persist",
+            self._persist_feedback,
+            concurrency=self.persist_concurrency,
+            queue_size=self.queue_size,
+        )
+        self.queue_stage.start()
+        self.persist_stage.start()
+        self.outbox.start(
+            self.iam_service.get_iam_session(),
+            self._upload_feedback,
+            self._on_feedbacks_superseded,
+        )
+
         logging.info("Starting worker...")
-        while session_still_active:
+        while self.session_still_active:
             async with self.lock_worker_is_running:
                 if not self.worker_is_running:
                     # Added a new method to stop collection, so now I'm adding this break
@@ -106,57 +221,259 @@ class FeedbackColletor:
             # the whole loop execute once every minute
             self.timing_service.start_iteration()
 
-            feedback = await self._collect_feedback_data()
-
-            logging.info("Sending feedback")
-            logging.info(json.dumps(feedback.model_dump()))
-            try:
-                session_still_active = await self.session_service.ingest_feedback(
-                    feedback
-                )
-            except TimeoutError:
-                logging.error("[ worker ] The server took too long to respond")
-            except Exception as e:
+            self.step_durations = {}
+            iteration_start = time.perf_counter()
+            feedback, session_active = await asyncio.gather(
+                self._collect_feedback_data(),
+                self._check_session_active(),
+                return_exceptions=True,
+            )
+            self._record_iteration(time.perf_counter() - iteration_start)
+            if isinstance(feedback, BaseException):
+                # The next iteration tries again, for instance once personal
+                # analytics can be reached
                 logging.error(
-                    f"[ worker ] Error while sending feedback: {traceback.format_exc()}"
+                    f"[ worker ] Error while collecting the feedback data: {''.join(traceback.format_exception(feedback))}"
                 )
+            else:
+                logging.info(json.dumps(feedback.model_dump()))
+                await self.queue_stage.put(feedback)
+            if not session_active:
+                self.session_still_active = False
+
+            logging.info(f"Session is still active: {self.session_still_active}")
+            logging.info(
+                f"Deduplication stats: {json.dumps(self.deduplicator.get_stats())}"
+            )
+            logging.info(f"Pipeline stats: {json.dumps(self.get_pipeline_stats())}")
 
+            self.timing_service.finish_iteration()
+
+            if not self.session_still_active:
+                logging.info("Session is not active anymore or collection stopped.")
+                break
+
+    async def _stop_pipeline(self) -> None:
+        """Waits until every collected feedback is queued and saved, then stops the
+        stages, gives the outbox drain_seconds to upload what is pending and closes
+        the screen capture."""
+        for stage in [self.queue_stage, self.persist_stage]:
+            if stage is not None:
+                await stage.join()
+        for stage in [self.queue_stage, self.persist_stage]:
+            if stage is not None:
+                await stage.stop()
+        if self.outbox.uploader_task is not None:
+            await self.outbox.drain(self.iam_service.get_iam_session())
+            await self.outbox.stop()
+        if self.screen_capture is not None:
+            # Frees the encoder process and its shared memory between sessions
             try:
-                await self.repository.insert_new(
-                    feedback, self.iam_service.get_iam_session()
-                )
-            except Exception as e:
+                await self.screen_capture.aclose()
+            except Exception:
                 logging.error(
-                    f"[ worker ] Error while saving the feedback locally: {traceback.format_exc()}"
+                    f"[ worker ] Error while closing the screen capture: {traceback.format_exc()}"
                 )
 
-            logging.info(f"Session is still active: {session_still_active}")
+    async def _get_last_seqnum(self) -> int:
+        """Highest seqnum already used in the session, by a saved feedback or by
+        one still waiting in the outbox."""
+        session = self.iam_service.get_iam_session()
+        try:
+            return max(
+                await self.repository.get_last_seqnum(session),
+                await self.outbox.get_last_seqnum(session),
+            )
+        except Exception:
+            logging.error(
+                f"[ worker ] Error while reading the last seqnum of the session: {traceback.format_exc()}"
+            )
+            return self.feedback_count
 
-            self.timing_service.finish_iteration()
+    async def _queue_feedback(self, feedback: Feedback) -> None:
+        # The screenshot is registered before it can be uploaded, since
+        # registering it resets its uploaded flag
+        await self._register_screenshot(feedback)
+        logging.info("Queueing feedback")
+        try:
+            await self.outbox.enqueue(self.iam_service.get_iam_session(), feedback)
+        except Exception as e:
+            logging.error(
+                f"[ worker ] Error while queueing the feedback for upload: {traceback.format_exc()}"
+            )
+            self._request_keyframe()
+        await self.persist_stage.put(feedback)
 
-            if not session_still_active:
-                logging.info("Session is not active anymore or collection stopped.")
-                break
+    async def _persist_feedback(self, feedback: Feedback) -> None:
+        try:
+            await self.repository.insert_new(
+                feedback, self.iam_service.get_iam_session()
+            )
+        except Exception as e:
+            logging.error(
+                f"[ worker ] Error while saving the feedback locally: {traceback.format_exc()}"
+            )
 
-        async with self.lock_worker_is_running:
-            self.worker_is_running = False
+    def get_pipeline_stats(self) -> dict:
+        stats = {
+            "capture": self.get_collection_stats(),
+            "outbox": self.outbox.get_stats(),
+        }
+        for stage in [self.queue_stage, self.persist_stage]:
+            if stage is not None:
+                stats[stage.name] = stage.get_stats()
+        return stats
 
+    def _on_feedbacks_superseded(self, count: int) -> None:
         logging.info(
-            "Session worker exited. Initiating personal analytics database dump"
+            f"[ worker ] The backend is falling behind, {count} feedbacks were superseded by newer ones"
         )
 
+    async def _upload_feedback(self, feedback: Feedback) -> bool:
+        """Called by the outbox uploader. Returns whether the session is still
+        active, and raises when the upload has to be retried."""
+        try:
+            response = await self.session_service.ingest_feedback(feedback)
+        except TimeoutError:
+            logging.error("[ worker ] The server took too long to respond")
+            self._request_keyframe()
+            raise
+        except Exception:
+            self._request_keyframe()
+            raise
+
+        # Only frames the backend actually received can be referenced by the
+        # following unchanged feedbacks
+        if feedback.unchanged_since is None and feedback.screenshot_hash is not None:
+            self.deduplicator.register_upload(
+                feedback.seqnum, feedback.screenshot_hash, feedback.screenshot
+            )
+            await self._mark_screenshot_uploaded(feedback)
+
+        if not response:
+            self.session_still_active = False
+        return bool(response)
+
     async def _collect_feedback_data(self) -> Feedback:
         self.feedback_count += 1
 
-        pa_feedback = await self._get_feedback_personal_analytics()
-        screenshot = take_screenshot()
+        pa_feedback, screenshot = await asyncio.gather(
+            self._timed("personal_analytics", self._get_feedback_personal_analytics()),
+            self._timed("capture", self._get_screen_capture().capture()),
+        )
+        logging.info(
+            f"[ FeedbackCollector._collect_feedback_data ] Capture stats: {json.dumps(self.screen_capture.get_timing_stats())}"
+        )
+
+        unchanged_since = self.deduplicator.find_duplicate(screenshot.phash)
+        if unchanged_since is not None:
+            self.deduplicator.register_skip(len(screenshot.data))
+            # A delta against a frame the backend never received cannot be rebuilt
+            self._request_keyframe()
+            return Feedback(
+                seqnum=self.feedback_count,
+                personal_analytics_data=pa_feedback,
+                screenshot=self.deduplicator.reference_screenshot,
+                screenshot_hash=screenshot.phash,
+                unchanged_since=unchanged_since,
+            )
+
+        self.screenshot_archive.schedule(
+            screenshot.filepath, screenshot.data, screenshot.manifest
+        )
         feedback = Feedback(
             seqnum=self.feedback_count,
             personal_analytics_data=pa_feedback,
-            screenshot=screenshot,
+            screenshot=screenshot.filepath,
+            screenshot_data=screenshot.data,
+            screenshot_hash=screenshot.phash,
+            screenshot_manifest=screenshot.manifest,
         )
         return feedback
 
+    async def _timed(self, step: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.step_durations[step] = time.perf_counter() - start
+
+    async def _check_session_active(self) -> bool:
+        try:
+            return await self._timed(
+                "session_check", self.session_service.is_session_active()
+            )
+        except Exception:
+            # The uploads tell when the session is over if the backend cannot be
+            # reached now
+            logging.error(
+                f"[ worker ] Error while checking if the session is active: {traceback.format_exc()}"
+            )
+            return True
+
+    def _record_iteration(self, seconds: float) -> None:
+        self.previous_iterations.append(seconds)
+        self.previous_sequential_iterations.append(sum(self.step_durations.values()))
+
+    def get_collection_stats(self) -> dict:
+        """Average duration of the concurrent steps of an iteration, and how much
+        shorter it is than running them one after the other."""
+        if len(self.previous_iterations) == 0:
+            return {
+                "average_seconds": None,
+                "average_sequential_seconds": None,
+                "average_saved_seconds": None,
+            }
+        average = sum(self.previous_iterations) / len(self.previous_iterations)
+        average_sequential = sum(self.previous_sequential_iterations) / len(
+            self.previous_sequential_iterations
+        )
+        return {
+            "average_seconds": average,
+            "average_sequential_seconds": average_sequential,
+            "average_saved_seconds": max(average_sequential - average, 0),
+        }
+
+    async def _register_screenshot(self, feedback: Feedback) -> None:
+        if (
+            self.storage is None
+            or not self.screenshot_archive.enabled
+            or feedback.screenshot_data is None
+        ):
+            return
+        try:
+            await self.storage.register(
+                self.iam_service.get_iam_session(),
+                feedback.seqnum,
+                feedback.screenshot,
+                len(feedback.screenshot_data),
+            )
+        except Exception:
+            logging.error(
+                f"[ worker ] Error while registering the screenshot in the storage: {traceback.format_exc()}"
+            )
+
+    async def _mark_screenshot_uploaded(self, feedback: Feedback) -> None:
+        if self.storage is None:
+            return
+        try:
+            await self.storage.mark_uploaded(
+                self.iam_service.get_iam_session(), feedback.seqnum
+            )
+        except Exception:
+            logging.error(
+                f"[ worker ] Error while marking the screenshot as uploaded: {traceback.format_exc()}"
+            )
+
+    def _request_keyframe(self) -> None:
+        if self.screen_capture is not None:
+            self.screen_capture.request_keyframe()
+
+    def _get_screen_capture(self) -> AsyncScreenCapture:
+        if self.screen_capture is None:
+            self.screen_capture = AsyncScreenCapture()
+        return self.screen_capture
+
     def get_feedback_count_for_session(self) -> int:
         return self.feedback_count
 
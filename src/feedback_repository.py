@@ -73,6 +73,21 @@ class FeedbackRepository:
             )
             await db.commit()
 
+    async def get_last_seqnum(self, session: IamSession) -> int:
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    SELECT MAX(seqnum) FROM feedbacks
+                    WHERE student_name = ? AND session_num = ?
+                """,
+                (session.user.username, session.session_num),
+            )
+            (seqnum,) = await response.fetchone()
+        return seqnum or 0
+
     async def get_all(self) -> Feedback:
         if not self.table_was_created:
             await self.create_table_if_not_exists()
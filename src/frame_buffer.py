@@ -0,0 +1,103 @@
+from typing import Callable
+
+import numpy as np
+
+
+class FrameBuffer:
+    """Reusable buffer holding one raw BGRA frame.
+
+    Capture backends write frames straight into the buffer and the encoding stages
+    read them through NumPy views of it, so a frame is not copied between the grab
+    and the encoder. The buffer is only reallocated when a larger frame arrives.
+    The allocator returns a writable buffer of at least the given number of bytes,
+    which lets the buffer live in shared memory.
+    """
+
+    def __init__(
+        self,
+        buffer=None,
+        allocator: Callable[[int], object] | None = bytearray,
+    ) -> None:
+        self.buffer = buffer
+        self.allocator = allocator
+        self.width = 0
+        self.height = 0
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def nbytes(self) -> int:
+        return self.width * self.height * 4
+
+    def set_size(self, width: int, height: int) -> None:
+        nbytes = width * height * 4
+        capacity = 0 if self.buffer is None else len(memoryview(self.buffer))
+        if nbytes > capacity:
+            if self.allocator is None:
+                raise ValueError(
+                    f"[ FrameBuffer.set_size ] Frame of {nbytes} bytes does not fit in {capacity} bytes"
+                )
+            # Dropping the old buffer first lets the allocator release it
+            self.buffer = None
+            self.buffer = self.allocator(nbytes)
+        self.width = width
+        self.height = height
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.buffer).cast("B")[: self.nbytes]
+
+    @property
+    def array(self) -> np.ndarray:
+        """(height, width, 4) view of the BGRA pixels."""
+        return np.frombuffer(self.buffer, dtype=np.uint8, count=self.nbytes).reshape(
+            self.height, self.width, 4
+        )
+
+    def write(self, raw, size: tuple[int, int]) -> None:
+        """Copies a frame grabbed into some other buffer."""
+        self.set_size(*size)
+        self.view[:] = memoryview(raw).cast("B")
+
+
+class BoxDownscaler:
+    """Shrinks frames by an integer factor, averaging each factor x factor block.
+
+    Works on a view of the frame and writes into buffers that are reused across
+    frames, so downscaling does not allocate once the frame size is stable.
+    """
+
+    # Keeps the sum of a block within 16 bits
+    MAX_FACTOR = 16
+
+    def __init__(self) -> None:
+        self.accumulator: np.ndarray | None = None
+        self.output: np.ndarray | None = None
+
+    def _get_buffers(self, shape: tuple) -> tuple[np.ndarray, np.ndarray]:
+        if self.output is None or self.output.shape != shape:
+            self.accumulator = np.empty(shape, dtype=np.uint16)
+            self.output = np.empty(shape, dtype=np.uint8)
+        return self.accumulator, self.output
+
+    def reduce(self, pixels: np.ndarray, factor: int) -> np.ndarray:
+        """Returns a (height // factor, width // factor, channels) array. The result
+        is overwritten by the next call."""
+        factor = min(factor, BoxDownscaler.MAX_FACTOR)
+        if factor <= 1:
+            return pixels
+        height = pixels.shape[0] // factor
+        width = pixels.shape[1] // factor
+        accumulator, output = self._get_buffers((height, width, pixels.shape[2]))
+        accumulator[...] = 0
+        for dy in range(factor):
+            for dx in range(factor):
+                np.add(
+                    accumulator,
+                    pixels[dy : height * factor : factor, dx : width * factor : factor],
+                    out=accumulator,
+                )
+        np.floor_divide(accumulator, factor * factor, out=output, casting="unsafe")
+        return output
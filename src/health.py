@@ -0,0 +1,155 @@
+import os
+import time
+import logging
+
+import asyncio
+
+from http_client import BackendClient, get_backend_client
+
+
+class BackendHealth:
+    """Readiness of a backend, checked in the background.
+
+    The health check runs once the local server is started instead of blocking its
+    startup. It is retried every retry_seconds while the backend is not ready, and
+    repeated every interval_seconds once it is, so a backend that goes down is
+    reported again. The last result is cached and exposed through get_readiness,
+    so the local server can answer the frontend while the backend is slow or
+    unreachable.
+
+    As before, the backend is only checked in production (ENV=PROD). Elsewhere the
+    state stays unknown.
+
+    The intervals are configured through HEALTH_CHECK_RETRY_SECONDS and
+    HEALTH_CHECK_INTERVAL_SECONDS.
+    """
+
+    UNKNOWN = "unknown"
+    READY = "ready"
+    UNAVAILABLE = "unavailable"
+
+    DEFAULT_RETRY_SECONDS = 5
+    DEFAULT_INTERVAL_SECONDS = 60
+
+    def __init__(
+        self,
+        http_client: BackendClient,
+        retry_seconds: float | None = None,
+        interval_seconds: float | None = None,
+        enabled: bool | None = None,
+    ) -> None:
+        if retry_seconds is None:
+            retry_seconds = float(
+                os.getenv(
+                    "HEALTH_CHECK_RETRY_SECONDS", BackendHealth.DEFAULT_RETRY_SECONDS
+                )
+            )
+        if interval_seconds is None:
+            interval_seconds = float(
+                os.getenv(
+                    "HEALTH_CHECK_INTERVAL_SECONDS",
+                    BackendHealth.DEFAULT_INTERVAL_SECONDS,
+                )
+            )
+        if enabled is None:
+            # The session service read ENV and the connection env, which are the
+            # same variable on Windows. The connection defaulted to production.
+            enabled = os.getenv("ENV", os.getenv("env", "PROD")).upper() == "PROD"
+        if retry_seconds <= 0 or interval_seconds <= 0:
+            raise ValueError(
+                "[ BackendHealth.__init__ ] The check intervals have to be positive"
+            )
+        self.http_client = http_client
+        self.retry_seconds = retry_seconds
+        self.interval_seconds = interval_seconds
+        self.enabled = enabled
+        self.state = BackendHealth.UNKNOWN
+        self.error: str | None = None
+        self.checked_at: float | None = None
+        self.probe_task: asyncio.Task | None = None
+
+    def is_ready(self) -> bool:
+        return self.state == BackendHealth.READY
+
+    async def check(self) -> bool:
+        """Runs the health check and caches its result."""
+        try:
+            response = await self.http_client.get(
+                "/health_check", endpoint="health_check"
+            )
+            if response.status_code != 200 or response.json()["status"] != "ok":
+                raise RuntimeError(
+                    f"The health check returned {response.status_code}: {response.text}"
+                )
+        except Exception as e:
+            self.state = BackendHealth.UNAVAILABLE
+            self.error = str(e) or type(e).__name__
+        else:
+            self.state = BackendHealth.READY
+            self.error = None
+        self.checked_at = time.time()
+        return self.is_ready()
+
+    async def _probe(self) -> None:
+        while True:
+            previous_state = self.state
+            if await self.check():
+                if previous_state != BackendHealth.READY:
+                    logging.info(
+                        f"[ BackendHealth._probe ] {self.http_client.base_url} is ready"
+                    )
+                await asyncio.sleep(self.interval_seconds)
+            else:
+                # Logged once per outage, the error stays in the readiness
+                if previous_state != BackendHealth.UNAVAILABLE:
+                    logging.error(
+                        f"[ BackendHealth._probe ] {self.http_client.base_url} is not ready: {self.error}"
+                    )
+                await asyncio.sleep(self.retry_seconds)
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self.probe_task is None or self.probe_task.done():
+            self.probe_task = asyncio.create_task(self._probe())
+
+    async def stop(self) -> None:
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+            await asyncio.gather(self.probe_task, return_exceptions=True)
+            self.probe_task = None
+
+    def get_readiness(self) -> dict:
+        return {
+            "backend": self.http_client.base_url,
+            "state": self.state,
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
+
+
+_backend_healths: dict[str, BackendHealth] = {}
+
+
+def get_backend_health(base_url: str) -> BackendHealth:
+    """Returns the readiness shared by every service that talks to the backend at
+    the given base URL."""
+    if base_url not in _backend_healths:
+        _backend_healths[base_url] = BackendHealth(get_backend_client(base_url))
+    return _backend_healths[base_url]
+
+
+def start_backend_health_checks() -> None:
+    """Starts the health checks in the background. Called when the local server
+    starts."""
+    for health in _backend_healths.values():
+        health.start()
+
+
+async def stop_backend_health_checks() -> None:
+    for health in _backend_healths.values():
+        await health.stop()
+
+
+def get_backend_readiness() -> list[dict]:
+    return [health.get_readiness() for health in _backend_healths.values()]
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import logging
+
+import httpx
+
+from latency import LatencyTracker
+from circuit_breaker import CircuitBreaker
+
+
+class BackendClient:
+    """Long-lived HTTP client for one backend.
+
+    Creating an httpx.AsyncClient per request opens a new TCP connection (and does
+    a new TLS handshake) every time. This class keeps a single client per backend
+    whose connection pool is reused across requests, and counts how many requests
+    could reuse a pooled connection.
+
+    The pool is configured through the following environment variables
+    - BACKEND_MAX_CONNECTIONS: maximum number of open connections (default 10)
+    - BACKEND_KEEPALIVE_SECONDS: how long an idle connection is kept (default 30)
+    - BACKEND_HTTP2: multiplexes the requests over a single HTTP/2 connection when
+      set to true. Requires the h2 package (httpx[http2]); HTTP/1.1 is used when
+      it is not installed
+
+    Requests that name their endpoint get timeouts adapted to the latencies
+    observed for it (see LatencyTracker), the timeout given by the caller being
+    used until enough latencies were observed. The connect timeout adapts to the
+    observed connection latencies in the same way.
+
+    Every request goes through a circuit breaker (see CircuitBreaker): while the
+    backend is down, requests fail right away with a CircuitOpenError instead of
+    waiting for their timeout. Transport errors and 5xx responses count as
+    failures.
+    """
+
+    DEFAULT_MAX_CONNECTIONS = 10
+    DEFAULT_KEEPALIVE_SECONDS = 30
+    # Default timeout of httpx
+    DEFAULT_TIMEOUT_SECONDS = 5
+    CONNECT_ENDPOINT = "connect"
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int | None = None,
+        keepalive_seconds: float | None = None,
+        http2: bool | None = None,
+    ) -> None:
+        if max_connections is None:
+            max_connections = int(
+                os.getenv(
+                    "BACKEND_MAX_CONNECTIONS", BackendClient.DEFAULT_MAX_CONNECTIONS
+                )
+            )
+        if keepalive_seconds is None:
+            keepalive_seconds = float(
+                os.getenv(
+                    "BACKEND_KEEPALIVE_SECONDS", BackendClient.DEFAULT_KEEPALIVE_SECONDS
+                )
+            )
+        if http2 is None:
+            http2 = os.getenv("BACKEND_HTTP2", "false").lower() == "true"
+        if max_connections <= 0:
+            raise ValueError(
+                "[ BackendClient.__init__ ] The maximum number of connections has to be positive"
+            )
+        if keepalive_seconds < 0:
+            raise ValueError(
+                "[ BackendClient.__init__ ] The keep-alive duration cannot be negative"
+            )
+        if http2:
+            try:
+                import h2
+            except ImportError:
+                logging.error(
+                    "[ BackendClient.__init__ ] HTTP/2 was requested but the h2 package is not installed, using HTTP/1.1"
+                )
+                http2 = False
+
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.keepalive_seconds = keepalive_seconds
+        self.http2 = http2
+        self.client: httpx.AsyncClient | None = None
+        self.latency = LatencyTracker()
+        self.circuit_breaker = CircuitBreaker()
+
+        self.request_count = 0
+        self.connection_count = 0
+        self.http_versions: dict[str, int] = {}
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Returns the pooled client, creating it on first use."""
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_seconds,
+                ),
+                event_hooks={
+                    "request": [self._on_request],
+                    "response": [self._on_response],
+                },
+            )
+        return self.client
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self.request_count += 1
+        connect_started_at = None
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal connect_started_at
+            # httpcore only connects when no pooled connection is available
+            if event_name == "connection.connect_tcp.started":
+                self.connection_count += 1
+                connect_started_at = time.perf_counter()
+            elif event_name == "connection.connect_tcp.complete":
+                self.latency.record(
+                    BackendClient.CONNECT_ENDPOINT,
+                    time.perf_counter() - connect_started_at,
+                )
+
+        request.extensions["trace"] = trace
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        self.http_versions[response.http_version] = (
+            self.http_versions.get(response.http_version, 0) + 1
+        )
+
+    async def request(
+        self, method: str, url: str, endpoint: str | None = None, **kwargs
+    ) -> httpx.Response:
+        self.circuit_breaker.before_call()
+        try:
+            response = await self._send(method, url, endpoint, **kwargs)
+        except httpx.TransportError:
+            self.circuit_breaker.on_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.release()
+            raise
+        if response.status_code >= 500:
+            self.circuit_breaker.on_failure()
+        else:
+            self.circuit_breaker.on_success()
+        return response
+
+    async def _send(
+        self, method: str, url: str, endpoint: str | None, **kwargs
+    ) -> httpx.Response:
+        if endpoint is None:
+            return await self.get_client().request(method, url, **kwargs)
+
+        timeout = self.latency.get_timeout(
+            endpoint, kwargs.pop("timeout", BackendClient.DEFAULT_TIMEOUT_SECONDS)
+        )
+        connect_timeout = min(
+            self.latency.get_timeout(BackendClient.CONNECT_ENDPOINT, timeout), timeout
+        )
+        start = time.perf_counter()
+        try:
+            response = await self.get_client().request(
+                method,
+                url,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                **kwargs,
+            )
+        except httpx.ConnectTimeout:
+            self.latency.record_timeout(BackendClient.CONNECT_ENDPOINT)
+            raise
+        except httpx.TimeoutException:
+            self.latency.record_timeout(endpoint)
+            raise
+        self.latency.record(endpoint, time.perf_counter() - start)
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def get_stats(self) -> dict:
+        return {
+            "request_count": self.request_count,
+            "connection_count": self.connection_count,
+            # Fraction of the requests sent over an already open connection
+            "connection_reuse_rate": (
+                1 - min(self.connection_count, self.request_count) / self.request_count
+                if self.request_count > 0
+                else None
+            ),
+            "http_versions": self.http_versions,
+            "latency": self.latency.get_stats(),
+            "circuit_breaker": self.circuit_breaker.get_stats(),
+        }
+
+    async def aclose(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            logging.info(
+                f"[ BackendClient.aclose ] Closed the client for {self.base_url}: {json.dumps(self.get_stats())}"
+            )
+
+
+_backend_clients: dict[str, BackendClient] = {}
+
+
+def get_backend_client(base_url: str) -> BackendClient:
+    """Returns the client shared by every service that talks to the backend at the
+    given base URL."""
+    if base_url not in _backend_clients:
+        _backend_clients[base_url] = BackendClient(base_url)
+    return _backend_clients[base_url]
+
+
+async def close_backend_clients() -> None:
+    """Closes the pooled connections. Called when the local server shuts down."""
+    for client in _backend_clients.values():
+        await client.aclose()
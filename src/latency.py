@@ -0,0 +1,149 @@
+import os
+import math
+from collections import deque
+
+
+class LatencyTracker:
+    """Latency distribution of the recent requests of each endpoint, used to set
+    the request timeouts.
+
+    Every endpoint keeps a sliding window of its latest latencies. Once an endpoint
+    has enough samples, its timeout is its p99 times a multiplier, kept within the
+    configured bounds. Until then, the timeout the caller gives is used. Requests
+    that timed out are only counted: recording the timeout as their latency would
+    make every timeout raise the next one, so the waits would keep growing while
+    the backend is down. So that the timeout still catches up when the latencies
+    rise above it, every backoff_after timeouts in a row double the adaptive
+    timeout of the endpoint, up to the maximum, until a request completes again.
+
+    The tracker is configured through the following environment variables
+    - LATENCY_WINDOW_SIZE: number of latencies kept per endpoint (default 200)
+    - LATENCY_MIN_SAMPLES: samples needed before adapting the timeout (default 20)
+    - LATENCY_TIMEOUT_MULTIPLIER: multiplier applied to the p99 (default 2)
+    - LATENCY_MIN_TIMEOUT_SECONDS, LATENCY_MAX_TIMEOUT_SECONDS: bounds of the
+      adaptive timeouts (default 1 and 60)
+    - LATENCY_BACKOFF_AFTER: timeouts in a row that double the timeout (default 3)
+    """
+
+    DEFAULT_WINDOW_SIZE = 200
+    DEFAULT_MIN_SAMPLES = 20
+    DEFAULT_TIMEOUT_MULTIPLIER = 2
+    DEFAULT_MIN_TIMEOUT_SECONDS = 1
+    DEFAULT_MAX_TIMEOUT_SECONDS = 60
+    DEFAULT_BACKOFF_AFTER = 3
+
+    PERCENTILES = [50, 95, 99]
+
+    def __init__(
+        self,
+        window_size: int | None = None,
+        min_samples: int | None = None,
+        timeout_multiplier: float | None = None,
+        min_timeout_seconds: float | None = None,
+        max_timeout_seconds: float | None = None,
+        backoff_after: int | None = None,
+    ) -> None:
+        if window_size is None:
+            window_size = int(
+                os.getenv("LATENCY_WINDOW_SIZE", LatencyTracker.DEFAULT_WINDOW_SIZE)
+            )
+        if min_samples is None:
+            min_samples = int(
+                os.getenv("LATENCY_MIN_SAMPLES", LatencyTracker.DEFAULT_MIN_SAMPLES)
+            )
+        if timeout_multiplier is None:
+            timeout_multiplier = float(
+                os.getenv(
+                    "LATENCY_TIMEOUT_MULTIPLIER",
+                    LatencyTracker.DEFAULT_TIMEOUT_MULTIPLIER,
+                )
+            )
+        if min_timeout_seconds is None:
+            min_timeout_seconds = float(
+                os.getenv(
+                    "LATENCY_MIN_TIMEOUT_SECONDS",
+                    LatencyTracker.DEFAULT_MIN_TIMEOUT_SECONDS,
+                )
+            )
+        if max_timeout_seconds is None:
+            max_timeout_seconds = float(
+                os.getenv(
+                    "LATENCY_MAX_TIMEOUT_SECONDS",
+                    LatencyTracker.DEFAULT_MAX_TIMEOUT_SECONDS,
+                )
+            )
+        if backoff_after is None:
+            backoff_after = int(
+                os.getenv("LATENCY_BACKOFF_AFTER", LatencyTracker.DEFAULT_BACKOFF_AFTER)
+            )
+        if window_size <= 0 or min_samples <= 0 or min_samples > window_size:
+            raise ValueError(
+                "[ LatencyTracker.__init__ ] The minimum number of samples has to be positive and fit in the window"
+            )
+        if timeout_multiplier < 1:
+            raise ValueError(
+                "[ LatencyTracker.__init__ ] The timeout multiplier has to be at least 1"
+            )
+        if min_timeout_seconds <= 0 or max_timeout_seconds < min_timeout_seconds:
+            raise ValueError(
+                "[ LatencyTracker.__init__ ] The timeout bounds have to be positive and ordered"
+            )
+        if backoff_after <= 0:
+            raise ValueError(
+                "[ LatencyTracker.__init__ ] The number of timeouts before backing off has to be positive"
+            )
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout_seconds = min_timeout_seconds
+        self.max_timeout_seconds = max_timeout_seconds
+        self.backoff_after = backoff_after
+
+        self.latencies: dict[str, deque[float]] = {}
+        self.timeout_counts: dict[str, int] = {}
+        self.consecutive_timeouts: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float) -> None:
+        if endpoint not in self.latencies:
+            self.latencies[endpoint] = deque(maxlen=self.window_size)
+        self.latencies[endpoint].append(seconds)
+        self.consecutive_timeouts[endpoint] = 0
+
+    def record_timeout(self, endpoint: str) -> None:
+        self.timeout_counts[endpoint] = self.timeout_counts.get(endpoint, 0) + 1
+        self.consecutive_timeouts[endpoint] = (
+            self.consecutive_timeouts.get(endpoint, 0) + 1
+        )
+
+    def get_percentile(self, endpoint: str, percentile: float) -> float | None:
+        """Nearest-rank percentile of the latencies in the window."""
+        latencies = self.latencies.get(endpoint)
+        if latencies is None or len(latencies) == 0:
+            return None
+        ordered = sorted(latencies)
+        rank = max(math.ceil(percentile / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+    def get_timeout(self, endpoint: str, default: float) -> float:
+        latencies = self.latencies.get(endpoint)
+        if latencies is None or len(latencies) < self.min_samples:
+            return default
+        timeout = self.get_percentile(endpoint, 99) * self.timeout_multiplier
+        # The latencies may have risen above the timeout, no longer recording any.
+        # Past 32 doublings the timeout is at its maximum anyway
+        doublings = self.consecutive_timeouts.get(endpoint, 0) // self.backoff_after
+        timeout *= 2 ** min(doublings, 32)
+        return min(max(timeout, self.min_timeout_seconds), self.max_timeout_seconds)
+
+    def get_stats(self) -> dict:
+        return {
+            endpoint: {
+                "count": len(self.latencies.get(endpoint, [])),
+                "timeout_count": self.timeout_counts.get(endpoint, 0),
+                **{
+                    f"p{percentile}": self.get_percentile(endpoint, percentile)
+                    for percentile in LatencyTracker.PERCENTILES
+                },
+            }
+            for endpoint in self.latencies | self.timeout_counts
+        }
@@ -1,5 +1,6 @@
 import os
 import asyncio
+import multiprocessing
 
 import logging
 
@@ -16,6 +17,8 @@ from feedback_repository import FeedbackRepository
 from connection import Connection
 
 from feedback_colletor import FeedbackColletor
+from screenshot import get_screenshot_dir
+from storage import ScreenshotStorage
 from services import SessionService, IamService
 from browser_service import BrowserService
 from timing import TimingService
@@ -53,7 +56,11 @@ def main():
     iam_service = IamService()
     app = create_app(
         FeedbackColletor(
-            session_service, iam_service, FeedbackRepository(), TimingService()
+            session_service,
+            iam_service,
+            FeedbackRepository(),
+            TimingService(),
+            storage=ScreenshotStorage(get_screenshot_dir()),
         ),
         BrowserService(session_service),
     )
@@ -68,4 +75,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required for the screenshot encoder process in the PyInstaller build
+    multiprocessing.freeze_support()
     main()
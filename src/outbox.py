@@ -0,0 +1,552 @@
+import os
+import time
+import random
+import logging
+import traceback
+from typing import Awaitable, Callable
+
+import asyncio
+import httpx
+import aiosqlite
+
+from feedback import Feedback
+from screenshot import EncodingOptions
+from session import IamSession
+
+
+class UploadOutbox:
+    """Durable queue of the feedbacks waiting to be uploaded to the backend.
+
+    The collection loop only enqueues feedbacks, which are written to the local
+    database together with their screenshot. A background uploader sends them to
+    the backend oldest first and deletes them once the backend received them, so
+    the capture cadence does not depend on the backend latency. A failed upload is
+    retried with exponential backoff and full jitter: the n-th retry waits a random
+    time between 0 and min(max delay, base delay * 2^n). The order is kept, since
+    delta encoded screenshots and unchanged feedbacks refer to earlier ones.
+
+    The feedbacks of the current session that were not uploaded before the process
+    stopped are uploaded when the collection starts again. Feedbacks are delivered
+    at least once: an upload interrupted after the backend received it is sent
+    again. Pending feedbacks of other sessions are dropped once they are older than
+    the maximum age, since the backend only ingests feedbacks for the active
+    session.
+
+    When the backend falls behind, uploading in order means the feedback the
+    student sees is based on ever older screenshots. With latest wins scheduling
+    (OUTBOX_LATEST_WINS, off by default) only the newest pending feedback is kept in
+    the real-time lane. The older ones are superseded: they are demoted to the
+    backfill lane, which is only uploaded (oldest first) when there is no real-time
+    feedback pending, or dropped when OUTBOX_BACKFILL is false. An upload in flight,
+    real-time or backfill, is interrupted as soon as a new feedback is queued, and
+    the interrupted real-time feedback is superseded too. Latest wins cannot
+    be enabled together with delta encoded screenshots (SCREENSHOT_DELTA), since a
+    delta would then reach the backend before, or without, the frame it is based
+    on.
+
+    A feedback the backend rejects (a 4xx response other than 408 and 429) would
+    fail on every retry and, since the order is kept, hold back every later
+    feedback of the session. It is moved to the dead letter lane right away, as is
+    a feedback that failed OUTBOX_MAX_ATTEMPTS times. Dead letters are never
+    uploaded and are dropped with the other feedbacks of their session once they
+    expire.
+
+    When the collection of a session ends, drain gives the uploader up to
+    OUTBOX_DRAIN_SECONDS to send the feedbacks still pending before it is stopped.
+
+    The retries are configured through OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS and OUTBOX_MAX_AGE_HOURS.
+    """
+
+    REALTIME_LANE = 0
+    BACKFILL_LANE = 1
+    DEAD_LETTER_LANE = 2
+
+    DEFAULT_RETRY_BASE_SECONDS = 1
+    DEFAULT_RETRY_MAX_SECONDS = 60
+    DEFAULT_MAX_AGE_HOURS = 24
+    DEFAULT_DRAIN_SECONDS = 30
+    DEFAULT_MAX_ATTEMPTS = 10
+    DRAIN_POLL_SECONDS = 0.1
+
+    def __init__(
+        self,
+        retry_base_seconds: float | None = None,
+        retry_max_seconds: float | None = None,
+        max_age_seconds: float | None = None,
+        latest_wins: bool | None = None,
+        backfill: bool | None = None,
+        drain_seconds: float | None = None,
+        max_attempts: int | None = None,
+    ) -> None:
+        self.db_path = os.getenv("SQLITE_DB_PATH", None)
+        if self.db_path is None:
+            raise ValueError(
+                "[ UploadOutbox ] The database path was not set in the environment variables"
+            )
+        if retry_base_seconds is None:
+            retry_base_seconds = float(
+                os.getenv(
+                    "OUTBOX_RETRY_BASE_SECONDS", UploadOutbox.DEFAULT_RETRY_BASE_SECONDS
+                )
+            )
+        if retry_max_seconds is None:
+            retry_max_seconds = float(
+                os.getenv(
+                    "OUTBOX_RETRY_MAX_SECONDS", UploadOutbox.DEFAULT_RETRY_MAX_SECONDS
+                )
+            )
+        if max_age_seconds is None:
+            max_age_seconds = (
+                float(
+                    os.getenv(
+                        "OUTBOX_MAX_AGE_HOURS", UploadOutbox.DEFAULT_MAX_AGE_HOURS
+                    )
+                )
+                * 60
+                * 60
+            )
+        if latest_wins is None:
+            latest_wins = os.getenv("OUTBOX_LATEST_WINS", "false").lower() == "true"
+        if backfill is None:
+            backfill = os.getenv("OUTBOX_BACKFILL", "true").lower() != "false"
+        if latest_wins and EncodingOptions.from_env().delta:
+            raise ValueError(
+                "[ UploadOutbox ] Latest wins scheduling cannot be enabled with delta encoded screenshots"
+            )
+        if drain_seconds is None:
+            drain_seconds = float(
+                os.getenv("OUTBOX_DRAIN_SECONDS", UploadOutbox.DEFAULT_DRAIN_SECONDS)
+            )
+        if max_attempts is None:
+            max_attempts = int(
+                os.getenv("OUTBOX_MAX_ATTEMPTS", UploadOutbox.DEFAULT_MAX_ATTEMPTS)
+            )
+        if max_attempts <= 0:
+            raise ValueError(
+                "[ UploadOutbox ] The maximum number of attempts has to be positive"
+            )
+        if (
+            retry_base_seconds < 0
+            or retry_max_seconds < 0
+            or max_age_seconds < 0
+            or drain_seconds < 0
+        ):
+            raise ValueError("[ UploadOutbox ] The delays cannot be negative")
+
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_age_seconds = max_age_seconds
+        self.latest_wins = latest_wins
+        self.backfill = backfill
+        self.drain_seconds = drain_seconds
+        self.max_attempts = max_attempts
+
+        self.table_was_created = False
+        self.wakeup = asyncio.Event()
+        self.uploader_task: asyncio.Task | None = None
+
+        self.enqueued_count = 0
+        self.uploaded_count = 0
+        self.retry_count = 0
+        self.expired_count = 0
+        self.superseded_count = 0
+        self.dropped_count = 0
+        self.preempted_count = 0
+        self.backfill_uploaded_count = 0
+        self.dead_letter_count = 0
+
+    async def create_table_if_not_exists(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("""
+                    CREATE TABLE IF NOT EXISTS feedback_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        student_name TEXT,
+                        session_num INTEGER,
+                        feedback TEXT,
+                        screenshot_data BLOB,
+                        lane INTEGER,
+                        attempts INTEGER,
+                        next_attempt_at REAL,
+                        created_at REAL
+                    );
+                """)
+            await db.commit()
+        self.table_was_created = True
+
+    def get_retry_delay(self, attempts: int) -> float:
+        """Full jitter backoff: spreads the retries of clients that failed at the
+        same time, for instance during a backend outage."""
+        ceiling = min(
+            self.retry_max_seconds, self.retry_base_seconds * 2 ** min(attempts, 32)
+        )
+        return random.uniform(0, ceiling)
+
+    async def enqueue(self, session: IamSession, feedback: Feedback) -> None:
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """
+                    INSERT INTO feedback_outbox (
+                        student_name, session_num, feedback, screenshot_data,
+                        lane, attempts, next_attempt_at, created_at
+                    ) VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                """,
+                (
+                    session.user.username,
+                    session.session_num,
+                    feedback.model_dump_json(),
+                    feedback.screenshot_data,
+                    UploadOutbox.REALTIME_LANE,
+                    now,
+                    now,
+                ),
+            )
+            await db.commit()
+        self.enqueued_count += 1
+        self.wakeup.set()
+
+    async def supersede(self, session: IamSession) -> int:
+        """Demotes (or drops) every real-time feedback of the session but the
+        newest. Returns how many were superseded."""
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    SELECT id FROM feedback_outbox
+                    WHERE student_name = ? AND session_num IS ? AND lane = ?
+                    ORDER BY id DESC
+                    LIMIT -1 OFFSET 1
+                """,
+                (
+                    session.user.username,
+                    session.session_num,
+                    UploadOutbox.REALTIME_LANE,
+                ),
+            )
+            ids = [(row[0],) for row in await response.fetchall()]
+            if len(ids) == 0:
+                return 0
+            if self.backfill:
+                await db.executemany(
+                    f"""
+                        UPDATE feedback_outbox SET lane = {UploadOutbox.BACKFILL_LANE}
+                        WHERE id = ?
+                    """,
+                    ids,
+                )
+            else:
+                await db.executemany("DELETE FROM feedback_outbox WHERE id = ?", ids)
+                self.dropped_count += len(ids)
+            await db.commit()
+        self.superseded_count += len(ids)
+        return len(ids)
+
+    async def peek(
+        self, session: IamSession
+    ) -> tuple[int, Feedback, int, int, float] | None:
+        """Returns the id, feedback, lane, attempts and next attempt time of the
+        next feedback of the session to upload, or None if there is none. The
+        real-time lane goes first, dead letters are left out."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    SELECT id, feedback, screenshot_data, lane, attempts, next_attempt_at
+                    FROM feedback_outbox
+                    WHERE student_name = ? AND session_num IS ? AND lane != ?
+                    ORDER BY lane, id
+                    LIMIT 1
+                """,
+                (
+                    session.user.username,
+                    session.session_num,
+                    UploadOutbox.DEAD_LETTER_LANE,
+                ),
+            )
+            row = await response.fetchone()
+        if row is None:
+            return None
+        entry_id, feedback_json, screenshot_data, lane, attempts, next_attempt_at = row
+        feedback = Feedback.model_validate_json(feedback_json)
+        feedback.screenshot_data = screenshot_data
+        return entry_id, feedback, lane, attempts, next_attempt_at
+
+    async def count_pending(self, session: IamSession | None = None) -> int:
+        """Number of feedbacks still to upload, dead letters left out."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            if session is None:
+                response = await db.execute(
+                    "SELECT COUNT(*) FROM feedback_outbox WHERE lane != ?",
+                    (UploadOutbox.DEAD_LETTER_LANE,),
+                )
+            else:
+                response = await db.execute(
+                    """
+                        SELECT COUNT(*) FROM feedback_outbox
+                        WHERE student_name = ? AND session_num IS ? AND lane != ?
+                    """,
+                    (
+                        session.user.username,
+                        session.session_num,
+                        UploadOutbox.DEAD_LETTER_LANE,
+                    ),
+                )
+            (count,) = await response.fetchone()
+        return count
+
+    async def get_last_seqnum(self, session: IamSession) -> int:
+        """Highest seqnum of the pending feedbacks of the session, 0 if none."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    SELECT MAX(json_extract(feedback, '$.seqnum')) FROM feedback_outbox
+                    WHERE student_name = ? AND session_num IS ?
+                """,
+                (session.user.username, session.session_num),
+            )
+            (seqnum,) = await response.fetchone()
+        return seqnum or 0
+
+    async def remove(self, entry_id: int) -> None:
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("DELETE FROM feedback_outbox WHERE id = ?", (entry_id,))
+            await db.commit()
+
+    async def reschedule(self, entry_id: int, attempts: int) -> float:
+        """Records a failed attempt. Returns the time to wait before the retry."""
+        delay = self.get_retry_delay(attempts)
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """
+                    UPDATE feedback_outbox SET attempts = ?, next_attempt_at = ?
+                    WHERE id = ?
+                """,
+                (attempts + 1, time.time() + delay, entry_id),
+            )
+            await db.commit()
+        return delay
+
+    async def dead_letter(self, entry_id: int) -> None:
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE feedback_outbox SET lane = ? WHERE id = ?",
+                (UploadOutbox.DEAD_LETTER_LANE, entry_id),
+            )
+            await db.commit()
+        self.dead_letter_count += 1
+
+    @staticmethod
+    def is_rejected(error: Exception) -> bool:
+        """Whether the backend rejected the feedback, so retrying cannot help."""
+        return (
+            isinstance(error, httpx.HTTPStatusError)
+            and 400 <= error.response.status_code < 500
+            and error.response.status_code not in (408, 429)
+        )
+
+    async def expire(self, current_session: IamSession) -> None:
+        """Drops the pending feedbacks of other sessions that are too old to be of
+        any use."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    DELETE FROM feedback_outbox
+                    WHERE created_at < ?
+                    AND NOT (student_name = ? AND session_num IS ?)
+                """,
+                (
+                    time.time() - self.max_age_seconds,
+                    current_session.user.username,
+                    current_session.session_num,
+                ),
+            )
+            await db.commit()
+        if response.rowcount > 0:
+            self.expired_count += response.rowcount
+            logging.info(
+                f"[ UploadOutbox.expire ] Dropped {response.rowcount} feedbacks of previous sessions"
+            )
+
+    async def _wait_for_enqueue(self, timeout: float) -> bool:
+        """Sleeps until the timeout or until a feedback is queued. Returns whether a
+        feedback was queued."""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _upload_preemptible(
+        self, upload: Callable[[Feedback], Awaitable[bool]], feedback: Feedback
+    ) -> bool | None:
+        """Uploads a feedback, giving up as soon as a newer feedback is queued.
+        Returns None if the upload was interrupted."""
+        upload_task = asyncio.create_task(upload(feedback))
+        wakeup_task = asyncio.create_task(self.wakeup.wait())
+        try:
+            await asyncio.wait(
+                {upload_task, wakeup_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            wakeup_task.cancel()
+            if not upload_task.done():
+                upload_task.cancel()
+                try:
+                    await upload_task
+                except asyncio.CancelledError:
+                    pass
+        if upload_task.cancelled():
+            return None
+        return upload_task.result()
+
+    async def run_uploader(
+        self,
+        session: IamSession,
+        upload: Callable[[Feedback], Awaitable[bool]],
+        on_superseded: Callable[[int], None] | None = None,
+    ) -> None:
+        """Uploads the pending feedbacks of the session until it is stopped, or
+        until upload returns False (the session is over). on_superseded is called
+        with the number of feedbacks that lost their place in the real-time lane."""
+        await self.expire(session)
+        while True:
+            # Cleared before looking for work, so an enqueue that happens while
+            # looking is not missed
+            self.wakeup.clear()
+            try:
+                if self.latest_wins:
+                    superseded = await self.supersede(session)
+                    if superseded > 0 and on_superseded is not None:
+                        on_superseded(superseded)
+                entry = await self.peek(session)
+            except Exception:
+                logging.error(
+                    f"[ UploadOutbox.run_uploader ] Could not read the outbox: {traceback.format_exc()}"
+                )
+                await asyncio.sleep(self.retry_max_seconds)
+                continue
+            if entry is None:
+                await self.wakeup.wait()
+                continue
+
+            entry_id, feedback, lane, attempts, next_attempt_at = entry
+            delay = next_attempt_at - time.time()
+            if delay > 0:
+                # A newer feedback supersedes the one waiting for its retry
+                if await self._wait_for_enqueue(delay) and self.latest_wins:
+                    continue
+                if time.time() < next_attempt_at:
+                    await asyncio.sleep(next_attempt_at - time.time())
+
+            try:
+                if self.latest_wins or lane == UploadOutbox.BACKFILL_LANE:
+                    keep_uploading = await self._upload_preemptible(upload, feedback)
+                    if keep_uploading is None:
+                        self.preempted_count += 1
+                        continue
+                else:
+                    keep_uploading = await upload(feedback)
+            except Exception as e:
+                if UploadOutbox.is_rejected(e) or attempts + 1 >= self.max_attempts:
+                    logging.error(
+                        f"[ UploadOutbox.run_uploader ] Upload of feedback {feedback.seqnum} failed (attempt {attempts + 1}), giving up on it: {traceback.format_exc()}"
+                    )
+                    await self.dead_letter(entry_id)
+                    continue
+                self.retry_count += 1
+                delay = await self.reschedule(entry_id, attempts)
+                logging.error(
+                    f"[ UploadOutbox.run_uploader ] Upload of feedback {feedback.seqnum} failed (attempt {attempts + 1}), retrying in {delay:.1f} seconds: {traceback.format_exc()}"
+                )
+                continue
+
+            self.uploaded_count += 1
+            if lane == UploadOutbox.BACKFILL_LANE:
+                self.backfill_uploaded_count += 1
+            try:
+                await self.remove(entry_id)
+            except Exception:
+                # The feedback is sent again on the next attempt
+                logging.error(
+                    f"[ UploadOutbox.run_uploader ] Could not remove feedback {feedback.seqnum} from the outbox: {traceback.format_exc()}"
+                )
+            if not keep_uploading:
+                break
+
+    def start(
+        self,
+        session: IamSession,
+        upload: Callable[[Feedback], Awaitable[bool]],
+        on_superseded: Callable[[int], None] | None = None,
+    ) -> None:
+        if self.uploader_task is not None and not self.uploader_task.done():
+            raise RuntimeError("[ UploadOutbox.start ] The uploader is already running")
+        self.uploader_task = asyncio.create_task(
+            self.run_uploader(session, upload, on_superseded)
+        )
+
+    async def drain(self, session: IamSession, timeout: float | None = None) -> bool:
+        """Waits until the uploader sent every pending feedback of the session,
+        exited or the timeout (drain_seconds by default) elapsed. Returns whether
+        nothing is left to upload."""
+        if timeout is None:
+            timeout = self.drain_seconds
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = await self.count_pending(session)
+            if pending == 0:
+                return True
+            remaining = deadline - time.monotonic()
+            if (
+                self.uploader_task is None
+                or self.uploader_task.done()
+                or remaining <= 0
+            ):
+                logging.info(
+                    f"[ UploadOutbox.drain ] {pending} feedbacks of the session are still pending"
+                )
+                return False
+            await asyncio.sleep(min(UploadOutbox.DRAIN_POLL_SECONDS, remaining))
+
+    async def stop(self) -> None:
+        """Stops the uploader. Feedbacks that were not uploaded stay in the outbox
+        for the next run."""
+        if self.uploader_task is None:
+            return
+        self.uploader_task.cancel()
+        try:
+            await self.uploader_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logging.error(
+                f"[ UploadOutbox.stop ] The uploader failed: {traceback.format_exc()}"
+            )
+        self.uploader_task = None
+
+    def get_stats(self) -> dict:
+        return {
+            "enqueued_count": self.enqueued_count,
+            "uploaded_count": self.uploaded_count,
+            "retry_count": self.retry_count,
+            "expired_count": self.expired_count,
+            "superseded_count": self.superseded_count,
+            "dropped_count": self.dropped_count,
+            "preempted_count": self.preempted_count,
+            "backfill_uploaded_count": self.backfill_uploaded_count,
+            "dead_letter_count": self.dead_letter_count,
+        }
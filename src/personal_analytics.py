@@ -1,3 +1,4 @@
+import time
 import logging
 
 import traceback
@@ -22,11 +23,121 @@ class PersonalAnalyticsData(BaseModel):
     scrollDelta: float
 
 
+class PersonalAnalyticsClient:
+    """Client of the PersonalAnalytics service running on the laptop.
+
+    A single connection is kept open to the service instead of opening one per
+    request. Whether the service is available is cached for a short time, so the
+    frontend can check it often without reaching the service every time.
+
+    The client is configured through the following environment variables
+    - PA_URL: address of the service (default http://localhost:57827)
+    - PA_TIMEOUT_SECONDS: timeout of the requests (default 5)
+    - PA_STATUS_TTL_SECONDS: how long the availability is cached (default 2)
+    """
+
+    DEFAULT_URL = "http://localhost:57827"
+    DEFAULT_TIMEOUT_SECONDS = 5
+    DEFAULT_STATUS_TTL_SECONDS = 2
+
+    def __init__(
+        self,
+        url: str | None = None,
+        timeout_seconds: float | None = None,
+        status_ttl_seconds: float | None = None,
+    ) -> None:
+        if url is None:
+            url = os.getenv("PA_URL", PersonalAnalyticsClient.DEFAULT_URL)
+        if timeout_seconds is None:
+            timeout_seconds = float(
+                os.getenv(
+                    "PA_TIMEOUT_SECONDS",
+                    PersonalAnalyticsClient.DEFAULT_TIMEOUT_SECONDS,
+                )
+            )
+        if status_ttl_seconds is None:
+            status_ttl_seconds = float(
+                os.getenv(
+                    "PA_STATUS_TTL_SECONDS",
+                    PersonalAnalyticsClient.DEFAULT_STATUS_TTL_SECONDS,
+                )
+            )
+        if timeout_seconds <= 0:
+            raise ValueError(
+                "[ PersonalAnalyticsClient.__init__ ] The timeout has to be positive"
+            )
+        if status_ttl_seconds < 0:
+            raise ValueError(
+                "[ PersonalAnalyticsClient.__init__ ] The status TTL cannot be negative"
+            )
+        self.url = url
+        self.timeout_seconds = timeout_seconds
+        self.status_ttl_seconds = status_ttl_seconds
+        self.client: httpx.AsyncClient | None = None
+
+        self.available: bool | None = None
+        self.checked_at: float | None = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+            )
+        return self.client
+
+    def _set_available(self, available: bool) -> None:
+        self.available = available
+        self.checked_at = time.monotonic()
+
+    async def get_data(self) -> PersonalAnalyticsData:
+        try:
+            response = await self.get_client().get("/intervention_status")
+        except httpx.HTTPError:
+            self._set_available(False)
+            raise
+        self._set_available(True)
+        return PersonalAnalyticsData(**response.json())
+
+    async def is_available(self) -> bool:
+        if (
+            self.checked_at is not None
+            and time.monotonic() - self.checked_at < self.status_ttl_seconds
+        ):
+            return self.available
+        try:
+            await self.get_client().get("/intervention_status")
+        except Exception:
+            # Whatever went wrong, /checkPA answers with a bool
+            self._set_available(False)
+        else:
+            self._set_available(True)
+        return self.available
+
+    async def aclose(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+_personal_analytics_client: PersonalAnalyticsClient | None = None
+
+
+def get_personal_analytics_client() -> PersonalAnalyticsClient:
+    global _personal_analytics_client
+    if _personal_analytics_client is None:
+        _personal_analytics_client = PersonalAnalyticsClient()
+    return _personal_analytics_client
+
+
+async def close_personal_analytics_client() -> None:
+    if _personal_analytics_client is not None:
+        await _personal_analytics_client.aclose()
+
+
 async def get_feedback_personal_analytics() -> PersonalAnalyticsData:
-    async with httpx.AsyncClient() as client:
-        pa_data = await client.get("http://localhost:57827/intervention_status")
-        pa_data = pa_data.json()
-    return PersonalAnalyticsData(**pa_data)
+    return await get_personal_analytics_client().get_data()
 
 
 class UserInput(BaseModel):
@@ -0,0 +1,107 @@
+import time
+import logging
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+import asyncio
+
+
+class PipelineStage:
+    """Stage of the feedback pipeline: a bounded queue drained by a fixed number of
+    workers.
+
+    Putting an item waits while the queue is full, so a slow stage holds back the
+    stages that feed it instead of letting the items pile up in memory. A stage
+    with a single worker processes its items in order. Errors raised by the handler
+    are logged and the item is dropped, so one bad item does not stop the stage.
+    """
+
+    HISTORY_SIZE = 10
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        concurrency: int = 1,
+        queue_size: int = 1,
+    ) -> None:
+        if concurrency <= 0:
+            raise ValueError(
+                "[ PipelineStage.__init__ ] The concurrency has to be positive"
+            )
+        if queue_size <= 0:
+            raise ValueError(
+                "[ PipelineStage.__init__ ] The queue size has to be positive"
+            )
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.workers: list[asyncio.Task] = []
+
+        self.processed_count = 0
+        self.failed_count = 0
+        self.max_queue_depth = 0
+        # Time items spent in the queue and in the handler
+        self.previous_waits: deque[float] = deque(maxlen=PipelineStage.HISTORY_SIZE)
+        self.previous_latencies: deque[float] = deque(maxlen=PipelineStage.HISTORY_SIZE)
+
+    def start(self) -> None:
+        if len(self.workers) > 0:
+            raise RuntimeError(
+                f"[ PipelineStage.start ] Stage {self.name} is already running"
+            )
+        self.workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def put(self, item) -> None:
+        await self.queue.put((time.perf_counter(), item))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    async def _work(self) -> None:
+        while True:
+            enqueued_at, item = await self.queue.get()
+            start = time.perf_counter()
+            self.previous_waits.append(start - enqueued_at)
+            try:
+                await self.handler(item)
+                self.processed_count += 1
+            except Exception:
+                self.failed_count += 1
+                logging.error(
+                    f"[ PipelineStage._work ] Stage {self.name} failed: {traceback.format_exc()}"
+                )
+            finally:
+                self.previous_latencies.append(time.perf_counter() - start)
+                self.queue.task_done()
+
+    async def join(self) -> None:
+        """Waits until every queued item was processed."""
+        await self.queue.join()
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "concurrency": self.concurrency,
+            "processed_count": self.processed_count,
+            "failed_count": self.failed_count,
+            "average_wait_seconds": (
+                sum(self.previous_waits) / len(self.previous_waits)
+                if len(self.previous_waits) > 0
+                else None
+            ),
+            "average_seconds": (
+                sum(self.previous_latencies) / len(self.previous_latencies)
+                if len(self.previous_latencies) > 0
+                else None
+            ),
+        }
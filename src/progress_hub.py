@@ -0,0 +1,204 @@
+import os
+import time
+import logging
+from typing import Awaitable, Callable
+
+import asyncio
+
+
+class SessionProgressHub:
+    """Single source of session progress for every part of the local server.
+
+    Progress is fetched from the backend at most once per TTL: callers within the
+    TTL get the cached progress (or the cached error), and callers that arrive
+    while a fetch is in flight wait for that fetch instead of starting their own.
+    While there are subscribers, the hub polls the backend once per interval and
+    puts every progress that differs from the previous one in their queues. A
+    subscriber queue only holds the latest progress, so a slow subscriber never
+    handles stale updates.
+
+    The progress can also be pushed by the backend (see SessionProgressStream).
+    While a push connection is up, the pushed progress never goes stale, so
+    neither the callers nor the poller reach the backend. When the connection
+    drops, the TTL applies again and the hub falls back to fetching.
+
+    The TTL and the polling interval are configured through
+    SESSION_PROGRESS_TTL_SECONDS and SESSION_PROGRESS_POLL_SECONDS.
+    """
+
+    DEFAULT_TTL_SECONDS = 1
+    DEFAULT_POLL_SECONDS = 1
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable],
+        ttl_seconds: float | None = None,
+        poll_seconds: float | None = None,
+    ) -> None:
+        if ttl_seconds is None:
+            ttl_seconds = float(
+                os.getenv(
+                    "SESSION_PROGRESS_TTL_SECONDS",
+                    SessionProgressHub.DEFAULT_TTL_SECONDS,
+                )
+            )
+        if poll_seconds is None:
+            poll_seconds = float(
+                os.getenv(
+                    "SESSION_PROGRESS_POLL_SECONDS",
+                    SessionProgressHub.DEFAULT_POLL_SECONDS,
+                )
+            )
+        if ttl_seconds < 0:
+            raise ValueError(
+                "[ SessionProgressHub.__init__ ] The TTL cannot be negative"
+            )
+        if poll_seconds <= 0:
+            raise ValueError(
+                "[ SessionProgressHub.__init__ ] The polling interval has to be positive"
+            )
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+
+        self.progress = None
+        self.error: Exception | None = None
+        self.fetched_at: float | None = None
+        self.inflight: asyncio.Task | None = None
+        # Incremented by invalidate, so a fetch started before does not fill the
+        # cache
+        self.generation = 0
+        self.pushing = False
+
+        self.subscribers: list[asyncio.Queue] = []
+        self.poller_task: asyncio.Task | None = None
+
+        self.fetch_count = 0
+        self.cache_hit_count = 0
+        self.coalesced_count = 0
+        self.update_count = 0
+        self.push_count = 0
+
+    def invalidate(self) -> None:
+        """Forgets the cached progress, for instance when the student changes."""
+        self.progress = None
+        self.error = None
+        self.fetched_at = None
+        self.inflight = None
+        self.generation += 1
+
+    def _get_cached(self):
+        if self.error is not None:
+            raise self.error
+        return self.progress
+
+    async def get(self):
+        """Returns the session progress, raising the error of the fetch if it
+        failed."""
+        if self.fetched_at is not None and (
+            self.pushing or time.monotonic() - self.fetched_at < self.ttl_seconds
+        ):
+            self.cache_hit_count += 1
+            return self._get_cached()
+        if self.inflight is None:
+            self.inflight = asyncio.create_task(self._refresh())
+        else:
+            self.coalesced_count += 1
+        generation = self.generation
+        # Shielded so that a caller that gets cancelled does not cancel the fetch
+        # the other callers are waiting for
+        await asyncio.shield(self.inflight)
+        if generation != self.generation:
+            return await self.get()
+        return self._get_cached()
+
+    async def _refresh(self) -> None:
+        generation = self.generation
+        self.fetch_count += 1
+        try:
+            progress = await self.fetch()
+        except Exception as e:
+            progress = None
+            error = e
+        else:
+            error = None
+        if generation != self.generation:
+            return
+        self.fetched_at = time.monotonic()
+        self.inflight = None
+        self.error = error
+        if error is None:
+            self.publish(progress)
+
+    def start_push(self) -> None:
+        """Called when the push connection is up. The cached progress stays stale
+        until the first push."""
+        self.pushing = True
+        self.fetched_at = None
+
+    def stop_push(self) -> None:
+        """Called when the push connection drops, falling back to fetching."""
+        self.pushing = False
+
+    def push(self, progress=None, error: Exception | None = None) -> None:
+        """Caches a progress, or an error, pushed by the backend."""
+        self.push_count += 1
+        self.fetched_at = time.monotonic()
+        self.error = error
+        if error is None:
+            self.publish(progress)
+
+    def publish(self, progress) -> None:
+        """Caches the progress and hands it to the subscribers if it changed."""
+        changed = progress != self.progress
+        self.progress = progress
+        if not changed:
+            return
+        self.update_count += 1
+        for queue in self.subscribers:
+            self._put_latest(queue, progress)
+
+    def _put_latest(self, queue: asyncio.Queue, progress) -> None:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(progress)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Returns a queue that receives every progress update. Polling starts with
+        the first subscriber."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if self.progress is not None:
+            queue.put_nowait(self.progress)
+        self.subscribers.append(queue)
+        if self.poller_task is None or self.poller_task.done():
+            self.poller_task = asyncio.create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Polling stops with the last subscriber."""
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+        if len(self.subscribers) == 0 and self.poller_task is not None:
+            self.poller_task.cancel()
+            self.poller_task = None
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                await self.get()
+            except Exception as e:
+                logging.info(
+                    f"[ SessionProgressHub._poll ] Could not get the session progress: {e}"
+                )
+            await asyncio.sleep(self.poll_seconds)
+
+    def get_stats(self) -> dict:
+        return {
+            "fetch_count": self.fetch_count,
+            "cache_hit_count": self.cache_hit_count,
+            "coalesced_count": self.coalesced_count,
+            "update_count": self.update_count,
+            "push_count": self.push_count,
+            "pushing": self.pushing,
+            "subscriber_count": len(self.subscribers),
+        }
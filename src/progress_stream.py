@@ -0,0 +1,158 @@
+import os
+import json
+import random
+import logging
+from typing import Callable
+
+import asyncio
+import websockets
+
+from progress_hub import SessionProgressHub
+
+
+class SessionProgressStream:
+    """Receives the session progress pushed by the backend over a WebSocket and
+    hands it to the progress hub.
+
+    The backend sends a message, the same JSON as the session progress endpoint,
+    whenever the stage or the remaining time changes. While the connection is up
+    the hub serves the pushed progress without polling. When the connection
+    cannot be opened or drops, the hub falls back to polling and the stream
+    reconnects with a full jitter backoff, so that the laptops of a lab do not all
+    reconnect at once after a backend restart.
+
+    The stream stops once is_over returns True for a pushed progress, so it does
+    not keep reconnecting for a session that finished. The streams still running
+    are stopped with the local server, see stop_progress_streams.
+
+    The backoff is configured through SESSION_PROGRESS_PUSH_RETRY_BASE_SECONDS and
+    SESSION_PROGRESS_PUSH_RETRY_MAX_SECONDS.
+    """
+
+    DEFAULT_RETRY_BASE_SECONDS = 1
+    DEFAULT_RETRY_MAX_SECONDS = 60
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        parse: Callable[[dict], object],
+        hub: SessionProgressHub,
+        is_over: Callable[[object], bool] | None = None,
+        retry_base_seconds: float | None = None,
+        retry_max_seconds: float | None = None,
+    ) -> None:
+        if retry_base_seconds is None:
+            retry_base_seconds = float(
+                os.getenv(
+                    "SESSION_PROGRESS_PUSH_RETRY_BASE_SECONDS",
+                    SessionProgressStream.DEFAULT_RETRY_BASE_SECONDS,
+                )
+            )
+        if retry_max_seconds is None:
+            retry_max_seconds = float(
+                os.getenv(
+                    "SESSION_PROGRESS_PUSH_RETRY_MAX_SECONDS",
+                    SessionProgressStream.DEFAULT_RETRY_MAX_SECONDS,
+                )
+            )
+        if retry_base_seconds < 0 or retry_max_seconds < 0:
+            raise ValueError(
+                "[ SessionProgressStream.__init__ ] The delays cannot be negative"
+            )
+        self.url = url
+        self.token = token
+        self.parse = parse
+        self.hub = hub
+        self.is_over = is_over
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.task: asyncio.Task | None = None
+
+        self.connection_count = 0
+        self.failed_connection_count = 0
+        self.message_count = 0
+
+    def get_retry_delay(self, attempts: int) -> float:
+        ceiling = min(self.retry_max_seconds, self.retry_base_seconds * 2**attempts)
+        return random.uniform(0, ceiling)
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+            _progress_streams.add(self)
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        _progress_streams.discard(self)
+        self.hub.stop_push()
+
+    async def _run(self) -> None:
+        attempts = 0
+        while True:
+            try:
+                async with websockets.connect(
+                    self.url,
+                    extra_headers={"Authorization": f"Bearer {self.token}"},
+                ) as websocket:
+                    self.connection_count += 1
+                    attempts = 0
+                    self.hub.start_push()
+                    async for message in websocket:
+                        if self._handle_message(message):
+                            logging.info(
+                                "[ SessionProgressStream._run ] The session is over"
+                            )
+                            _progress_streams.discard(self)
+                            return
+                logging.info(
+                    "[ SessionProgressStream._run ] The backend closed the connection"
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_connection_count += 1
+                logging.info(
+                    f"[ SessionProgressStream._run ] Falling back to polling: {e}"
+                )
+            finally:
+                self.hub.stop_push()
+            await asyncio.sleep(self.get_retry_delay(attempts))
+            attempts += 1
+
+    def _handle_message(self, message: str | bytes) -> bool:
+        """Hands the pushed progress to the hub. Returns whether the session is
+        over."""
+        self.message_count += 1
+        try:
+            progress = self.parse(json.loads(message))
+        except json.JSONDecodeError:
+            logging.error(
+                "[ SessionProgressStream._handle_message ] JSON cannot parse the message"
+            )
+            return False
+        except (RuntimeError, ValueError) as e:
+            self.hub.push(error=e)
+            return False
+        self.hub.push(progress)
+        return self.is_over is not None and self.is_over(progress)
+
+    def get_stats(self) -> dict:
+        return {
+            "connected": self.hub.pushing,
+            "connection_count": self.connection_count,
+            "failed_connection_count": self.failed_connection_count,
+            "message_count": self.message_count,
+        }
+
+
+_progress_streams: set[SessionProgressStream] = set()
+
+
+def stop_progress_streams() -> None:
+    """Stops the streams still running. Called when the local server shuts
+    down."""
+    for stream in list(_progress_streams):
+        stream.stop()
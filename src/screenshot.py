@@ -1,48 +1,343 @@
 import os
-import uuid
-import mss
-import win32api
+import io
+import json
+import time
+import logging
+import traceback
+import asyncio
 from PIL import Image
+from pydantic import BaseModel, Field
 
+from collections import deque
 from datetime import datetime
+from enum import StrEnum
+from typing import Optional
 
 from conf import ENV
+from deduplication import perceptual_hash
+from delta import TileDeltaEncoder
+from frame_buffer import BoxDownscaler, FrameBuffer
+from capture_backends import CaptureBackend, create_capture_backend
 
 
-def take_screenshot():
+def get_screenshot_dir() -> str:
     env = os.getenv("ENV")
     # Assume this is defined globally
     if env == ENV.TEST:
-        SCREENSHOT_DIR = "test_screenshots"
+        return "test_screenshots"
     elif env == ENV.PROD:
-        SCREENSHOT_DIR = "screenshots"
+        return "screenshots"
     elif env == ENV.DEV:
-        SCREENSHOT_DIR = "dev_screenshots"
+        return "dev_screenshots"
     else:
         raise ValueError(f"ENV environment variable is not set properly: {env}")
-    if not os.path.exists(SCREENSHOT_DIR):
-        os.mkdir(SCREENSHOT_DIR)
 
-    with mss.mss() as sct:
-        mouse_x, mouse_y = win32api.GetCursorPos()
 
-        # Find which monitor the mouse is on
-        monitor_index = 1  # default to first monitor if none matched
-        for i, monitor in enumerate(sct.monitors[1:], start=1):
-            if (
-                monitor["left"] <= mouse_x < monitor["left"] + monitor["width"]
-                and monitor["top"] <= mouse_y < monitor["top"] + monitor["height"]
-            ):
-                monitor_index = i
-                break
+class ImageFormat(StrEnum):
+    PNG = "png"
+    JPEG = "jpeg"
+    WEBP = "webp"
 
-        monitor = sct.monitors[monitor_index]
-        screenshot = sct.grab(monitor)
 
-        filename = f"{datetime.now().isoformat().replace(':', '-')}.png"
-        filepath = os.path.join(SCREENSHOT_DIR, filename)
+class EncodingOptions(BaseModel):
+    """How screenshots are encoded before being uploaded. The defaults reproduce
+    the original full-resolution lossless PNG.
 
-        img = Image.frombytes("RGB", screenshot.size, screenshot.rgb)
-        img.save(filepath)
+    Every field can be set through the environment:
+    - SCREENSHOT_FORMAT: png, jpeg or webp
+    - SCREENSHOT_QUALITY: 1 to 100, ignored for png
+    - SCREENSHOT_MAX_EDGE: maximum size of the longest edge in pixels, 0 to disable
+    - SCREENSHOT_GRAYSCALE: true or false
+    - SCREENSHOT_DELTA: true to only encode the tiles that changed since the previous
+      frame (see delta.TileDeltaEncoder). The maximum edge is ignored in this mode,
+      since tiles have to line up with the previous frame
+    - SCREENSHOT_DELTA_TILE_SIZE: size of the tiles in pixels
+    - SCREENSHOT_KEYFRAME_INTERVAL: number of delta frames between two full frames
+    """
 
-        return filepath
+    format: ImageFormat = ImageFormat.PNG
+    quality: int = Field(default=85, ge=1, le=100)
+    max_edge: int = Field(default=0, ge=0)
+    grayscale: bool = False
+    delta: bool = False
+    delta_tile_size: int = Field(default=64, gt=0)
+    keyframe_interval: int = Field(default=10, gt=0)
+
+    @classmethod
+    def from_env(cls) -> "EncodingOptions":
+        options = {}
+        if os.getenv("SCREENSHOT_FORMAT"):
+            options["format"] = os.getenv("SCREENSHOT_FORMAT").lower()
+        if os.getenv("SCREENSHOT_QUALITY"):
+            options["quality"] = os.getenv("SCREENSHOT_QUALITY")
+        if os.getenv("SCREENSHOT_MAX_EDGE"):
+            options["max_edge"] = os.getenv("SCREENSHOT_MAX_EDGE")
+        if os.getenv("SCREENSHOT_GRAYSCALE"):
+            options["grayscale"] = os.getenv("SCREENSHOT_GRAYSCALE").lower() == "true"
+        if os.getenv("SCREENSHOT_DELTA"):
+            options["delta"] = os.getenv("SCREENSHOT_DELTA").lower() == "true"
+        if os.getenv("SCREENSHOT_DELTA_TILE_SIZE"):
+            options["delta_tile_size"] = os.getenv("SCREENSHOT_DELTA_TILE_SIZE")
+        if os.getenv("SCREENSHOT_KEYFRAME_INTERVAL"):
+            options["keyframe_interval"] = os.getenv("SCREENSHOT_KEYFRAME_INTERVAL")
+        return cls(**options)
+
+    def create_delta_encoder(self) -> TileDeltaEncoder | None:
+        if not self.delta:
+            return None
+        return TileDeltaEncoder(self.delta_tile_size, self.keyframe_interval)
+
+    def get_extension(self) -> str:
+        return "jpg" if self.format == ImageFormat.JPEG else self.format.value
+
+
+class EncodingStats:
+    """Moving statistics of the encoded screenshots, used to tune the encoding
+    options against upload size and encoding latency."""
+
+    HISTORY_SIZE = 10
+
+    def __init__(self) -> None:
+        self.frame_count = 0
+        self.total_bytes = 0
+        self.last_bytes: int | None = None
+        self.last_encode_seconds: float | None = None
+        self.previous_bytes: deque[int] = deque(maxlen=EncodingStats.HISTORY_SIZE)
+        self.previous_encode_seconds: deque[float] = deque(
+            maxlen=EncodingStats.HISTORY_SIZE
+        )
+
+    def register(self, nbytes: int, encode_seconds: float) -> None:
+        self.frame_count += 1
+        self.total_bytes += nbytes
+        self.last_bytes = nbytes
+        self.last_encode_seconds = encode_seconds
+        self.previous_bytes.append(nbytes)
+        self.previous_encode_seconds.append(encode_seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "frame_count": self.frame_count,
+            "total_bytes": self.total_bytes,
+            "last_bytes": self.last_bytes,
+            "average_bytes": (
+                sum(self.previous_bytes) / len(self.previous_bytes)
+                if len(self.previous_bytes) > 0
+                else None
+            ),
+            "last_encode_seconds": self.last_encode_seconds,
+            "average_encode_seconds": (
+                sum(self.previous_encode_seconds) / len(self.previous_encode_seconds)
+                if len(self.previous_encode_seconds) > 0
+                else None
+            ),
+        }
+
+
+def encode_image(img: Image.Image, options: EncodingOptions, fp) -> None:
+    if options.grayscale:
+        img = img.convert("L")
+    if not options.delta and options.max_edge > 0 and max(img.size) > options.max_edge:
+        img.thumbnail((options.max_edge, options.max_edge), Image.Resampling.BILINEAR)
+
+    if options.format == ImageFormat.PNG:
+        img.save(fp, format="PNG")
+    elif options.format == ImageFormat.JPEG:
+        img.save(fp, format="JPEG", quality=options.quality)
+    elif options.format == ImageFormat.WEBP:
+        img.save(fp, format="WEBP", quality=options.quality, method=4)
+
+
+def encode_frame(
+    frame: FrameBuffer,
+    options: EncodingOptions,
+    delta_encoder: TileDeltaEncoder | None = None,
+    downscaler: BoxDownscaler | None = None,
+) -> tuple[io.BytesIO, int, dict | None]:
+    """Encodes a raw BGRA frame into an in-memory buffer and computes its
+    perceptual hash. The frame is only read through views, so it can live in
+    shared memory, and the channel conversion happens while PIL decodes it.
+
+    When a delta encoder is given, only the tiles that changed since the previous
+    frame are encoded and the tile manifest is returned along with them. Otherwise
+    frames larger than the maximum edge are first shrunk by an integer factor on a
+    view of the frame, so PIL only converts and resamples the smaller frame."""
+    pixels = frame.array
+    phash = perceptual_hash(pixels)
+
+    manifest = None
+    if delta_encoder is not None:
+        manifest, tiles = delta_encoder.encode(frame.view, frame.size)
+        if not manifest["keyframe"]:
+            pixels = tiles
+    elif options.max_edge > 0 and max(frame.size) > options.max_edge:
+        if downscaler is None:
+            downscaler = BoxDownscaler()
+        pixels = downscaler.reduce(pixels, max(frame.size) // options.max_edge)
+
+    img = Image.frombuffer(
+        "RGB", (pixels.shape[1], pixels.shape[0]), pixels, "raw", "BGRX", 0, 1
+    )
+    fp = io.BytesIO()
+    encode_image(img, options, fp)
+    return fp, phash, manifest
+
+
+class EncodedScreenshot(BaseModel):
+    # Path the screenshot is archived to
+    filepath: str
+    data: bytes = Field(repr=False)
+    phash: int
+    # Tile manifest when the screenshot is a delta encoded frame
+    manifest: Optional[dict] = None
+
+
+class ScreenshotArchive:
+    """Optional disk sink for the encoded screenshots.
+
+    The collection loop keeps the screenshots in memory from capture to upload, so
+    writing them to disk is only needed for archival. Writes run on a worker thread
+    in the background, keeping file I/O out of the collection loop. Archival can be
+    turned off by setting SCREENSHOT_ARCHIVE to false.
+    """
+
+    def __init__(self, enabled: bool | None = None) -> None:
+        if enabled is None:
+            enabled = os.getenv("SCREENSHOT_ARCHIVE", "true").lower() != "false"
+        self.enabled = enabled
+        self.pending: set[asyncio.Task] = set()
+
+    def _write(self, filepath: str, data, manifest: dict | None) -> None:
+        with open(filepath, "wb") as fp:
+            fp.write(data)
+        if manifest is not None:
+            with open(f"{filepath}.json", "w") as jout:
+                json.dump(manifest, jout)
+
+    async def save(self, filepath: str, data, manifest: dict | None = None) -> None:
+        try:
+            await asyncio.to_thread(self._write, filepath, data, manifest)
+        except Exception:
+            logging.error(
+                f"[ ScreenshotArchive.save ] Could not archive {filepath}: {traceback.format_exc()}"
+            )
+
+    def schedule(self, filepath: str, data, manifest: dict | None = None) -> None:
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.save(filepath, data, manifest))
+        # Keeping a reference so the task is not garbage collected before it finishes
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def flush(self) -> None:
+        if len(self.pending) > 0:
+            await asyncio.gather(*self.pending)
+
+
+class ScreenCapture:
+    """Long-lived screen grabber.
+
+    Opening a grabber allocates platform handles and enumerates the monitors, which
+    is too expensive to do on every iteration of the collection loop. This class
+    keeps its capture backend (see capture_backends) open between captures, and
+    encodes the frames it grabs.
+    """
+
+    TIMING_HISTORY_SIZE = 10
+
+    def __init__(
+        self,
+        encoding_options: EncodingOptions | None = None,
+        backend: CaptureBackend | None = None,
+    ) -> None:
+        self.screenshot_dir = get_screenshot_dir()
+        if not os.path.exists(self.screenshot_dir):
+            os.mkdir(self.screenshot_dir)
+
+        self.encoding_options = encoding_options or EncodingOptions.from_env()
+        self.encoding_stats = EncodingStats()
+        self.delta_encoder = self.encoding_options.create_delta_encoder()
+        # Reused by every capture, so frames are grabbed without allocating
+        self.frame_buffer = FrameBuffer()
+        self.downscaler = BoxDownscaler()
+
+        # The backend is created on the first grab, by the thread that grabs
+        self.backend = backend
+
+        self.capture_count = 0
+        self.last_capture_seconds: float | None = None
+        self.previous_captures: deque[float] = deque(
+            maxlen=ScreenCapture.TIMING_HISTORY_SIZE
+        )
+
+    def grab_into(self, frame_buffer: FrameBuffer) -> None:
+        if self.backend is None:
+            self.backend = create_capture_backend()
+        self.backend.grab_into(frame_buffer)
+
+    def new_screenshot_path(self) -> str:
+        filename = f"{datetime.now().isoformat().replace(':', '-')}.{self.encoding_options.get_extension()}"
+        return os.path.join(self.screenshot_dir, filename)
+
+    def register_capture(self, seconds: float) -> None:
+        self.last_capture_seconds = seconds
+        self.previous_captures.append(seconds)
+        self.capture_count += 1
+
+    def take_screenshot(self) -> EncodedScreenshot:
+        """Grabs and encodes the monitor under the cursor. Nothing is written to
+        disk."""
+        start = time.perf_counter()
+
+        self.grab_into(self.frame_buffer)
+        filepath = self.new_screenshot_path()
+        encode_start = time.perf_counter()
+        fp, phash, manifest = encode_frame(
+            self.frame_buffer,
+            self.encoding_options,
+            self.delta_encoder,
+            self.downscaler,
+        )
+        data = fp.getvalue()
+        self.encoding_stats.register(len(data), time.perf_counter() - encode_start)
+
+        self.register_capture(time.perf_counter() - start)
+
+        return EncodedScreenshot(
+            filepath=filepath, data=data, phash=phash, manifest=manifest
+        )
+
+    def request_keyframe(self) -> None:
+        """Makes the next delta encoded frame a full frame. Used when the previous
+        frame did not reach the backend."""
+        if self.delta_encoder is not None:
+            self.delta_encoder.request_keyframe()
+
+    def get_timing_stats(self) -> dict:
+        return {
+            "capture_count": self.capture_count,
+            **(self.backend.get_stats() if self.backend is not None else {}),
+            "last_capture_seconds": self.last_capture_seconds,
+            "average_capture_seconds": (
+                sum(self.previous_captures) / len(self.previous_captures)
+                if len(self.previous_captures) > 0
+                else None
+            ),
+            "encoding": self.encoding_stats.to_dict(),
+        }
+
+    def close(self) -> None:
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+
+_screen_capture: ScreenCapture | None = None
+
+
+def take_screenshot() -> EncodedScreenshot:
+    global _screen_capture
+    if _screen_capture is None:
+        _screen_capture = ScreenCapture()
+    return _screen_capture.take_screenshot()
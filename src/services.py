@@ -1,5 +1,4 @@
 import os
-import requests
 import httpx
 
 import logging
@@ -7,32 +6,53 @@ import logging
 import json
 
 import asyncio
+from typing import ClassVar
 
 from pydantic import BaseModel
 from pydantic_core import ValidationError
 
 from session import IamSession
-from feedback import Feedback
-
-
-class HealthCheckError(Exception):
-    def __init__(self) -> None:
-        super().__init__("Health Check Error. Could not connect to the server")
+from feedback import Feedback, get_screenshot_upload
+from http_client import get_backend_client
+from health import get_backend_health
+from progress_hub import SessionProgressHub
+from progress_stream import SessionProgressStream
+from tracking_rollup import TrackingRollup
 
 
 class SessionProgress(BaseModel):
+    # Seconds before the end of the homework at which it counts as finished
+    HOMEWORK_END_SECONDS: ClassVar[int] = 5
+
     stage: str
     remaining_time: int
 
+    def is_finished(self) -> bool:
+        return self.stage.lower() == "finished"
+
     def has_finished_homework(self) -> bool:
-        if self.stage.lower() == "homework" and self.remaining_time < 5:
+        if (
+            self.stage.lower() == "homework"
+            and self.remaining_time < SessionProgress.HOMEWORK_END_SECONDS
+        ):
             return True
         if self.stage.lower() in ["survey", "finished"]:
             return True
         return False
 
+    def get_seconds_until_homework_finishes(self) -> int:
+        """Lower bound of the seconds before has_finished_homework becomes true.
+        Before the homework, the remaining time is the one of the current stage,
+        and the homework comes after it."""
+        if self.has_finished_homework():
+            return 0
+        if self.stage.lower() == "homework":
+            return self.remaining_time - SessionProgress.HOMEWORK_END_SECONDS
+        return max(self.remaining_time, 0)
+
 
 class SessionService:
+    # Timeout until the latencies of an endpoint are known, see LatencyTracker
     TIMEOUT_SECONDS = 15
 
     # Session Progress errors
@@ -47,6 +67,10 @@ class SessionService:
         - BACKEND_PORT
         - PATH_PREFIX
         - ENV
+
+        The session progress is pushed by the backend over a WebSocket when
+        SESSION_PROGRESS_PUSH is true, and polled otherwise or while the WebSocket
+        is down.
         """
         host = os.getenv("BACKEND_HOST", None)
         port_str: str = os.getenv("BACKEND_PORT", None)
@@ -71,19 +95,33 @@ class SessionService:
         port = int(port_str)
 
         self.base_url = f"http{'s' if port == 443 else ''}://{host}:{port}{path_prefix}"
+        self.websocket_url = (
+            f"ws{'s' if port == 443 else ''}://{host}:{port}{path_prefix}"
+        )
 
-        if env == "PROD":
-            try:
-                response = requests.get(f"{self.base_url}/health_check")
-            except requests.exceptions.ConnectionError:
-                raise HealthCheckError()
-            if response.status_code != 200 or response.json()["status"] != "ok":
-                raise HealthCheckError()
+        self.http_client = get_backend_client(self.base_url)
+        # Checked in the background once the local server is started, see
+        # start_backend_health_checks
+        self.health = get_backend_health(self.base_url)
+        # Every reader of the session progress goes through the hub, so the
+        # backend is asked at most once per TTL
+        self.progress_hub = SessionProgressHub(self.fetch_session_progress)
+        self.push_progress = (
+            os.getenv("SESSION_PROGRESS_PUSH", "false").lower() == "true"
+        )
+        self.progress_stream: SessionProgressStream | None = None
         self.iam_session = None
         self.get_remaining_sessions_seqnum_task = None
 
     async def get_session_progress(self) -> SessionProgress:
-        """Get the session progress for the current authenticated student.
+        """Get the session progress for the current authenticated student, cached
+        and shared through the progress hub. See fetch_session_progress for the
+        conditions and errors."""
+        return await self.progress_hub.get()
+
+    async def fetch_session_progress(self) -> SessionProgress:
+        """Fetch the session progress for the current authenticated student from
+        the backend.
 
         Pre-conditions
         - An IamSession object needs to be set
@@ -104,10 +142,10 @@ class SessionService:
             raise RuntimeError(
                 "[ Backend.get_session_progress ] IamSession is still none"
             )
-        async with httpx.AsyncClient() as client:
-            progress = await client.get(
-                f"/student/{self.iam_session.user.username}/session"
-            )
+        progress = await self.http_client.get(
+            f"/student/{self.iam_session.user.username}/session",
+            endpoint="session_progress",
+        )
 
         if progress is None:
             raise ValueError("[ Backend.get_session_progress ] SessionProgress is None")
@@ -119,6 +157,17 @@ class SessionService:
                 "[ Backend.get_session_progress ] JSON cannot parse the response"
             )
 
+        return self.parse_session_progress(progress)
+
+    def parse_session_progress(self, progress: dict) -> SessionProgress:
+        """Validates a session progress sent by the backend, either as the response
+        of the session progress endpoint or as a pushed message.
+
+        Raises
+        ------
+            ValueError - If the object is not a session progress object
+            RuntimeError - If the backend sent one of the session progress errors
+        """
         if "status" in progress and progress["status"] == "err":
             if (
                 progress["message"]
@@ -148,8 +197,34 @@ class SessionService:
     def get_iam_session(self) -> IamSession:
         return self.iam_session
 
+    def get_readiness(self) -> dict:
+        return self.health.get_readiness()
+
+    def get_connection_stats(self) -> dict:
+        return self.http_client.get_stats()
+
+    def start_progress_stream(self) -> None:
+        """(Re)subscribes to the progress pushed for the current student."""
+        self.stop_progress_stream()
+        self.progress_stream = SessionProgressStream(
+            f"{self.websocket_url}/student/{self.iam_session.user.username}/session/stream",
+            self.iam_session.token,
+            self.parse_session_progress,
+            self.progress_hub,
+            is_over=SessionProgress.is_finished,
+        )
+        self.progress_stream.start()
+
+    def stop_progress_stream(self) -> None:
+        if self.progress_stream is not None:
+            self.progress_stream.stop()
+            self.progress_stream = None
+
     def set_iam_session(self, iam_session: IamSession) -> None:
         self.iam_session = iam_session
+        self.progress_hub.invalidate()
+        if self.push_progress:
+            self.start_progress_stream()
         self.get_remaining_sessions_seqnum_task = asyncio.create_task(
             self.get_remaining_sessions_seqnum()
         )
@@ -163,7 +238,9 @@ class SessionService:
     async def is_session_active(self) -> bool:
         try:
             session_progress = await self.get_session_progress()
-            if session_progress.stage.lower() == "finished":
+            if session_progress.is_finished():
+                # Nothing more will be pushed for this session
+                self.stop_progress_stream()
                 return False
         except RuntimeError:
             # A runtime error can be caused either by 1) a user not having an active session, or 2) a user not being authenticated
@@ -178,50 +255,74 @@ class SessionService:
         return True
 
     async def ingest_feedback(self, feedback: Feedback) -> Feedback:
-        with open(feedback.screenshot, "rb") as screenshot_file:
-            logging.info("Sending feedback")
-            async with httpx.AsyncClient(
-                timeout=SessionService.TIMEOUT_SECONDS
-            ) as client:
-                response = await client.post(
-                    f"{self.base_url}/session_execution/student/{self.iam_session.user.username}/session/feedback",
-                    headers={"Authorization": f"Bearer {self.iam_session.token}"},
-                    params={
-                        "pa_feedback_str": json.dumps(
-                            feedback.personal_analytics_data.model_dump()
-                        ),
-                    },
-                    files={"screenshot_file": screenshot_file},
-                )
+        params = {
+            "pa_feedback_str": json.dumps(
+                feedback.personal_analytics_data.model_dump()
+            ),
+        }
+        if feedback.unchanged_since is None:
+            files = {"screenshot_file": get_screenshot_upload(feedback)}
+            if feedback.screenshot_manifest is not None:
+                params["tile_manifest"] = json.dumps(feedback.screenshot_manifest)
+        else:
+            # The screen did not change, so the backend can reuse the screenshot it
+            # received with the referenced feedback
+            params["unchanged_since_seqnum"] = feedback.unchanged_since
+            files = None
+
+        logging.info("Sending feedback")
+        response = await self.http_client.post(
+            f"{self.base_url}/session_execution/student/{self.iam_session.user.username}/session/feedback",
+            headers={"Authorization": f"Bearer {self.iam_session.token}"},
+            params=params,
+            files=files,
+            endpoint="ingest_feedback",
+            timeout=SessionService.TIMEOUT_SECONDS,
+        )
+        # An error body would otherwise count as a received feedback
+        response.raise_for_status()
         return response.json()
 
     async def get_remaining_sessions_seqnum(self) -> list[int]:
-        async with httpx.AsyncClient(timeout=SessionService.TIMEOUT_SECONDS) as client:
-            response = await client.get(
-                f"{self.base_url}/student/{self.iam_session.user.username}/remaining_sessions",
-                headers={"Authorization": f"Bearer {self.iam_session.token}"},
-            )
-            session_list = response.json()
+        response = await self.http_client.get(
+            f"{self.base_url}/student/{self.iam_session.user.username}/remaining_sessions",
+            headers={"Authorization": f"Bearer {self.iam_session.token}"},
+            endpoint="remaining_sessions",
+            timeout=SessionService.TIMEOUT_SECONDS,
+        )
+        session_list = response.json()
 
         return [s["seqnum"] for s in session_list]
 
+    async def upload_tracking_rollup(self, rollup: TrackingRollup) -> dict:
+        """Uploads the per-interval aggregates of the tracking data, which the
+        backend can use instead of the raw rows."""
+        response = await self.http_client.post(
+            f"{self.base_url}/student/{self.iam_session.user.username}/tracking/rollup",
+            headers={"Authorization": f"Bearer {self.iam_session.token}"},
+            json=rollup.to_records(),
+            endpoint="tracking_rollup",
+            timeout=SessionService.TIMEOUT_SECONDS,
+        )
+        return response.json()
 
-# class IamService:
-#     def __init__(self):
-#         self._iam_session: IamSession | None = None
 
-#     def set_iam_session(self, s: IamSession) -> None:
-#         if s is None:
-#             raise ValueError("[ IamService.set_iam_session ] IamSession cannot be none")
+class IamService:
+    def __init__(self):
+        self._iam_session: IamSession | None = None
 
-#         self._iam_session = s
+    def set_iam_session(self, s: IamSession) -> None:
+        if s is None:
+            raise ValueError("[ IamService.set_iam_session ] IamSession cannot be none")
 
-#     def get_iam_session(self) -> IamSession:
-#         return self._iam_session
+        self._iam_session = s
 
-#     def set_session_num(self, session_num: int) -> None:
-#         if self._iam_session is None:
-#             raise RuntimeError(
-#                 "[ IamService.set_session_num ] IamSession was not set yet"
-#             )
-#         self._iam_session.session_num = session_num
+    def get_iam_session(self) -> IamSession:
+        return self._iam_session
+
+    def set_session_num(self, session_num: int) -> None:
+        if self._iam_session is None:
+            raise RuntimeError(
+                "[ IamService.set_session_num ] IamSession was not set yet"
+            )
+        self._iam_session.session_num = session_num
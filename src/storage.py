@@ -0,0 +1,347 @@
+import os
+import time
+import logging
+import traceback
+import zipfile
+
+import asyncio
+import aiosqlite
+
+from session import IamSession
+
+
+class ScreenshotStorage:
+    """Keeps the archived screenshots within a disk budget.
+
+    Every archived screenshot is indexed by (student_name, session_num, seqnum) in
+    the local database, together with its size, its last access and whether the
+    backend received it. Maintenance runs in the background after each session:
+    - Screenshots of previous sessions are compacted into a single zip archive per
+      session, so the screenshots directory does not hold thousands of files
+    - Uploaded screenshots older than the maximum age are deleted
+    - Uploaded screenshots are deleted, least recently used first, until the total
+      size is within the budget. Screenshots the backend never received are kept
+
+    The budget is configured through SCREENSHOT_STORAGE_MAX_MB and
+    SCREENSHOT_STORAGE_MAX_AGE_DAYS.
+    """
+
+    DEFAULT_MAX_MB = 2048
+    DEFAULT_MAX_AGE_DAYS = 30
+    ARCHIVE_DIR = "archive"
+
+    def __init__(
+        self,
+        screenshot_dir: str,
+        max_bytes: int | None = None,
+        max_age_seconds: float | None = None,
+    ):
+        self.db_path = os.getenv("SQLITE_DB_PATH", None)
+        if self.db_path is None:
+            raise ValueError(
+                "[ ScreenshotStorage ] The database path was not set in the environment variables"
+            )
+        if max_bytes is None:
+            max_bytes = (
+                int(
+                    os.getenv(
+                        "SCREENSHOT_STORAGE_MAX_MB", ScreenshotStorage.DEFAULT_MAX_MB
+                    )
+                )
+                * 1024
+                * 1024
+            )
+        if max_age_seconds is None:
+            max_age_seconds = (
+                float(
+                    os.getenv(
+                        "SCREENSHOT_STORAGE_MAX_AGE_DAYS",
+                        ScreenshotStorage.DEFAULT_MAX_AGE_DAYS,
+                    )
+                )
+                * 24
+                * 60
+                * 60
+            )
+        if max_bytes < 0 or max_age_seconds < 0:
+            raise ValueError("[ ScreenshotStorage ] The budget cannot be negative")
+
+        self.screenshot_dir = screenshot_dir
+        self.archive_dir = os.path.join(screenshot_dir, ScreenshotStorage.ARCHIVE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self.table_was_created = False
+        self.maintenance_task: asyncio.Task | None = None
+
+    async def create_table_if_not_exists(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("""
+                    CREATE TABLE IF NOT EXISTS screenshot_files (
+                        student_name TEXT,
+                        session_num INTEGER,
+                        seqnum INTEGER,
+                        path TEXT,
+                        archive_path TEXT,
+                        nbytes INTEGER,
+                        created_at REAL,
+                        last_access REAL,
+                        uploaded INTEGER,
+                        PRIMARY KEY (student_name, session_num, seqnum)
+                    );
+                """)
+            await db.commit()
+        self.table_was_created = True
+
+    async def register(
+        self, session: IamSession, seqnum: int, path: str, nbytes: int
+    ) -> None:
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        now = time.time()
+        async with aiosqlite.connect(self.db_path) as db:
+            # Not INSERT OR REPLACE: the session number is NULL until the backend
+            # sent it, and NULLs never conflict in the primary key
+            await db.execute(
+                """
+                    DELETE FROM screenshot_files
+                    WHERE student_name = ? AND session_num IS ? AND seqnum = ?
+                """,
+                (session.user.username, session.session_num, seqnum),
+            )
+            await db.execute(
+                """
+                    INSERT INTO screenshot_files VALUES (
+                        ?, ?, ?, ?, NULL, ?, ?, ?, 0
+                    )
+                """,
+                (
+                    session.user.username,
+                    session.session_num,
+                    seqnum,
+                    path,
+                    nbytes,
+                    now,
+                    now,
+                ),
+            )
+            await db.commit()
+
+    async def mark_uploaded(self, session: IamSession, seqnum: int) -> None:
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """
+                    UPDATE screenshot_files SET uploaded = 1
+                    WHERE student_name = ? AND session_num IS ? AND seqnum = ?
+                """,
+                (session.user.username, session.session_num, seqnum),
+            )
+            await db.commit()
+
+    async def read(
+        self, student_name: str, session_num: int | None, seqnum: int
+    ) -> bytes:
+        """Reads an archived screenshot, whether it is still a loose file or was
+        compacted into its session archive."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute(
+                """
+                    SELECT path, archive_path FROM screenshot_files
+                    WHERE student_name = ? AND session_num IS ? AND seqnum = ?
+                """,
+                (student_name, session_num, seqnum),
+            )
+            row = await response.fetchone()
+            if row is None:
+                raise KeyError(
+                    f"[ ScreenshotStorage.read ] No screenshot for {(student_name, session_num, seqnum)}"
+                )
+            await db.execute(
+                """
+                    UPDATE screenshot_files SET last_access = ?
+                    WHERE student_name = ? AND session_num IS ? AND seqnum = ?
+                """,
+                (time.time(), student_name, session_num, seqnum),
+            )
+            await db.commit()
+
+        path, archive_path = row
+        return await asyncio.to_thread(self._read_file, path, archive_path)
+
+    def _read_file(self, path: str, archive_path: str | None) -> bytes:
+        if archive_path is None:
+            with open(path, "rb") as fp:
+                return fp.read()
+        with zipfile.ZipFile(archive_path) as archive:
+            return archive.read(os.path.basename(path))
+
+    def _get_archive_path(self, student_name: str, session_num: int) -> str:
+        return os.path.join(self.archive_dir, f"{student_name}_{session_num}.zip")
+
+    def _compact_session(
+        self, student_name: str, session_num: int, paths: list[str]
+    ) -> tuple[str, list[str], list[str]]:
+        """Moves the loose screenshots of a session into the session archive.
+        Returns the archive path, the paths that were moved and the paths that do
+        not exist anymore."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive_path = self._get_archive_path(student_name, session_num)
+        moved = []
+        missing = []
+        # Appending keeps what an interrupted compaction already moved
+        with zipfile.ZipFile(archive_path, "a", zipfile.ZIP_DEFLATED) as archive:
+            existing = set(archive.namelist())
+            for path in paths:
+                name = os.path.basename(path)
+                if name not in existing:
+                    if not os.path.exists(path):
+                        missing.append(path)
+                        continue
+                    archive.write(path, name)
+                    # Tile manifest of delta encoded screenshots
+                    if os.path.exists(f"{path}.json"):
+                        archive.write(f"{path}.json", f"{name}.json")
+                moved.append(path)
+        for path in moved:
+            self._delete(path)
+        return archive_path, moved, missing
+
+    async def compact(self, current_session: IamSession | None = None) -> None:
+        """Compacts every session except the one still being collected."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute("""
+                    SELECT student_name, session_num, path FROM screenshot_files
+                    WHERE archive_path IS NULL
+                """)
+            rows = await response.fetchall()
+
+        sessions: dict[tuple[str, int], list[str]] = {}
+        for student_name, session_num, path in rows:
+            if (
+                current_session is not None
+                and student_name == current_session.user.username
+                and session_num == current_session.session_num
+            ):
+                continue
+            sessions.setdefault((student_name, session_num), []).append(path)
+
+        for (student_name, session_num), paths in sessions.items():
+            archive_path, moved, missing = await asyncio.to_thread(
+                self._compact_session, student_name, session_num, paths
+            )
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.executemany(
+                    """
+                        UPDATE screenshot_files SET archive_path = ?
+                        WHERE student_name = ? AND session_num IS ? AND path = ?
+                    """,
+                    [(archive_path, student_name, session_num, p) for p in moved],
+                )
+                # Screenshots deleted by hand (or never written) would otherwise
+                # count against the budget forever
+                await db.executemany(
+                    """
+                        DELETE FROM screenshot_files
+                        WHERE student_name = ? AND session_num IS ? AND path = ?
+                    """,
+                    [(student_name, session_num, p) for p in missing],
+                )
+                await db.commit()
+            logging.info(
+                f"[ ScreenshotStorage.compact ] Compacted {len(moved)} screenshots into {archive_path}"
+            )
+
+    def _get_size(self, path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _delete(self, path: str) -> None:
+        for p in [path, f"{path}.json"]:
+            if os.path.exists(p):
+                os.remove(p)
+
+    async def evict(self) -> None:
+        """Deletes uploaded screenshots that are too old, then the least recently
+        used uploaded screenshots until the storage is within budget. A session
+        archive is evicted as a whole, once all its screenshots were uploaded."""
+        if not self.table_was_created:
+            await self.create_table_if_not_exists()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            response = await db.execute("""
+                    SELECT
+                        COALESCE(archive_path, path),
+                        archive_path IS NOT NULL,
+                        SUM(nbytes),
+                        MIN(created_at),
+                        MAX(last_access),
+                        MIN(uploaded)
+                    FROM screenshot_files
+                    GROUP BY COALESCE(archive_path, path)
+                """)
+            units = await response.fetchall()
+
+        sizes = {}
+        for path, is_archive, nbytes, *_ in units:
+            sizes[path] = (
+                await asyncio.to_thread(self._get_size, path) if is_archive else nbytes
+            )
+        total_bytes = sum(sizes.values())
+
+        now = time.time()
+        evicted = []
+        # Least recently used first
+        candidates = sorted(
+            [unit for unit in units if unit[5] == 1], key=lambda unit: unit[4]
+        )
+        for path, is_archive, nbytes, created_at, last_access, uploaded in candidates:
+            too_old = now - created_at > self.max_age_seconds
+            if not too_old and total_bytes <= self.max_bytes:
+                continue
+            try:
+                await asyncio.to_thread(self._delete, path)
+            except Exception:
+                logging.error(
+                    f"[ ScreenshotStorage.evict ] Could not delete {path}: {traceback.format_exc()}"
+                )
+                continue
+            total_bytes -= sizes[path]
+            evicted.append(path)
+
+        if len(evicted) > 0:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.executemany(
+                    """
+                        DELETE FROM screenshot_files
+                        WHERE COALESCE(archive_path, path) = ?
+                    """,
+                    [(path,) for path in evicted],
+                )
+                await db.commit()
+        logging.info(
+            f"[ ScreenshotStorage.evict ] Evicted {len(evicted)} files, {total_bytes} bytes in use"
+        )
+
+    async def maintain(self, current_session: IamSession | None = None) -> None:
+        try:
+            await self.compact(current_session)
+            await self.evict()
+        except Exception:
+            logging.error(
+                f"[ ScreenshotStorage.maintain ] Error while maintaining the screenshot storage: {traceback.format_exc()}"
+            )
+
+    def schedule_maintenance(self, current_session: IamSession | None = None) -> None:
+        """Runs the maintenance in the background, unless it is already running."""
+        if self.maintenance_task is not None and not self.maintenance_task.done():
+            return
+        self.maintenance_task = asyncio.create_task(self.maintain(current_session))
@@ -0,0 +1,221 @@
+import json
+import struct
+
+import numpy as np
+
+from tracking import UserInput, WindowsActivity
+
+
+class TrackingBatch:
+    """Columnar batch of tracking rows of one table of one .pa.dat file.
+
+    Every column is a NumPy array, timestamps being int64 microseconds since the
+    epoch, so a batch is built from the SQLite rows without creating a model per
+    row, and serialised by copying its arrays. The binary format is
+    - the MAGIC bytes, then the length of the header (uint32, little endian)
+    - a JSON header with the table, username, filename, number of rows and the
+      size of every column buffer
+    - the column buffers, in the order of the schema. Text columns are stored as
+      int64 offsets followed by the UTF-8 bytes of the values, as Arrow does
+
+    NULL values of the .pa.dat file are read as empty texts and zeros, and NULL
+    timestamps as NaT, stored as the minimum int64 (see NAT).
+    """
+
+    MAGIC = b"PATB"
+    VERSION = 1
+
+    # Timestamps are stored as int64 epoch microseconds, TEXT columns as objects
+    TIMESTAMP = "timestamp"
+    TEXT = "text"
+    # Value of the NaT timestamps in the int64 columns
+    NAT = np.iinfo(np.int64).min
+    SCHEMAS = {
+        "user_input": {
+            "id": "<i8",
+            "ts_time": TIMESTAMP,
+            "ts_start": TIMESTAMP,
+            "ts_end": TIMESTAMP,
+            "keys_total": "<i8",
+            "clicks_total": "<i8",
+            "scroll_delta": "<f8",
+            "moved_distance": "<f8",
+        },
+        "windows_activity": {
+            "id": "<i8",
+            "ts_time": TIMESTAMP,
+            "ts_start": TIMESTAMP,
+            "ts_end": TIMESTAMP,
+            "window_name": TEXT,
+            "process_name": TEXT,
+        },
+    }
+
+    def __init__(
+        self,
+        table: str,
+        username: str,
+        filename: str,
+        columns: dict[str, np.ndarray],
+        last_time: str | None = None,
+    ) -> None:
+        if table not in TrackingBatch.SCHEMAS:
+            raise ValueError(f"[ TrackingBatch.__init__ ] Unknown table {table}")
+        if list(columns) != list(TrackingBatch.SCHEMAS[table]):
+            raise ValueError(
+                f"[ TrackingBatch.__init__ ] The columns do not match the schema of {table}"
+            )
+        if len({len(column) for column in columns.values()}) > 1:
+            raise ValueError(
+                "[ TrackingBatch.__init__ ] The columns do not have the same length"
+            )
+        self.table = table
+        self.username = username
+        self.filename = filename
+        self.columns = columns
+        # Raw time of the last row, as stored in the .pa.dat file, for the
+        # checkpoint of the extractor
+        self.last_time = last_time
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    @property
+    def last_id(self) -> int:
+        return int(self.columns["id"][-1])
+
+    @classmethod
+    def from_rows(
+        cls, table: str, username: str, filename: str, rows: list[tuple]
+    ) -> "TrackingBatch":
+        """Builds a batch from rows read with the columns of
+        TrackingExtractor.COLUMNS."""
+        if table not in TrackingBatch.SCHEMAS:
+            raise ValueError(f"[ TrackingBatch.from_rows ] Unknown table {table}")
+        schema = TrackingBatch.SCHEMAS[table]
+        values = list(zip(*rows)) if len(rows) > 0 else [()] * len(schema)
+        columns = {}
+        for (name, dtype), column in zip(schema.items(), values):
+            if dtype == TrackingBatch.TIMESTAMP:
+                # NULL becomes NaT
+                columns[name] = (
+                    np.array(column, dtype="datetime64[us]")
+                    .astype(np.int64)
+                    .reshape(-1)
+                )
+                continue
+            if None in column:
+                empty = "" if dtype == TrackingBatch.TEXT else 0
+                column = [empty if value is None else value for value in column]
+            if dtype == TrackingBatch.TEXT:
+                columns[name] = np.array(column, dtype=object).reshape(-1)
+            else:
+                columns[name] = np.array(column, dtype=dtype).reshape(-1)
+        last_time = str(rows[-1][1]) if len(rows) > 0 else None
+        return cls(table, username, filename, columns, last_time)
+
+    def to_bytes(self) -> bytes:
+        buffers = []
+        header_columns = []
+        for name, dtype in TrackingBatch.SCHEMAS[self.table].items():
+            column = self.columns[name]
+            if dtype == TrackingBatch.TEXT:
+                encoded = [value.encode("utf-8") for value in column]
+                offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                data = b"".join(encoded)
+                buffers.extend([offsets.tobytes(), data])
+                header_columns.append(
+                    {
+                        "name": name,
+                        "dtype": dtype,
+                        "nbytes": offsets.nbytes + len(data),
+                    }
+                )
+            else:
+                data = np.ascontiguousarray(
+                    column, dtype="<i8" if dtype == TrackingBatch.TIMESTAMP else dtype
+                ).tobytes()
+                buffers.append(data)
+                header_columns.append(
+                    {"name": name, "dtype": dtype, "nbytes": len(data)}
+                )
+        header = json.dumps(
+            {
+                "version": TrackingBatch.VERSION,
+                "table": self.table,
+                "username": self.username,
+                "filename": self.filename,
+                "rows": len(self),
+                "last_time": self.last_time,
+                "columns": header_columns,
+            }
+        ).encode("utf-8")
+        return b"".join(
+            [TrackingBatch.MAGIC, struct.pack("<I", len(header)), header, *buffers]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TrackingBatch":
+        """Reads a batch written by to_bytes. The numeric columns are views on the
+        given bytes."""
+        if data[: len(TrackingBatch.MAGIC)] != TrackingBatch.MAGIC:
+            raise ValueError("[ TrackingBatch.from_bytes ] Not a tracking batch")
+        position = len(TrackingBatch.MAGIC)
+        (header_size,) = struct.unpack_from("<I", data, position)
+        position += 4
+        header = json.loads(data[position : position + header_size])
+        position += header_size
+        if header["version"] != TrackingBatch.VERSION:
+            raise ValueError(
+                f"[ TrackingBatch.from_bytes ] Unsupported version {header['version']}"
+            )
+        rows = header["rows"]
+        columns = {}
+        for column in header["columns"]:
+            buffer = memoryview(data)[position : position + column["nbytes"]]
+            position += column["nbytes"]
+            if column["dtype"] == TrackingBatch.TEXT:
+                offsets = np.frombuffer(buffer, dtype="<i8", count=rows + 1)
+                text = bytes(buffer[offsets.nbytes :])
+                columns[column["name"]] = np.array(
+                    [
+                        text[start:end].decode("utf-8")
+                        for start, end in zip(offsets[:-1], offsets[1:])
+                    ],
+                    dtype=object,
+                ).reshape(-1)
+            elif column["dtype"] == TrackingBatch.TIMESTAMP:
+                columns[column["name"]] = np.frombuffer(buffer, dtype="<i8")
+            else:
+                columns[column["name"]] = np.frombuffer(buffer, dtype=column["dtype"])
+        return cls(
+            header["table"],
+            header["username"],
+            header["filename"],
+            columns,
+            header["last_time"],
+        )
+
+    def get_timestamps(self, name: str) -> np.ndarray:
+        return self.columns[name].astype("datetime64[us]")
+
+    def to_models(self) -> list[UserInput] | list[WindowsActivity]:
+        """Rows of the batch as the per-row models of the legacy upload."""
+        model = UserInput if self.table == "user_input" else WindowsActivity
+        columns = {
+            name: (
+                self.get_timestamps(name).tolist()
+                if dtype == TrackingBatch.TIMESTAMP
+                else self.columns[name].tolist()
+            )
+            for name, dtype in TrackingBatch.SCHEMAS[self.table].items()
+        }
+        return [
+            model(
+                username=self.username,
+                filename=self.filename,
+                **{name: values[index] for name, values in columns.items()},
+            )
+            for index in range(len(self))
+        ]
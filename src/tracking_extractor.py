@@ -0,0 +1,206 @@
+import os
+import logging
+import sqlite3 as sql
+from contextlib import closing
+from pathlib import Path
+from typing import Iterator
+
+from pydantic import BaseModel
+
+from personal_analytics import UserInput, WindowsActivity
+from tracking_batch import TrackingBatch
+
+
+class TrackingChunk(BaseModel):
+    filename: str
+    table: str
+    # UserInput or WindowsActivity rows, ordered by id
+    rows: list
+    last_id: int
+    last_time: str
+
+
+def open_tracking_file(path: str, immutable: bool = False) -> sql.Connection:
+    """Opens a .pa.dat file read-only. In immutable mode SQLite takes no lock at
+    all, so the reader never waits for the PersonalAnalytics writer nor blocks it,
+    but it may see a page the writer is changing."""
+    query = "mode=ro&immutable=1" if immutable else "mode=ro"
+    return sql.connect(f"{Path(path).resolve().as_uri()}?{query}", uri=True)
+
+
+def to_tracking_model(filename: str, table: str, row: tuple):
+    if table == "user_input":
+        return UserInput(
+            filename=filename,
+            id=row[0],
+            time=row[1],
+            tsStart=row[2],
+            tsEnd=row[3],
+            keyTotal=row[4],
+            clickTotal=row[5],
+            scrollDelta=row[6],
+            movedDistance=row[7],
+        )
+    return WindowsActivity(
+        filename=filename,
+        id=row[0],
+        time=row[1],
+        tsStart=row[2],
+        tsEnd=row[3],
+        window=row[4],
+        process=row[5],
+    )
+
+
+def to_tracking_chunk(filename: str, table: str, rows: list[tuple]) -> TrackingChunk:
+    return TrackingChunk(
+        filename=filename,
+        table=table,
+        rows=[to_tracking_model(filename, table, row) for row in rows],
+        last_id=rows[-1][0],
+        last_time=str(rows[-1][1]),
+    )
+
+
+class TrackingExtractor:
+    """Reads the rows added to the PersonalAnalytics databases (.pa.dat files)
+    since the previous export.
+
+    For every file and table, the id and the time of the last exported row are
+    kept in the local database. Only the rows after that id are read, in chunks of
+    chunk_size rows, so a dump costs as much as the new data and never holds more
+    than one chunk in memory. If the row of the checkpoint is gone or has another
+    time, the file was replaced and it is read again from the start.
+
+    A checkpoint only moves forward when the consumer calls save_checkpoint with a
+    chunk it handled, so rows that could not be exported are read again next time.
+
+    This class performs data validation for the following environment variables
+    - SQLITE_DB_PATH: database the checkpoints are saved in
+    - TRACKING_CHUNK_SIZE: number of rows per chunk (default 5000)
+    """
+
+    DEFAULT_CHUNK_SIZE = 5000
+
+    COLUMNS = {
+        "user_input": "id, time, tsStart, tsEnd, keyTotal, clickTotal, scrollDelta, movedDistance",
+        "windows_activity": "id, time, tsStart, tsEnd, window, process",
+    }
+
+    def __init__(self, base_dir: str, chunk_size: int | None = None) -> None:
+        self.db_path = os.getenv("SQLITE_DB_PATH", None)
+        if self.db_path is None:
+            raise ValueError(
+                "[ TrackingExtractor ] The database path was not set in the environment variables"
+            )
+        if chunk_size is None:
+            chunk_size = int(
+                os.getenv("TRACKING_CHUNK_SIZE", TrackingExtractor.DEFAULT_CHUNK_SIZE)
+            )
+        if chunk_size <= 0:
+            raise ValueError("[ TrackingExtractor ] The chunk size has to be positive")
+        self.base_dir = base_dir
+        self.chunk_size = chunk_size
+
+        self.table_was_created = False
+        self.rows_read = 0
+        self.chunks_read = 0
+        self.reset_count = 0
+
+    def create_table_if_not_exists(self) -> None:
+        with closing(sql.connect(self.db_path)) as db:
+            db.execute("""
+                    CREATE TABLE IF NOT EXISTS tracking_checkpoints (
+                        filename TEXT,
+                        table_name TEXT,
+                        last_id INTEGER,
+                        last_time TEXT,
+                        PRIMARY KEY (filename, table_name)
+                    );
+                """)
+            db.commit()
+        self.table_was_created = True
+
+    def get_checkpoint(self, filename: str, table: str) -> tuple[int, str] | None:
+        if not self.table_was_created:
+            self.create_table_if_not_exists()
+        with closing(sql.connect(self.db_path)) as db:
+            return db.execute(
+                """
+                SELECT last_id, last_time FROM tracking_checkpoints
+                WHERE filename = ? AND table_name = ?
+                """,
+                (filename, table),
+            ).fetchone()
+
+    def save_checkpoint(self, chunk: TrackingChunk | TrackingBatch) -> None:
+        """Marks the rows of the chunk, and every row before them, as exported."""
+        if not self.table_was_created:
+            self.create_table_if_not_exists()
+        with closing(sql.connect(self.db_path)) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO tracking_checkpoints VALUES (?, ?, ?, ?)",
+                (chunk.filename, chunk.table, chunk.last_id, chunk.last_time),
+            )
+            db.commit()
+
+    def list_files(self) -> list[str]:
+        return sorted(
+            os.path.join(self.base_dir, filename)
+            for filename in os.listdir(self.base_dir)
+            if filename.endswith(".pa.dat")
+        )
+
+    def get_resume_id(self, conn: sql.Connection, filename: str, table: str) -> int:
+        """Id after which the rows of the table were not exported yet."""
+        checkpoint = self.get_checkpoint(filename, table)
+        if checkpoint is None:
+            return 0
+        last_id, last_time = checkpoint
+        row = conn.execute(
+            f"SELECT time FROM {table} WHERE id = ?", (last_id,)
+        ).fetchone()
+        if row is None or str(row[0]) != last_time:
+            self.reset_count += 1
+            logging.info(
+                f"[ TrackingExtractor.get_resume_id ] {filename} was replaced, reading {table} again from the start"
+            )
+            return 0
+        return last_id
+
+    def iter_chunks(self, path: str, table: str) -> Iterator[TrackingChunk]:
+        """Yields the rows of the table added since the checkpoint of the file."""
+        if table not in TrackingExtractor.COLUMNS:
+            raise ValueError(f"[ TrackingExtractor.iter_chunks ] Unknown table {table}")
+        filename = os.path.basename(path)
+        # Read-only, the PersonalAnalytics service keeps writing to the file
+        with closing(open_tracking_file(path)) as conn:
+            last_id = self.get_resume_id(conn, filename, table)
+            while True:
+                rows = conn.execute(
+                    f"""
+                    SELECT {TrackingExtractor.COLUMNS[table]} FROM {table}
+                    WHERE id > ? ORDER BY id LIMIT ?
+                    """,
+                    (last_id, self.chunk_size),
+                ).fetchall()
+                if len(rows) == 0:
+                    return
+                last_id = rows[-1][0]
+                self.rows_read += len(rows)
+                self.chunks_read += 1
+                yield to_tracking_chunk(filename, table, rows)
+
+    def iter_new_data(self) -> Iterator[TrackingChunk]:
+        """Yields the new rows of every table of every file under the base
+        directory."""
+        for path in self.list_files():
+            for table in TrackingExtractor.COLUMNS:
+                yield from self.iter_chunks(path, table)
+
+    def get_stats(self) -> dict:
+        return {
+            "rows_read": self.rows_read,
+            "chunks_read": self.chunks_read,
+            "reset_count": self.reset_count,
+        }
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import closing
+from typing import Callable, Iterator
+
+from tracking_batch import TrackingBatch
+from tracking_extractor import (
+    TrackingChunk,
+    TrackingExtractor,
+    open_tracking_file,
+    to_tracking_chunk,
+)
+
+
+def read_tracking_range(
+    path: str, table: str, after_id: int, until_id: int, immutable: bool
+) -> tuple[list[tuple], float]:
+    """Runs in the worker processes. Reads the rows of the table whose id is in
+    (after_id, until_id], and returns them with the time it took."""
+    start = time.perf_counter()
+    with closing(open_tracking_file(path, immutable)) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {TrackingExtractor.COLUMNS[table]} FROM {table}
+            WHERE id > ? AND id <= ? ORDER BY id
+            """,
+            (after_id, until_id),
+        ).fetchall()
+    return rows, time.perf_counter() - start
+
+
+def read_tracking_batch(
+    path: str,
+    table: str,
+    after_id: int,
+    until_id: int,
+    immutable: bool,
+    username: str,
+) -> tuple[TrackingBatch, float]:
+    """Runs in the worker processes. Same as read_tracking_range, but returns the
+    rows as a columnar batch, whose arrays are cheap to send back."""
+    start = time.perf_counter()
+    rows, _ = read_tracking_range(path, table, after_id, until_id, immutable)
+    batch = TrackingBatch.from_rows(table, username, os.path.basename(path), rows)
+    return batch, time.perf_counter() - start
+
+
+class ParallelTrackingReader:
+    """Reads the new rows of the PersonalAnalytics databases in a process pool.
+
+    The new rows of every file and table (see TrackingExtractor) are split into id
+    ranges of chunk_size ids, which the worker processes read in parallel. The
+    workers send back the raw rows, since pickling the pydantic models costs
+    several times more than building them. The chunks are still yielded in the
+    order of the sequential extractor, file by file, table by table and by id, so
+    the consumer can save the checkpoint of every chunk it handled. At most two
+    ranges per worker are in flight, which bounds the memory held by chunks
+    waiting for an earlier one.
+
+    The rows are only read up to the highest id seen when the read starts. The rows
+    added later are read by the next export.
+
+    The reader is configured through the following environment variables
+    - TRACKING_READER_WORKERS: number of worker processes (default: one per core)
+    - TRACKING_IMMUTABLE: opens the files in SQLite immutable mode (default true)
+    """
+
+    def __init__(
+        self,
+        extractor: TrackingExtractor,
+        workers: int | None = None,
+        immutable: bool | None = None,
+    ) -> None:
+        if workers is None:
+            workers = int(os.getenv("TRACKING_READER_WORKERS", os.cpu_count() or 1))
+        if immutable is None:
+            immutable = os.getenv("TRACKING_IMMUTABLE", "true").lower() != "false"
+        if workers <= 0:
+            raise ValueError(
+                "[ ParallelTrackingReader.__init__ ] The number of workers has to be positive"
+            )
+        self.extractor = extractor
+        self.workers = workers
+        self.immutable = immutable
+
+        # Rows read and seconds spent reading them, per file
+        self.file_rows: dict[str, int] = {}
+        self.file_seconds: dict[str, float] = {}
+        self.elapsed_seconds: float | None = None
+
+    def plan(self) -> list[tuple[str, str, int, int]]:
+        """Returns the (path, table, after_id, until_id) ranges to read, in order."""
+        ranges = []
+        for path in self.extractor.list_files():
+            filename = os.path.basename(path)
+            with closing(open_tracking_file(path)) as conn:
+                for table in TrackingExtractor.COLUMNS:
+                    after_id = self.extractor.get_resume_id(conn, filename, table)
+                    max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+                    if max_id is None:
+                        continue
+                    while after_id < max_id:
+                        until_id = min(after_id + self.extractor.chunk_size, max_id)
+                        ranges.append((path, table, after_id, until_id))
+                        after_id = until_id
+        return ranges
+
+    def _record(
+        self, filename: str, table: str, rows: list[tuple], seconds: float
+    ) -> TrackingChunk | None:
+        self.file_seconds[filename] = self.file_seconds.get(filename, 0) + seconds
+        if len(rows) == 0:
+            return None
+        self.file_rows[filename] = self.file_rows.get(filename, 0) + len(rows)
+        return to_tracking_chunk(filename, table, rows)
+
+    def _iter_ranges(
+        self,
+        ranges: list[tuple[str, str, int, int]],
+        read: Callable = read_tracking_range,
+        *args,
+    ) -> Iterator[tuple[str, str, object, float]]:
+        """Yields what read returns for every range, in order. The extra arguments
+        are passed to read after the range."""
+        workers = min(self.workers, len(ranges))
+        if workers == 1:
+            # Starting a process would only add to the time of the read
+            for path, table, after_id, until_id in ranges:
+                rows, seconds = read(
+                    path, table, after_id, until_id, self.immutable, *args
+                )
+                yield os.path.basename(path), table, rows, seconds
+            return
+
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            # Same start method as the screenshot encoder, which also runs on
+            # Windows
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        pending: deque[tuple[str, str, Future]] = deque()
+        next_range = 0
+        try:
+            while next_range < len(ranges) or len(pending) > 0:
+                while next_range < len(ranges) and len(pending) < 2 * workers:
+                    path, table, after_id, until_id = ranges[next_range]
+                    future = executor.submit(
+                        read,
+                        path,
+                        table,
+                        after_id,
+                        until_id,
+                        self.immutable,
+                        *args,
+                    )
+                    pending.append((os.path.basename(path), table, future))
+                    next_range += 1
+                filename, table, future = pending.popleft()
+                rows, seconds = future.result()
+                yield filename, table, rows, seconds
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_new_data(self) -> Iterator[TrackingChunk]:
+        start = time.perf_counter()
+        ranges = self.plan()
+        if len(ranges) == 0:
+            return
+        try:
+            for filename, table, rows, seconds in self._iter_ranges(ranges):
+                chunk = self._record(filename, table, rows, seconds)
+                if chunk is not None:
+                    yield chunk
+        finally:
+            self.elapsed_seconds = time.perf_counter() - start
+            logging.info(
+                f"[ ParallelTrackingReader.iter_new_data ] Read {sum(self.file_rows.values())} rows in {self.elapsed_seconds:.2f} seconds"
+            )
+
+    def iter_new_batches(self, username: str) -> Iterator[TrackingBatch]:
+        """Same as iter_new_data, but the workers build columnar batches instead of
+        sending back the rows. The batches can be given to save_checkpoint of the
+        extractor as well."""
+        start = time.perf_counter()
+        ranges = self.plan()
+        if len(ranges) == 0:
+            return
+        try:
+            for filename, table, batch, seconds in self._iter_ranges(
+                ranges, read_tracking_batch, username
+            ):
+                self.file_seconds[filename] = (
+                    self.file_seconds.get(filename, 0) + seconds
+                )
+                if len(batch) == 0:
+                    continue
+                self.file_rows[filename] = self.file_rows.get(filename, 0) + len(batch)
+                yield batch
+        finally:
+            self.elapsed_seconds = time.perf_counter() - start
+            logging.info(
+                f"[ ParallelTrackingReader.iter_new_batches ] Read {sum(self.file_rows.values())} rows in {self.elapsed_seconds:.2f} seconds"
+            )
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "elapsed_seconds": self.elapsed_seconds,
+            "rows": sum(self.file_rows.values()),
+            "rows_per_second": (
+                sum(self.file_rows.values()) / self.elapsed_seconds
+                if self.elapsed_seconds
+                else None
+            ),
+            # Reading speed of the workers, per file
+            "files": {
+                filename: {
+                    "rows": self.file_rows.get(filename, 0),
+                    "seconds": seconds,
+                    "rows_per_second": (
+                        self.file_rows.get(filename, 0) / seconds
+                        if seconds > 0
+                        else None
+                    ),
+                }
+                for filename, seconds in self.file_seconds.items()
+            },
+        }
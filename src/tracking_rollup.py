@@ -0,0 +1,208 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from tracking_batch import TrackingBatch
+
+
+class TrackingRollup:
+    """Aggregates of the tracking rows of a student, per interval.
+
+    The backend only uses the tracking data in aggregate, so the rows can be rolled
+    up locally and the rollup uploaded instead of, or ahead of, the raw rows. The
+    intervals are either fixed (every interval_seconds, per minute by default) or
+    given by their boundaries, for instance the times the feedbacks were collected.
+    A row belongs to the interval its ts_start falls in; rows outside of the
+    boundaries, or without ts_start, are left out.
+
+    Every batch added is aggregated with NumPy (bincount and ufunc.at over the
+    interval of every row) and merged into the intervals seen so far. For every
+    interval the rollup has
+    - the number of user_input rows, the sums and the maxima of their counters
+    - active_seconds: duration of the user_input rows with any input
+    - the number of windows_activity rows and window_switches: rows whose window
+      or process differs from the previous row of the same file
+
+    The length of the fixed intervals is configured through TRACKING_ROLLUP_SECONDS.
+    """
+
+    DEFAULT_INTERVAL_SECONDS = 60
+
+    COUNTERS = ("keys_total", "clicks_total", "scroll_delta", "moved_distance")
+    SUM_COLUMNS = (
+        "user_input_rows",
+        *COUNTERS,
+        "active_seconds",
+        "windows_activity_rows",
+        "window_switches",
+    )
+    MAX_COLUMNS = tuple(f"{counter}_max" for counter in COUNTERS)
+
+    def __init__(
+        self,
+        username: str,
+        interval_seconds: float | None = None,
+        boundaries: list[datetime] | None = None,
+    ) -> None:
+        if interval_seconds is None and boundaries is None:
+            interval_seconds = float(
+                os.getenv(
+                    "TRACKING_ROLLUP_SECONDS", TrackingRollup.DEFAULT_INTERVAL_SECONDS
+                )
+            )
+        if interval_seconds is not None and interval_seconds <= 0:
+            raise ValueError(
+                "[ TrackingRollup.__init__ ] The interval has to be positive"
+            )
+        self.username = username
+        self.interval = (
+            int(interval_seconds * 1e6) if interval_seconds is not None else None
+        )
+        self.boundaries = None
+        if boundaries is not None:
+            self.boundaries = np.array(boundaries, dtype="datetime64[us]").astype(
+                np.int64
+            )
+            if len(self.boundaries) < 2 or np.any(np.diff(self.boundaries) <= 0):
+                raise ValueError(
+                    "[ TrackingRollup.__init__ ] The boundaries have to be at least two increasing times"
+                )
+
+        # Start of every interval (epoch microseconds), sorted, and its aggregates
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.columns = {name: np.zeros(0) for name in TrackingRollup.SUM_COLUMNS} | {
+            name: np.zeros(0) for name in TrackingRollup.MAX_COLUMNS
+        }
+        # Window and process of the last windows_activity row, per file
+        self.last_windows: dict[str, str] = {}
+        self.rows_added = 0
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _get_starts(self, timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the start of the interval of every timestamp inside the
+        intervals, and the mask of these timestamps. NaT is in no interval."""
+        if self.boundaries is None:
+            inside = timestamps != TrackingBatch.NAT
+            return timestamps[inside] // self.interval * self.interval, inside
+        # NaT sorts before the first boundary
+        indices = np.searchsorted(self.boundaries, timestamps, side="right") - 1
+        inside = (indices >= 0) & (indices < len(self.boundaries) - 1)
+        return self.boundaries[indices[inside]], inside
+
+    def _get_end(self, start: int) -> int:
+        if self.boundaries is None:
+            return start + self.interval
+        return int(self.boundaries[np.searchsorted(self.boundaries, start) + 1])
+
+    def _merge(self, starts_added: np.ndarray, values: dict[str, np.ndarray]) -> None:
+        """Aggregates the values of the rows starting at the given intervals into
+        the rollup. Missing columns count as zero in the sums and are ignored by
+        the maxima."""
+        starts, inverse = np.unique(
+            np.concatenate([self.starts, starts_added]), return_inverse=True
+        )
+        columns = {}
+        for name, column in self.columns.items():
+            if name in values:
+                merged = np.concatenate([column, values[name]])
+            else:
+                empty = 0 if name in TrackingRollup.SUM_COLUMNS else -np.inf
+                merged = np.concatenate([column, np.full(len(starts_added), empty)])
+            if name in TrackingRollup.SUM_COLUMNS:
+                columns[name] = np.bincount(
+                    inverse, weights=merged, minlength=len(starts)
+                )
+            else:
+                columns[name] = np.full(len(starts), -np.inf)
+                np.maximum.at(columns[name], inverse, merged)
+        self.starts = starts
+        self.columns = columns
+
+    def _add_user_input(self, batch: TrackingBatch) -> None:
+        starts, inside = self._get_starts(batch.columns["ts_start"])
+        counters = {
+            name: batch.columns[name][inside].astype(np.float64)
+            for name in TrackingRollup.COUNTERS
+        }
+        active = np.logical_or.reduce([counter != 0 for counter in counters.values()])
+        ends = batch.columns["ts_end"][inside]
+        # A row without ts_end counts as not active
+        durations = (
+            np.where(
+                ends != TrackingBatch.NAT, ends - batch.columns["ts_start"][inside], 0
+            )
+            / 1e6
+        )
+        self._merge(
+            starts,
+            {
+                "user_input_rows": np.ones(len(starts)),
+                "active_seconds": np.where(active, np.maximum(durations, 0), 0),
+            }
+            | counters
+            | {f"{name}_max": counter for name, counter in counters.items()},
+        )
+
+    def _add_windows_activity(self, batch: TrackingBatch) -> None:
+        windows = batch.columns["window_name"] + "\x00" + batch.columns["process_name"]
+        previous = np.empty(len(windows), dtype=object)
+        previous[0] = self.last_windows.get(batch.filename, windows[0])
+        previous[1:] = windows[:-1]
+        self.last_windows[batch.filename] = windows[-1]
+
+        starts, inside = self._get_starts(batch.columns["ts_start"])
+        self._merge(
+            starts,
+            {
+                "windows_activity_rows": np.ones(len(starts)),
+                "window_switches": (windows != previous)[inside].astype(np.float64),
+            },
+        )
+
+    def add(self, batch: TrackingBatch) -> None:
+        """Adds the rows of the batch. The batches of a file have to be added in
+        the order of their ids, as the reader yields them."""
+        if len(batch) == 0:
+            return
+        if batch.table == "user_input":
+            self._add_user_input(batch)
+        else:
+            self._add_windows_activity(batch)
+        self.rows_added += len(batch)
+
+    def to_records(self) -> list[dict]:
+        """Intervals of the rollup, ready to be uploaded as JSON."""
+        columns = {
+            name: (
+                column.astype(np.int64).tolist()
+                if name.endswith("_rows") or name == "window_switches"
+                else np.where(np.isinf(column), 0, column).tolist()
+            )
+            for name, column in self.columns.items()
+        }
+        return [
+            {
+                "username": self.username,
+                "interval_start": start.isoformat(),
+                "interval_end": (
+                    np.datetime64(self._get_end(int(self.starts[index])), "us")
+                    .item()
+                    .isoformat()
+                ),
+            }
+            | {name: values[index] for name, values in columns.items()}
+            for index, start in enumerate(self.starts.astype("datetime64[us]").tolist())
+        ]
+
+    def get_stats(self) -> dict:
+        return {
+            "rows_added": self.rows_added,
+            "intervals": len(self),
+            # How many rows every uploaded interval stands for
+            "compression_ratio": (
+                self.rows_added / len(self) if len(self) > 0 else None
+            ),
+        }
@@ -0,0 +1,72 @@
+"""Compares building and serialising a batch of tracking rows with the pydantic
+models and with the columnar batch.
+
+python tests/benchmark_tracking_batch.py --rows 1000000
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from tracking import UserInput
+from tracking_batch import TrackingBatch
+
+
+def measure(function) -> tuple[int, float, float]:
+    """Returns the size of the serialised batch, the seconds and the peak memory
+    in MB it took."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = len(function())
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return size, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows = [
+        (
+            row_id,
+            f"2024-01-01 10:{row_id // 60 % 60:02d}:{row_id % 60:02d}",
+            "2024-01-01 10:00:00",
+            "2024-01-01 10:01:00",
+            row_id % 7,
+            row_id % 3,
+            row_id % 11,
+            row_id % 13,
+        )
+        for row_id in range(1, args.rows + 1)
+    ]
+    fields = list(TrackingBatch.SCHEMAS["user_input"])
+
+    def pydantic_path() -> bytes:
+        models = [
+            UserInput(username="student", filename="a.pa.dat", **dict(zip(fields, row)))
+            for row in rows
+        ]
+        return json.dumps([model.model_dump() for model in models]).encode("utf-8")
+
+    def columnar_path() -> bytes:
+        return TrackingBatch.from_rows(
+            "user_input", "student", "a.pa.dat", rows
+        ).to_bytes()
+
+    results = {}
+    for name, function in [("pydantic", pydantic_path), ("columnar", columnar_path)]:
+        size, seconds, peak = measure(function)
+        results[name] = {"bytes": size, "seconds": seconds, "peak_mb": peak}
+    print(json.dumps({"rows": args.rows, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
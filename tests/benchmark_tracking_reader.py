@@ -0,0 +1,64 @@
+"""Compares the sequential and the parallel tracking readers on generated files.
+
+python tests/benchmark_tracking_reader.py --files 24 --rows 100000
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from pa_fixtures import create_pa_file
+from tracking_extractor import TrackingExtractor
+from tracking_reader import ParallelTrackingReader
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=24)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tmp_dir, "local.db")
+        pa_dir = os.path.join(tmp_dir, "pa")
+        os.mkdir(pa_dir)
+        for index in range(args.files):
+            create_pa_file(
+                os.path.join(pa_dir, f"{index:03d}.pa.dat"),
+                user_inputs=args.rows,
+                windows_activities=args.rows // 10,
+            )
+
+        # Nothing is checkpointed, so both readers read every row
+        extractor = TrackingExtractor(pa_dir)
+        start = time.perf_counter()
+        sequential_rows = sum(len(chunk.rows) for chunk in extractor.iter_new_data())
+        sequential_seconds = time.perf_counter() - start
+
+        reader = ParallelTrackingReader(extractor, workers=args.workers)
+        parallel_rows = sum(len(chunk.rows) for chunk in reader.iter_new_data())
+        assert parallel_rows == sequential_rows
+
+        stats = reader.get_stats()
+        print(
+            json.dumps(
+                {
+                    "rows": sequential_rows,
+                    "sequential_rows_per_second": sequential_rows / sequential_seconds,
+                    "parallel_rows_per_second": stats["rows_per_second"],
+                    "workers": stats["workers"],
+                    "files": stats["files"],
+                },
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
+import json
 import asyncio
 from typing import Annotated
 
+import websockets
+
 from fastapi import FastAPI, UploadFile, Depends
 from fastapi.security import OAuth2PasswordBearer
 
@@ -19,3 +22,44 @@ def create_timeout_case():
     ) -> dict:
         # Timeout should be triggered in 20 seconds
         await asyncio.sleep(20)
+
+
+class SessionProgressServer:
+    """Local WebSocket server pushing session progress updates, so the push mode
+    can be tested offline.
+
+    Every connection gets the queued updates and is then kept open, or closed when
+    close_after_updates is set, which makes the client reconnect.
+    """
+
+    def __init__(self, updates: list[dict], close_after_updates: bool = False):
+        self.updates = updates
+        self.close_after_updates = close_after_updates
+        self.connections: list = []
+        self.server = None
+
+    async def handler(self, websocket) -> None:
+        self.connections.append(websocket)
+        for update in self.updates:
+            await websocket.send(json.dumps(update))
+        if not self.close_after_updates:
+            await websocket.wait_closed()
+
+    def send(self, update: dict) -> None:
+        """Pushes an update to every open connection."""
+        websockets.broadcast(
+            [connection for connection in self.connections if connection.open],
+            json.dumps(update),
+        )
+
+    async def start(self) -> str:
+        self.server = await websockets.serve(self.handler, "localhost", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"ws://localhost:{port}"
+
+    async def stop(self) -> None:
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
@@ -0,0 +1,46 @@
+"""Generates PersonalAnalytics databases (.pa.dat files) for the tests and the
+benchmark of the tracking readers."""
+
+import sqlite3 as sql
+from contextlib import closing
+
+import pytest
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    """Directory of the .pa.dat files, with the local database next to it."""
+    monkeypatch.setenv("SQLITE_DB_PATH", str(tmp_path / "local.db"))
+    pa_dir = tmp_path / "pa"
+    pa_dir.mkdir()
+    return pa_dir
+
+
+def create_pa_file(path, user_inputs: int, windows_activities: int = 0, start: int = 1):
+    with closing(sql.connect(path)) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_input (id INTEGER PRIMARY KEY, time TEXT, tsStart TEXT, tsEnd TEXT, keyTotal INTEGER, clickTotal INTEGER, scrollDelta INTEGER, movedDistance INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS windows_activity (id INTEGER PRIMARY KEY, time TEXT, tsStart TEXT, tsEnd TEXT, window TEXT, process TEXT)"
+        )
+        add_rows(conn, "user_input", user_inputs, start)
+        add_rows(conn, "windows_activity", windows_activities, start)
+
+
+def add_rows(conn, table: str, count: int, start: int = 1, minute: int = 0) -> None:
+    times = [
+        (row_id, f"2024-01-01 10:{minute:02d}:{row_id % 60:02d}")
+        for row_id in range(start, start + count)
+    ]
+    if table == "user_input":
+        conn.executemany(
+            "INSERT INTO user_input VALUES (?, ?, ?, ?, 1, 2, 3, 4)",
+            [(row_id, time, time, time) for row_id, time in times],
+        )
+    else:
+        conn.executemany(
+            "INSERT INTO windows_activity VALUES (?, ?, ?, ?, 'window', 'process')",
+            [(row_id, time, time, time) for row_id, time in times],
+        )
+    conn.commit()
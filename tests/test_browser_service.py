@@ -4,6 +4,8 @@ from unittest.mock import AsyncMock, Mock
 import asyncio
 
 from browser_service import BrowserService
+from services import SessionProgress
+from circuit_breaker import CircuitOpenError
 
 
 @pytest.fixture
@@ -17,6 +19,7 @@ def session_progress_has_finished_homework():
 def session_progress_has_not_finished_homework():
     mock = Mock()
     mock.has_finished_homework.return_value = False
+    mock.get_seconds_until_homework_finishes.return_value = 0
     return mock
 
 
@@ -104,3 +107,63 @@ class TestBrowserService:
             svc.is_running = False
         with pytest.raises(RuntimeError):
             await task
+
+    @pytest.mark.parametrize(
+        "stage, remaining_time, delay",
+        [
+            # Sleeps until the final seconds of the homework
+            ["homework", 200, 200 - 5 - 10],
+            ["homework", 20, 5],
+            # Polls in the final seconds
+            ["homework", 12, 1],
+            # The stage before the homework ends first
+            ["tutorial", 100, 90],
+            # Never sleeps more than the maximum
+            ["homework", 1800, 300],
+        ],
+    )
+    def test_wakeup_delay(
+        self, session_service_wait_zero, stage, remaining_time, delay
+    ):
+        svc = BrowserService(
+            session_service_wait_zero,
+            poll_seconds=1,
+            final_seconds=10,
+            max_sleep_seconds=300,
+        )
+        progress = SessionProgress(stage=stage, remaining_time=remaining_time)
+        assert svc.get_wakeup_delay(progress) == delay
+
+    def test_invalid_polling_interval(self, session_service_wait_zero):
+        with pytest.raises(ValueError):
+            BrowserService(session_service_wait_zero, poll_seconds=0)
+
+    @pytest.mark.asyncio
+    async def test_wakes_up_before_deadline(self):
+        session_service = Mock()
+        session_service.get_session_progress = AsyncMock(
+            side_effect=[
+                SessionProgress(stage="homework", remaining_time=1800),
+                SessionProgress(stage="homework", remaining_time=15),
+                SessionProgress(stage="homework", remaining_time=8),
+                SessionProgress(stage="homework", remaining_time=4),
+            ]
+        )
+        svc = BrowserService(
+            session_service, poll_seconds=0.01, final_seconds=10, max_sleep_seconds=0.02
+        )
+        await svc.start_browser_worker()
+        assert session_service.get_session_progress.call_count == 4
+
+    @pytest.mark.asyncio
+    async def test_waits_while_circuit_is_open(self):
+        session_service = Mock()
+        session_service.get_session_progress = AsyncMock(
+            side_effect=[
+                CircuitOpenError(0.02),
+                SessionProgress(stage="survey", remaining_time=0),
+            ]
+        )
+        svc = BrowserService(session_service, poll_seconds=0.01, max_sleep_seconds=1)
+        await svc.start_browser_worker()
+        assert session_service.get_session_progress.call_count == 2
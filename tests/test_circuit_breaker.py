@@ -0,0 +1,62 @@
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker(failure_threshold=3, reset_seconds=60)
+
+
+def fail(breaker: CircuitBreaker, times: int) -> None:
+    for _ in range(times):
+        breaker.before_call()
+        breaker.on_failure()
+
+
+class TestCircuitBreaker:
+    @pytest.mark.parametrize("failure_threshold, reset_seconds", [[0, 1], [1, -1]])
+    def test_invalid_parameters(self, failure_threshold, reset_seconds):
+        with pytest.raises(ValueError):
+            CircuitBreaker(failure_threshold, reset_seconds)
+
+    def test_opens_after_consecutive_failures(self, breaker):
+        fail(breaker, 2)
+        breaker.before_call()
+        breaker.on_success()
+        fail(breaker, 2)
+        assert breaker.get_state() == CircuitBreaker.CLOSED
+
+        fail(breaker, 1)
+        assert breaker.get_state() == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError) as error:
+            breaker.before_call()
+        assert 0 < error.value.retry_after <= 60
+        assert breaker.get_stats()["rejected_count"] == 1
+
+    def test_half_open_lets_a_single_probe_through(self, breaker):
+        fail(breaker, 3)
+        breaker.reset_seconds = 0
+        assert breaker.get_state() == CircuitBreaker.HALF_OPEN
+
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.on_success()
+        assert breaker.get_state() == CircuitBreaker.CLOSED
+        breaker.before_call()
+
+    def test_failed_probe_opens_again(self, breaker):
+        fail(breaker, 3)
+        breaker.opened_at -= 60
+        breaker.before_call()
+        breaker.on_failure()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+        assert breaker.get_stats()["open_count"] == 2
+
+    def test_released_probe_can_be_retried(self, breaker):
+        fail(breaker, 3)
+        breaker.opened_at -= 60
+        breaker.before_call()
+        breaker.release()
+        breaker.before_call()
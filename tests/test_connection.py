@@ -0,0 +1,86 @@
+import json
+import asyncio
+
+import pytest
+from unittest.mock import Mock, AsyncMock
+
+from connection import Connection
+from feedback import Feedback, PaFeedback
+from session import IamSession, User, Role
+
+
+@pytest.fixture
+def session():
+    return IamSession(
+        token="valid",
+        user=User(username="u", role=Role.STUDENT),
+        ip_address="localhost",
+        session_num=1,
+    )
+
+
+def make_feedback(screenshot_manifest: dict | None = None) -> Feedback:
+    return Feedback(
+        seqnum=1,
+        personal_analytics_data=PaFeedback(
+            isFocused=0,
+            numMouseClicks=12,
+            mouseScrollDistance=234,
+            mouseMoveDistance=10,
+            keyboardStrokes=10,
+        ),
+        screenshot="1.png",
+        screenshot_data=b"tiles",
+        screenshot_manifest=screenshot_manifest,
+    )
+
+
+class TestConnection:
+    @pytest.mark.asyncio
+    async def test_tile_manifest_is_sent_with_delta_screenshots(self, session):
+        c = Connection()
+        c.set_session(session)
+        c.http_client = Mock(
+            post=AsyncMock(return_value=Mock(json=lambda: {"valid": "feedback"}))
+        )
+        manifest = {"tile_size": 64, "tiles": [[0, 0]]}
+        assert await c.send_feedback(make_feedback(manifest))
+        params = c.http_client.post.call_args.kwargs["params"]
+        assert json.loads(params["tile_manifest"]) == manifest
+
+        assert await c.send_feedback(make_feedback())
+        assert "tile_manifest" not in c.http_client.post.call_args.kwargs["params"]
+
+    @pytest.mark.parametrize(
+        "student, finished",
+        [
+            [None, False],
+            [
+                {"sessions": [{"stage": "homework", "remaining_time_seconds": 60}]},
+                False,
+            ],
+            [{"sessions": [{"stage": "homework", "remaining_time_seconds": 3}]}, True],
+            [{"sessions": [{"stage": "survey", "remaining_time_seconds": 0}]}, True],
+        ],
+    )
+    def test_has_finished_homework(self, student, finished):
+        assert Connection.has_finished_homework(student) == finished
+
+    @pytest.mark.asyncio
+    async def test_homework_checks_share_one_fetch(self, session):
+        c = Connection()
+        c.set_session(session)
+        student = {"sessions": [{"stage": "survey", "remaining_time_seconds": 0}]}
+        c.http_client = Mock(
+            get=AsyncMock(return_value=Mock(status_code=200, json=lambda: student))
+        )
+        first = c.progress_hub.subscribe()
+        second = c.progress_hub.subscribe()
+        try:
+            assert await asyncio.wait_for(first.get(), timeout=5) == student
+            assert await asyncio.wait_for(second.get(), timeout=5) == student
+            assert await c.check_user_has_finished_homework()
+        finally:
+            c.progress_hub.unsubscribe(first)
+            c.progress_hub.unsubscribe(second)
+        assert c.http_client.get.call_count == 1
@@ -0,0 +1,81 @@
+import pytest
+import numpy as np
+
+from PIL import Image
+
+from deduplication import FrameDeduplicator, perceptual_hash, hamming_distance
+
+
+@pytest.fixture
+def gradient_image():
+    img = Image.new("RGB", (320, 240))
+    img.putdata([(x % 256, y % 256, 0) for y in range(240) for x in range(320)])
+    return img
+
+
+class TestPerceptualHash:
+    def test_same_image_has_same_hash(self, gradient_image):
+        assert perceptual_hash(np.asarray(gradient_image)) == perceptual_hash(
+            np.asarray(gradient_image.copy())
+        )
+
+    def test_small_change_has_small_distance(self, gradient_image):
+        changed = gradient_image.copy()
+        changed.paste((255, 255, 255), (0, 0, 4, 4))
+        distance = hamming_distance(
+            perceptual_hash(np.asarray(gradient_image)),
+            perceptual_hash(np.asarray(changed)),
+        )
+        assert distance <= 2
+
+    def test_different_image_has_large_distance(self, gradient_image):
+        flipped = gradient_image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        distance = hamming_distance(
+            perceptual_hash(np.asarray(gradient_image)),
+            perceptual_hash(np.asarray(flipped)),
+        )
+        assert distance > 10
+
+    def test_hash_does_not_depend_on_channel_order(self, gradient_image):
+        rgb = np.asarray(gradient_image)
+        assert perceptual_hash(rgb) == perceptual_hash(rgb[:, :, ::-1])
+
+
+class TestFrameDeduplicator:
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("SCREENSHOT_DEDUP_DISTANCE", raising=False)
+        dedup = FrameDeduplicator()
+        dedup.register_upload(1, 0, "s")
+        assert dedup.find_duplicate(0) is None
+
+    def test_distance_cannot_be_negative(self):
+        with pytest.raises(ValueError):
+            FrameDeduplicator(-1)
+
+    def test_no_reference_uploads(self):
+        dedup = FrameDeduplicator(4)
+        assert dedup.find_duplicate(0) is None
+
+    def test_close_hash_returns_reference_seqnum(self):
+        dedup = FrameDeduplicator(4)
+        dedup.register_upload(3, 0b1111, "s")
+        assert dedup.find_duplicate(0b0111) == 3
+
+    def test_far_hash_is_uploaded(self):
+        dedup = FrameDeduplicator(4)
+        dedup.register_upload(3, 0, "s")
+        assert dedup.find_duplicate(0b11111) is None
+
+    def test_skips_are_counted(self):
+        dedup = FrameDeduplicator(4)
+        dedup.register_skip(100)
+        dedup.register_skip(50)
+        assert dedup.get_stats()["frames_skipped"] == 2
+        assert dedup.get_stats()["bytes_saved"] == 150
+
+    def test_reset_forgets_reference(self):
+        dedup = FrameDeduplicator(4)
+        dedup.register_upload(3, 0, "s")
+        dedup.reset()
+        assert dedup.find_duplicate(0) is None
+        assert dedup.get_stats()["frames_uploaded"] == 0
@@ -0,0 +1,105 @@
+import pytest
+
+import numpy as np
+
+from delta import TileDeltaEncoder
+
+WIDTH = 100
+HEIGHT = 70
+TILE_SIZE = 16
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(HEIGHT, WIDTH, 4), dtype=np.uint8)
+
+
+def rebuild(previous: np.ndarray, manifest: dict, pixels: np.ndarray) -> np.ndarray:
+    if manifest["keyframe"]:
+        return pixels.copy()
+    frame = previous.copy()
+    cols = pixels.shape[1] // TILE_SIZE
+    for i, (row, col) in enumerate(manifest["tiles"]):
+        atlas_row, atlas_col = divmod(i, cols)
+        tile = pixels[
+            atlas_row * TILE_SIZE : (atlas_row + 1) * TILE_SIZE,
+            atlas_col * TILE_SIZE : (atlas_col + 1) * TILE_SIZE,
+        ]
+        target = frame[
+            row * TILE_SIZE : (row + 1) * TILE_SIZE,
+            col * TILE_SIZE : (col + 1) * TILE_SIZE,
+        ]
+        target[...] = tile[: target.shape[0], : target.shape[1]]
+    return frame
+
+
+class TestTileDeltaEncoder:
+    @pytest.mark.parametrize("tile_size, keyframe_interval", [[0, 1], [16, 0]])
+    def test_invalid_parameters(self, tile_size, keyframe_interval):
+        with pytest.raises(ValueError):
+            TileDeltaEncoder(tile_size, keyframe_interval)
+
+    def test_first_frame_is_keyframe(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        manifest, pixels = encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        assert manifest["keyframe"]
+        assert pixels.shape == (HEIGHT, WIDTH)
+
+    def test_unchanged_frame_has_no_tiles(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        manifest, _ = encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        assert not manifest["keyframe"]
+        assert manifest["tiles"] == []
+
+    def test_only_changed_tiles_are_kept(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        changed = frame.copy()
+        changed[0, 0] = 0
+        changed[HEIGHT - 1, WIDTH - 1] = 0
+        manifest, pixels = encoder.encode(changed.tobytes(), (WIDTH, HEIGHT))
+        assert manifest["tiles"] == [[0, 0], [HEIGHT // TILE_SIZE, WIDTH // TILE_SIZE]]
+        assert pixels.shape == (TILE_SIZE, 2 * TILE_SIZE)
+
+    def test_frames_can_be_rebuilt(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        manifest, pixels = encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        rebuilt = rebuild(None, manifest, pixels)
+        for y in range(0, HEIGHT, 20):
+            changed = frame.copy()
+            changed[y : y + 3, 10:40] = 255
+            manifest, pixels = encoder.encode(changed.tobytes(), (WIDTH, HEIGHT))
+            assert not manifest["keyframe"]
+            rebuilt = rebuild(rebuilt, manifest, pixels)
+            assert np.array_equal(
+                rebuilt, changed.view(np.uint32).reshape(HEIGHT, WIDTH)
+            )
+
+    def test_keyframe_interval(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 2)
+        keyframes = [
+            encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))[0]["keyframe"]
+            for _ in range(4)
+        ]
+        assert keyframes == [True, False, False, True]
+
+    def test_requested_keyframe(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        encoder.request_keyframe()
+        manifest, _ = encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        assert manifest["keyframe"]
+
+    def test_resolution_change_is_keyframe(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        manifest, _ = encoder.encode(frame[:50, :50].tobytes(), (50, 50))
+        assert manifest["keyframe"]
+
+    def test_large_change_is_keyframe(self, frame):
+        encoder = TileDeltaEncoder(TILE_SIZE, 10)
+        encoder.encode(frame.tobytes(), (WIDTH, HEIGHT))
+        manifest, _ = encoder.encode((255 - frame).tobytes(), (WIDTH, HEIGHT))
+        assert manifest["keyframe"]
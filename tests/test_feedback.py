@@ -0,0 +1,56 @@
+import pytest
+
+from feedback import Feedback, PaFeedback, get_screenshot_upload
+from screenshot import EncodedScreenshot, ScreenshotArchive
+
+
+def make_feedback(screenshot: str, screenshot_data: bytes | None) -> Feedback:
+    return Feedback(
+        seqnum=1,
+        personal_analytics_data=PaFeedback(
+            isFocused=1,
+            numMouseClicks=0,
+            mouseScrollDistance=0,
+            mouseMoveDistance=0,
+            keyboardStrokes=0,
+        ),
+        screenshot=screenshot,
+        screenshot_data=screenshot_data,
+    )
+
+
+class TestInMemoryScreenshots:
+    def test_encoded_screenshot_round_trip(self):
+        screenshot = EncodedScreenshot(
+            filepath="a.png", data=b"\x89PNG\x00", phash=42, manifest={"tiles": []}
+        )
+        decoded = EncodedScreenshot.model_validate(screenshot.model_dump())
+        assert decoded == screenshot
+        assert decoded.data == b"\x89PNG\x00"
+        assert "data" not in repr(screenshot)
+
+    def test_screenshot_is_uploaded_from_memory(self, tmp_path):
+        # The archived file does not exist (yet)
+        feedback = make_feedback(str(tmp_path / "a.png"), b"\x89PNG")
+        assert get_screenshot_upload(feedback) == ("a.png", b"\x89PNG", "image/png")
+        # The bytes are not part of the feedback saved in the local database
+        assert "screenshot_data" not in feedback.model_dump()
+
+    def test_screenshot_is_read_from_the_archive(self, tmp_path):
+        path = tmp_path / "a.jpg"
+        path.write_bytes(b"jpeg")
+        feedback = make_feedback(str(path), None)
+        assert get_screenshot_upload(feedback) == ("a.jpg", b"jpeg", "image/jpeg")
+
+    @pytest.mark.asyncio
+    async def test_archive_writes_in_the_background(self, tmp_path):
+        archive = ScreenshotArchive(enabled=True)
+        archive.schedule(str(tmp_path / "a.png"), b"png", {"tiles": []})
+        await archive.flush()
+        assert (tmp_path / "a.png").read_bytes() == b"png"
+        assert (tmp_path / "a.png.json").exists()
+
+        disabled = ScreenshotArchive(enabled=False)
+        disabled.schedule(str(tmp_path / "b.png"), b"png")
+        await disabled.flush()
+        assert not (tmp_path / "b.png").exists()
@@ -6,6 +6,16 @@ import asyncio
 from session import IamSession, User
 from feedback_colletor import FeedbackColletor
 from feedback import Feedback, PaFeedback
+from outbox import UploadOutbox
+
+
+@pytest.fixture(autouse=True)
+def outbox_env(tmp_path, monkeypatch):
+    # Every test gets an empty outbox, and failed uploads are retried right away.
+    # The screenshots are archived in the temporary directory too
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SQLITE_DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setenv("OUTBOX_RETRY_BASE_SECONDS", "0.01")
 
 
 @pytest.fixture
@@ -58,8 +68,10 @@ def session_service__with_successful_ingest():
     mock = Mock()
     mock.ingest_feedback = AsyncMock()
     mock.ingest_feedback.side_effect = [True, False]
-    mock.is_session_active = AsyncMock()
-    mock.is_session_active.side_effect = [True, False]
+    # The session is over once the backend received the second feedback
+    mock.is_session_active = AsyncMock(
+        side_effect=lambda: mock.ingest_feedback.call_count < 2
+    )
 
     return mock
 
@@ -76,6 +88,7 @@ def session_service_no_active_session():
 def repository():
     mock = Mock()
     mock.insert_new = AsyncMock()
+    mock.get_last_seqnum = AsyncMock(return_value=0)
 
     return mock
 
@@ -222,6 +235,29 @@ class TestFeedbackCollector:
         await c.start_collecting()
         assert repository.insert_new.call_count > 0
 
+    @pytest.mark.asyncio
+    async def test_saves_every_collected_feedback_before_exiting(
+        self,
+        session_service__with_successful_ingest,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        get_pa_feedback_data,
+    ):
+        c = FeedbackColletor(
+            session_service__with_successful_ingest,
+            iam_service_with_session,
+            repository,
+            timing_service,
+            queue_size=1,
+        )
+        c._get_feedback_personal_analytics = get_pa_feedback_data
+        await c.start_collecting()
+        assert repository.insert_new.call_count == c.get_feedback_count_for_session()
+        stats = c.get_pipeline_stats()
+        assert stats["persist"]["queue_depth"] == 0
+        assert stats["queue"]["processed_count"] == c.get_feedback_count_for_session()
+
     @pytest.mark.asyncio
     async def test_sends_feedbacks_to_server(
         self,
@@ -286,14 +322,16 @@ class TestFeedbackCollector:
         assert is_session_active == False
 
     @pytest.mark.asyncio
-    async def test_send_timeout_proceeds_next_iteration(
+    async def test_send_timeout_is_retried(
         self,
         ingest_feedback_fails_first_works_second,
         iam_service_with_session,
         repository,
         timing_service,
         get_pa_feedback_data,
+        monkeypatch,
     ):
+        monkeypatch.setenv("OUTBOX_LATEST_WINS", "false")
         c = FeedbackColletor(
             ingest_feedback_fails_first_works_second,
             iam_service_with_session,
@@ -303,14 +341,11 @@ class TestFeedbackCollector:
         c._get_feedback_personal_analytics = get_pa_feedback_data
         await c.start_collecting()
 
-        # A retry will trigger the send feedback method twice while only
-        # collecting one feedback
-        assert (
-            c.get_feedback_count_for_session() == 3
-        )  # collects one feedback more than the server processes
-        assert (
-            ingest_feedback_fails_first_works_second.ingest_feedback.call_count == 3
-        )  # last call will be the one to break the loop
+        # The feedback that timed out is sent again before the next one, and the
+        # uploads stop once the backend reports the end of the session
+        calls = ingest_feedback_fails_first_works_second.ingest_feedback.call_args_list
+        assert [call.args[0].seqnum for call in calls] == [1, 1, 2]
+        assert c.outbox.get_stats()["retry_count"] == 1
 
     @pytest.mark.asyncio
     async def test_running_twice_raises_exception(
@@ -382,3 +417,178 @@ class TestFeedbackCollector:
         await c.start_collecting()
 
         timing_service.finish_iteration.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_collection_steps_run_concurrently(
+        self, iam_service_with_session, repository, timing_service
+    ):
+        session_service = Mock()
+        session_service.ingest_feedback = AsyncMock(return_value=False)
+
+        async def is_session_active():
+            await asyncio.sleep(0.05)
+            return session_service.ingest_feedback.call_count == 0
+
+        async def get_pa_feedback_data():
+            await asyncio.sleep(0.05)
+            return PaFeedback(
+                numMouseClicks=0,
+                keyboardStrokes=0,
+                mouseMoveDistance=0,
+                mouseScrollDistance=0,
+                isFocused=0,
+            )
+
+        session_service.is_session_active = AsyncMock(side_effect=is_session_active)
+        c = FeedbackColletor(
+            session_service, iam_service_with_session, repository, timing_service
+        )
+        c._get_feedback_personal_analytics = get_pa_feedback_data
+        await c.start_collecting()
+
+        stats = c.get_pipeline_stats()["capture"]
+        assert stats["average_sequential_seconds"] >= 0.1
+        assert stats["average_saved_seconds"] >= 0.04
+
+    @pytest.mark.asyncio
+    async def test_seqnums_carry_on_after_a_restart(
+        self,
+        session_service__with_successful_ingest,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        get_pa_feedback_data,
+    ):
+        # Feedbacks 1 to 5 were saved and 6 was still in the outbox when the
+        # process stopped
+        repository.get_last_seqnum.return_value = 5
+        outbox = UploadOutbox()
+        await outbox.enqueue(
+            iam_service_with_session.get_iam_session(),
+            Feedback(
+                seqnum=6,
+                personal_analytics_data=await get_pa_feedback_data(),
+                screenshot="6.png",
+            ),
+        )
+        c = FeedbackColletor(
+            session_service__with_successful_ingest,
+            iam_service_with_session,
+            repository,
+            timing_service,
+            outbox=outbox,
+        )
+        c._get_feedback_personal_analytics = get_pa_feedback_data
+        await c.start_collecting()
+
+        seqnums = [call.args[0].seqnum for call in repository.insert_new.call_args_list]
+        assert seqnums[0] == 7
+
+    @pytest.mark.asyncio
+    async def test_pending_feedbacks_are_drained_before_exiting(
+        self,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        collect_feedback,
+    ):
+        session_service = Mock()
+        # The session ends with the first collected feedback, while its upload
+        # is still being retried
+        session_service.is_session_active = AsyncMock(side_effect=[True, False])
+        session_service.ingest_feedback = AsyncMock(
+            side_effect=[ConnectionError(), True]
+        )
+        c = FeedbackColletor(
+            session_service,
+            iam_service_with_session,
+            repository,
+            timing_service,
+        )
+        c._collect_feedback_data = collect_feedback
+        await c.start_collecting()
+
+        assert session_service.ingest_feedback.call_count == 2
+        assert (
+            await c.outbox.count_pending(iam_service_with_session.get_iam_session())
+            == 0
+        )
+
+    @pytest.mark.asyncio
+    async def test_collection_error_skips_the_iteration(
+        self,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        collect_feedback,
+    ):
+        session_service = Mock()
+        session_service.is_session_active = AsyncMock(side_effect=[True, True, False])
+        session_service.ingest_feedback = AsyncMock(return_value=False)
+        c = FeedbackColletor(
+            session_service,
+            iam_service_with_session,
+            repository,
+            timing_service,
+        )
+        feedback = collect_feedback.return_value
+        c._collect_feedback_data = AsyncMock(
+            side_effect=[ConnectionError("PA is unreachable"), feedback]
+        )
+        await c.start_collecting()
+
+        assert c._collect_feedback_data.call_count == 2
+        assert session_service.ingest_feedback.call_count == 1
+        assert repository.insert_new.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_collection_can_restart_after_a_failure(
+        self,
+        session_service__with_successful_ingest,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        collect_feedback,
+    ):
+        c = FeedbackColletor(
+            session_service__with_successful_ingest,
+            iam_service_with_session,
+            repository,
+            timing_service,
+        )
+        c._collect_feedback_data = collect_feedback
+        # Fails outside of the collection of a feedback
+        timing_service.wait.side_effect = RuntimeError("broken")
+        with pytest.raises(RuntimeError):
+            await c.start_collecting()
+
+        # The stages and the uploader were stopped
+        assert not c.worker_is_running
+        assert c.queue_stage.workers == []
+        assert c.persist_stage.workers == []
+        assert c.outbox.uploader_task is None
+
+        timing_service.wait.side_effect = None
+        await c.start_collecting()
+        assert session_service__with_successful_ingest.ingest_feedback.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_screen_capture_is_closed_when_the_collection_ends(
+        self,
+        session_service__with_successful_ingest,
+        iam_service_with_session,
+        repository,
+        timing_service,
+        collect_feedback,
+    ):
+        screen_capture = Mock(aclose=AsyncMock())
+        c = FeedbackColletor(
+            session_service__with_successful_ingest,
+            iam_service_with_session,
+            repository,
+            timing_service,
+            screen_capture=screen_capture,
+        )
+        c._collect_feedback_data = collect_feedback
+        await c.start_collecting()
+        screen_capture.aclose.assert_awaited_once()
@@ -0,0 +1,107 @@
+import pytest
+import pytest_asyncio
+import asyncio
+
+from health import BackendHealth
+from http_client import BackendClient
+
+
+def make_handler(body: bytes):
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        writer.close()
+
+    return handle
+
+
+@pytest_asyncio.fixture
+async def start_server():
+    servers = []
+
+    async def start(body: bytes) -> str:
+        server = await asyncio.start_server(make_handler(body), "127.0.0.1", 0)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+    yield start
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+
+class TestBackendHealth:
+    def test_invalid_retry_interval(self):
+        with pytest.raises(ValueError):
+            BackendHealth(BackendClient("http://localhost"), retry_seconds=0)
+
+    def test_state_is_unknown_before_the_check(self):
+        health = BackendHealth(BackendClient("http://localhost"))
+        assert health.get_readiness()["state"] == BackendHealth.UNKNOWN
+        assert not health.is_ready()
+
+    @pytest.mark.asyncio
+    async def test_ready_backend(self, start_server):
+        url = await start_server(b'{"status": "ok"}')
+        health = BackendHealth(BackendClient(url))
+        assert await health.check()
+        readiness = health.get_readiness()
+        assert readiness["state"] == BackendHealth.READY
+        assert readiness["checked_at"] is not None
+
+    @pytest.mark.asyncio
+    async def test_unhealthy_backend(self, start_server):
+        url = await start_server(b'{"status": "err"}')
+        health = BackendHealth(BackendClient(url))
+        assert not await health.check()
+        assert health.get_readiness()["state"] == BackendHealth.UNAVAILABLE
+        assert health.get_readiness()["error"] is not None
+
+    @pytest.mark.asyncio
+    async def test_probe_keeps_checking_once_ready(self):
+        health = BackendHealth(
+            BackendClient("http://127.0.0.1:1"),
+            retry_seconds=0.01,
+            interval_seconds=0.02,
+            enabled=True,
+        )
+        results = iter([False, True, True, False])
+        states = []
+
+        async def check():
+            ready = next(results, False)
+            health.state = BackendHealth.READY if ready else BackendHealth.UNAVAILABLE
+            states.append(health.state)
+            return ready
+
+        health.check = check
+        health.start()
+        # Starting the probe does not wait for the backend
+        assert health.probe_task is not None
+        while len(states) < 4:
+            await asyncio.sleep(0.01)
+        await health.stop()
+        # The backend going down after it was ready is reported
+        assert states[:4] == [
+            BackendHealth.UNAVAILABLE,
+            BackendHealth.READY,
+            BackendHealth.READY,
+            BackendHealth.UNAVAILABLE,
+        ]
+        assert not health.is_ready()
+
+    @pytest.mark.asyncio
+    async def test_probe_only_runs_in_production(self, monkeypatch):
+        monkeypatch.setenv("ENV", "DEV")
+        health = BackendHealth(BackendClient("http://127.0.0.1:1"))
+        health.start()
+        assert health.probe_task is None
+        assert health.get_readiness()["state"] == BackendHealth.UNKNOWN
+
+        monkeypatch.setenv("ENV", "PROD")
+        assert BackendHealth(BackendClient("http://127.0.0.1:1")).enabled
@@ -0,0 +1,161 @@
+import pytest
+import pytest_asyncio
+import asyncio
+import httpx
+
+from http_client import BackendClient, get_backend_client, close_backend_clients
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+async def handle_keep_alive(reader, writer):
+    # Minimal HTTP/1.1 server that keeps the connection open between requests
+    try:
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if not request:
+                break
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: 2\r\n\r\n{}"
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+@pytest_asyncio.fixture
+async def server_url():
+    server = await asyncio.start_server(handle_keep_alive, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}"
+    server.close()
+    await server.wait_closed()
+
+
+class TestBackendClient:
+    @pytest.mark.parametrize(
+        "max_connections, keepalive_seconds", [[0, 30], [-1, 30], [10, -1]]
+    )
+    def test_invalid_pool(self, max_connections, keepalive_seconds):
+        with pytest.raises(ValueError):
+            BackendClient("http://localhost", max_connections, keepalive_seconds)
+
+    def test_http2_without_h2_falls_back(self, monkeypatch):
+        monkeypatch.setenv("BACKEND_HTTP2", "true")
+        client = BackendClient("http://localhost")
+        try:
+            import h2
+        except ImportError:
+            assert client.http2 is False
+        else:
+            assert client.http2 is True
+
+    @pytest.mark.asyncio
+    async def test_connection_is_reused(self, server_url):
+        client = BackendClient(server_url)
+        try:
+            for _ in range(3):
+                response = await client.get("/health_check")
+                assert response.json() == {}
+        finally:
+            await client.aclose()
+        stats = client.get_stats()
+        assert stats["request_count"] == 3
+        assert stats["connection_count"] == 1
+        assert stats["connection_reuse_rate"] == pytest.approx(2 / 3)
+        assert stats["http_versions"] == {"HTTP/1.1": 3}
+
+    @pytest.mark.asyncio
+    async def test_client_is_recreated_after_close(self, server_url):
+        client = BackendClient(server_url)
+        await client.get("/")
+        await client.aclose()
+        await client.get("/")
+        await client.aclose()
+        assert client.get_stats()["connection_count"] == 2
+
+    def test_stats_without_requests(self):
+        assert (
+            BackendClient("http://localhost").get_stats()["connection_reuse_rate"]
+            is None
+        )
+
+    @pytest.mark.asyncio
+    async def test_latencies_are_tracked_per_endpoint(self, server_url):
+        client = BackendClient(server_url)
+        for _ in range(3):
+            await client.get("/", endpoint="root")
+        await client.get("/")
+        latency = client.get_stats()["latency"]
+        assert latency["root"]["count"] == 3
+        assert latency["connect"]["count"] == 1
+        assert latency["root"]["p50"] <= latency["root"]["p99"]
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_timeouts_are_recorded(self):
+        async def never_respond(reader, writer):
+            await asyncio.sleep(10)
+
+        server = await asyncio.start_server(never_respond, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = BackendClient(f"http://127.0.0.1:{port}")
+        with pytest.raises(httpx.ReadTimeout):
+            await client.get("/", endpoint="slow", timeout=0.05)
+        latency = client.get_stats()["latency"]["slow"]
+        assert latency["timeout_count"] == 1
+        # The timeout is not a latency sample
+        assert latency["count"] == 0
+        await client.aclose()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_unreachable_backend_fails_fast(self, server_url):
+        client = BackendClient(server_url)
+        client.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        # Nothing listens on the port of the backend anymore
+        client.base_url = "http://127.0.0.1:1"
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await client.get("/")
+        with pytest.raises(CircuitOpenError):
+            await client.get("/")
+        assert client.get_stats()["circuit_breaker"]["state"] == CircuitBreaker.OPEN
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_server_errors_open_the_circuit(self):
+        async def respond_with_error(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(
+                b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n"
+            )
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(respond_with_error, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = BackendClient(f"http://127.0.0.1:{port}")
+        client.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        response = await client.get("/")
+        assert response.status_code == 503
+        # The circuit is half-open right away, the next request is the probe
+        assert client.circuit_breaker.get_state() == CircuitBreaker.HALF_OPEN
+        await client.get("/")
+        # The failed probe opened it again
+        assert client.circuit_breaker.get_stats()["open_count"] == 2
+        await client.aclose()
+        server.close()
+
+
+class TestBackendClientRegistry:
+    @pytest.mark.asyncio
+    async def test_client_is_shared_per_backend(self, server_url):
+        client = get_backend_client(server_url)
+        assert get_backend_client(server_url) is client
+        assert get_backend_client("http://other") is not client
+        await client.get("/")
+        await close_backend_clients()
+        assert client.client is None
@@ -0,0 +1,122 @@
+import pytest
+
+from latency import LatencyTracker
+
+
+@pytest.fixture
+def tracker():
+    return LatencyTracker(
+        window_size=100,
+        min_samples=10,
+        timeout_multiplier=2,
+        min_timeout_seconds=1,
+        max_timeout_seconds=30,
+        backoff_after=3,
+    )
+
+
+class TestLatencyTracker:
+    @pytest.mark.parametrize(
+        "window_size, min_samples, timeout_multiplier, min_timeout, max_timeout, backoff_after",
+        [
+            [0, 1, 2, 1, 30, 3],
+            [10, 20, 2, 1, 30, 3],
+            [100, 10, 0.5, 1, 30, 3],
+            [100, 10, 2, 0, 30, 3],
+            [100, 10, 2, 30, 1, 3],
+            [100, 10, 2, 1, 30, 0],
+        ],
+    )
+    def test_invalid_parameters(
+        self,
+        window_size,
+        min_samples,
+        timeout_multiplier,
+        min_timeout,
+        max_timeout,
+        backoff_after,
+    ):
+        with pytest.raises(ValueError):
+            LatencyTracker(
+                window_size,
+                min_samples,
+                timeout_multiplier,
+                min_timeout,
+                max_timeout,
+                backoff_after,
+            )
+
+    def test_percentiles(self, tracker):
+        for seconds in range(1, 101):
+            tracker.record("ingest", seconds / 10)
+        assert tracker.get_percentile("ingest", 50) == 5
+        assert tracker.get_percentile("ingest", 95) == 9.5
+        assert tracker.get_percentile("ingest", 99) == 9.9
+        assert tracker.get_percentile("unknown", 99) is None
+
+    def test_window_forgets_old_latencies(self, tracker):
+        for _ in range(100):
+            tracker.record("ingest", 20)
+        for _ in range(100):
+            tracker.record("ingest", 1)
+        assert tracker.get_percentile("ingest", 99) == 1
+
+    def test_default_timeout_until_enough_samples(self, tracker):
+        for _ in range(9):
+            tracker.record("ingest", 0.1)
+        assert tracker.get_timeout("ingest", 15) == 15
+        tracker.record("ingest", 0.1)
+        # Twice the p99, raised to the minimum timeout
+        assert tracker.get_timeout("ingest", 15) == 1
+
+    @pytest.mark.parametrize("seconds, timeout", [[3, 6], [14, 28], [20, 30]])
+    def test_timeout_follows_latencies(self, tracker, seconds, timeout):
+        for _ in range(10):
+            tracker.record("ingest", seconds)
+        assert tracker.get_timeout("ingest", 15) == timeout
+
+    def test_timeouts_are_not_recorded_as_latencies(self, tracker):
+        for _ in range(10):
+            tracker.record("ingest", 3)
+        for _ in range(100):
+            tracker.record_timeout("ingest")
+        assert tracker.get_percentile("ingest", 99) == 3
+
+    def test_timeouts_in_a_row_double_the_timeout(self, tracker):
+        for _ in range(10):
+            tracker.record("ingest", 1)
+        for timeouts, timeout in [[2, 2], [3, 4], [6, 8], [9, 16], [12, 30]]:
+            while tracker.consecutive_timeouts.get("ingest", 0) < timeouts:
+                tracker.record_timeout("ingest")
+            assert tracker.get_timeout("ingest", 15) == timeout
+        tracker.record("ingest", 1)
+        assert tracker.get_timeout("ingest", 15) == 2
+
+    def test_timeout_recovers_when_the_latency_jumps(self, tracker):
+        for _ in range(100):
+            tracker.record("ingest", 1)
+        # The backend now answers in 10 seconds, above the adaptive timeout
+        completed = 0
+        for _ in range(100):
+            if 10 > tracker.get_timeout("ingest", 15):
+                tracker.record_timeout("ingest")
+            else:
+                tracker.record("ingest", 10)
+                completed += 1
+        assert tracker.get_timeout("ingest", 15) == 20
+        assert completed >= 80
+
+    def test_stats(self, tracker):
+        tracker.record("ingest", 2)
+        tracker.record_timeout("ingest")
+        tracker.record_timeout("health_check")
+        stats = tracker.get_stats()
+        assert stats["ingest"] == {
+            "count": 1,
+            "timeout_count": 1,
+            "p50": 2,
+            "p95": 2,
+            "p99": 2,
+        }
+        assert stats["health_check"]["count"] == 0
+        assert stats["health_check"]["p99"] is None
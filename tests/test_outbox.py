@@ -0,0 +1,352 @@
+import httpx
+import pytest
+import asyncio
+
+from unittest.mock import AsyncMock, Mock
+
+from feedback import Feedback, PaFeedback
+from outbox import UploadOutbox
+from session import IamSession, User
+
+
+def make_session(username="student", session_num=1) -> IamSession:
+    return IamSession(
+        token="token",
+        user=User(username=username, role="student"),
+        ip_address="localhost",
+        session_num=session_num,
+    )
+
+
+def make_status_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://backend/feedback")
+    return httpx.HTTPStatusError(
+        "error",
+        request=request,
+        response=httpx.Response(status_code, json={"status": "err"}, request=request),
+    )
+
+
+def make_feedback(seqnum: int, screenshot_data: bytes | None = b"png") -> Feedback:
+    return Feedback(
+        seqnum=seqnum,
+        personal_analytics_data=PaFeedback(
+            isFocused=1,
+            numMouseClicks=0,
+            mouseScrollDistance=0,
+            mouseMoveDistance=0,
+            keyboardStrokes=0,
+        ),
+        screenshot=f"{seqnum}.png",
+        screenshot_data=screenshot_data,
+    )
+
+
+@pytest.fixture
+def outbox_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_DB_PATH", str(tmp_path / "outbox.db"))
+    return tmp_path
+
+
+@pytest.fixture
+def outbox(outbox_env):
+    return UploadOutbox(
+        retry_base_seconds=0.01, retry_max_seconds=0.05, latest_wins=False
+    )
+
+
+@pytest.fixture
+def latest_wins_outbox(outbox_env):
+    return UploadOutbox(
+        retry_base_seconds=0.01, retry_max_seconds=0.05, latest_wins=True
+    )
+
+
+class TestUploadOutbox:
+    def test_missing_database_path_raises(self, monkeypatch):
+        monkeypatch.delenv("SQLITE_DB_PATH", raising=False)
+        with pytest.raises(ValueError):
+            UploadOutbox()
+
+    def test_negative_delay_raises(self, outbox_env):
+        with pytest.raises(ValueError):
+            UploadOutbox(retry_base_seconds=-1)
+
+    def test_invalid_max_attempts_raises(self, outbox_env):
+        with pytest.raises(ValueError):
+            UploadOutbox(max_attempts=0)
+
+    def test_latest_wins_is_off_by_default(self, outbox_env, monkeypatch):
+        monkeypatch.delenv("OUTBOX_LATEST_WINS", raising=False)
+        assert not UploadOutbox().latest_wins
+
+    def test_latest_wins_is_refused_with_delta_encoding(self, outbox_env, monkeypatch):
+        monkeypatch.setenv("SCREENSHOT_DELTA", "true")
+        with pytest.raises(ValueError):
+            UploadOutbox(latest_wins=True)
+        assert not UploadOutbox().latest_wins
+
+    def test_retry_delay_is_bounded(self, outbox):
+        for attempts in range(50):
+            delay = outbox.get_retry_delay(attempts)
+            assert 0 <= delay <= min(0.05, 0.01 * 2**attempts)
+
+    @pytest.mark.asyncio
+    async def test_feedback_survives_restart(self, outbox):
+        session = make_session()
+        await outbox.enqueue(session, make_feedback(1, b"\x89PNG"))
+
+        reopened = UploadOutbox()
+        entry_id, feedback, lane, attempts, _ = await reopened.peek(session)
+        assert feedback.seqnum == 1
+        assert feedback.screenshot_data == b"\x89PNG"
+        assert lane == UploadOutbox.REALTIME_LANE
+        assert attempts == 0
+
+    @pytest.mark.asyncio
+    async def test_uploads_in_order_and_retries(self, outbox):
+        session = make_session()
+        for seqnum in [1, 2, 3]:
+            await outbox.enqueue(session, make_feedback(seqnum))
+        upload = AsyncMock(side_effect=[ConnectionError(), True, True, False])
+
+        await asyncio.wait_for(outbox.run_uploader(session, upload), timeout=5)
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [1, 1, 2, 3]
+        assert await outbox.count_pending(session) == 0
+        assert outbox.get_stats()["retry_count"] == 1
+        assert outbox.get_stats()["uploaded_count"] == 3
+
+    @pytest.mark.asyncio
+    async def test_rejected_feedback_does_not_block_the_queue(self, outbox):
+        session = make_session()
+        for seqnum in [1, 2, 3]:
+            await outbox.enqueue(session, make_feedback(seqnum))
+        upload = AsyncMock(side_effect=[make_status_error(422), True, False])
+
+        await asyncio.wait_for(outbox.run_uploader(session, upload), timeout=5)
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [1, 2, 3]
+        assert await outbox.count_pending(session) == 0
+        assert outbox.get_stats()["retry_count"] == 0
+        assert outbox.get_stats()["dead_letter_count"] == 1
+        # Dead letters still count for the seqnums of the session
+        assert await outbox.get_last_seqnum(session) == 1
+
+    @pytest.mark.parametrize("error", [make_status_error(503), ValueError()])
+    @pytest.mark.asyncio
+    async def test_failing_feedback_is_given_up_after_max_attempts(
+        self, outbox_env, error
+    ):
+        outbox = UploadOutbox(
+            retry_base_seconds=0.01,
+            retry_max_seconds=0.05,
+            latest_wins=False,
+            max_attempts=3,
+        )
+        session = make_session()
+        for seqnum in [1, 2]:
+            await outbox.enqueue(session, make_feedback(seqnum))
+        upload = AsyncMock(side_effect=[error, error, error, False])
+
+        await asyncio.wait_for(outbox.run_uploader(session, upload), timeout=5)
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [1, 1, 1, 2]
+        assert outbox.get_stats()["retry_count"] == 2
+        assert outbox.get_stats()["dead_letter_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_uploader_waits_for_new_feedbacks(self, outbox):
+        session = make_session()
+        upload = AsyncMock(return_value=False)
+        outbox.start(session, upload)
+        await asyncio.sleep(0.05)
+        assert upload.call_count == 0
+
+        await outbox.enqueue(session, make_feedback(1))
+        await asyncio.wait_for(outbox.uploader_task, timeout=5)
+        assert upload.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_stop_keeps_pending_feedbacks(self, outbox):
+        session = make_session()
+        await outbox.enqueue(session, make_feedback(1))
+        outbox.start(session, AsyncMock(side_effect=ConnectionError()))
+        await asyncio.sleep(0.05)
+        await outbox.stop()
+        assert await outbox.count_pending(session) == 1
+
+    @pytest.mark.asyncio
+    async def test_drain_waits_for_pending_feedbacks(self, outbox):
+        session = make_session()
+        await outbox.enqueue(session, make_feedback(1))
+        upload = AsyncMock(side_effect=[ConnectionError(), True])
+        outbox.start(session, upload)
+        assert await outbox.drain(session, timeout=5)
+        await outbox.stop()
+        assert upload.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_drain_is_bounded(self, outbox):
+        session = make_session()
+        await outbox.enqueue(session, make_feedback(1))
+        outbox.start(session, AsyncMock(side_effect=ConnectionError()))
+        assert not await outbox.drain(session, timeout=0.1)
+        await outbox.stop()
+        assert await outbox.count_pending(session) == 1
+
+    @pytest.mark.asyncio
+    async def test_last_seqnum_of_the_session(self, outbox):
+        session = make_session()
+        assert await outbox.get_last_seqnum(session) == 0
+        for seqnum in [3, 4]:
+            await outbox.enqueue(session, make_feedback(seqnum))
+        await outbox.enqueue(make_session(session_num=2), make_feedback(9))
+        assert await outbox.get_last_seqnum(session) == 4
+
+    @pytest.mark.asyncio
+    async def test_only_current_session_is_uploaded(self, outbox):
+        current = make_session(session_num=2)
+        await outbox.enqueue(make_session(session_num=1), make_feedback(1))
+        await outbox.enqueue(current, make_feedback(2))
+        upload = AsyncMock(return_value=False)
+
+        await asyncio.wait_for(outbox.run_uploader(current, upload), timeout=5)
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [2]
+        assert await outbox.count_pending() == 1
+
+    @pytest.mark.asyncio
+    async def test_old_feedbacks_of_other_sessions_expire(self, outbox_env):
+        outbox = UploadOutbox(max_age_seconds=0)
+        current = make_session(session_num=2)
+        await outbox.enqueue(make_session(session_num=1), make_feedback(1))
+        await outbox.enqueue(current, make_feedback(2))
+
+        await outbox.expire(current)
+
+        assert await outbox.count_pending() == 1
+        assert outbox.get_stats()["expired_count"] == 1
+
+
+class TestLatestWins:
+    @pytest.mark.asyncio
+    async def test_newest_feedback_goes_first(self, latest_wins_outbox):
+        session = make_session()
+        for seqnum in [1, 2, 3]:
+            await latest_wins_outbox.enqueue(session, make_feedback(seqnum))
+        upload = AsyncMock(side_effect=[True, True, False])
+        on_superseded = Mock()
+
+        await asyncio.wait_for(
+            latest_wins_outbox.run_uploader(session, upload, on_superseded), timeout=5
+        )
+
+        # The superseded feedbacks are backfilled oldest first
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [3, 1, 2]
+        on_superseded.assert_called_once_with(2)
+        stats = latest_wins_outbox.get_stats()
+        assert stats["superseded_count"] == 2
+        assert stats["backfill_uploaded_count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_superseded_feedbacks_are_dropped_without_backfill(self, outbox_env):
+        outbox = UploadOutbox(latest_wins=True, backfill=False)
+        session = make_session()
+        for seqnum in [1, 2, 3]:
+            await outbox.enqueue(session, make_feedback(seqnum))
+        upload = AsyncMock(return_value=True)
+        outbox.start(session, upload)
+        await asyncio.sleep(0.1)
+        await outbox.stop()
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [3]
+        assert outbox.get_stats()["dropped_count"] == 2
+        assert await outbox.count_pending() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_feedback_is_superseded_by_newer_one(self, latest_wins_outbox):
+        session = make_session()
+        latest_wins_outbox.get_retry_delay = lambda attempts: 10
+        await latest_wins_outbox.enqueue(session, make_feedback(1))
+        upload = AsyncMock(side_effect=[ConnectionError(), False])
+        latest_wins_outbox.start(session, upload)
+        await asyncio.sleep(0.05)
+
+        # The retry of the first feedback would wait for its backoff
+        await latest_wins_outbox.enqueue(session, make_feedback(2))
+        await asyncio.wait_for(latest_wins_outbox.uploader_task, timeout=5)
+
+        assert [call.args[0].seqnum for call in upload.call_args_list] == [1, 2]
+        assert latest_wins_outbox.get_stats()["superseded_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_backfill_upload_is_preempted(self, latest_wins_outbox):
+        session = make_session()
+        await latest_wins_outbox.enqueue(session, make_feedback(1))
+        await latest_wins_outbox.enqueue(session, make_feedback(2))
+        uploaded = []
+        backfill_started = asyncio.Event()
+
+        async def upload(feedback):
+            if feedback.seqnum == 1 and not backfill_started.is_set():
+                backfill_started.set()
+                await asyncio.sleep(10)
+            uploaded.append(feedback.seqnum)
+            return feedback.seqnum != 1
+
+        latest_wins_outbox.start(session, upload)
+        await asyncio.wait_for(backfill_started.wait(), timeout=5)
+        await latest_wins_outbox.enqueue(session, make_feedback(3))
+        await asyncio.wait_for(latest_wins_outbox.uploader_task, timeout=5)
+
+        assert uploaded == [2, 3, 1]
+        assert latest_wins_outbox.get_stats()["preempted_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_realtime_upload_is_superseded_while_in_flight(
+        self, latest_wins_outbox
+    ):
+        session = make_session()
+        await latest_wins_outbox.enqueue(session, make_feedback(1))
+        uploaded = []
+        upload_started = asyncio.Event()
+
+        async def upload(feedback):
+            if feedback.seqnum == 1 and not upload_started.is_set():
+                upload_started.set()
+                await asyncio.sleep(10)
+            uploaded.append(feedback.seqnum)
+            return feedback.seqnum != 1
+
+        latest_wins_outbox.start(session, upload)
+        await asyncio.wait_for(upload_started.wait(), timeout=5)
+        await latest_wins_outbox.enqueue(session, make_feedback(2))
+        await asyncio.wait_for(latest_wins_outbox.uploader_task, timeout=5)
+
+        # The newer feedback goes first, the interrupted one is backfilled
+        assert uploaded == [2, 1]
+        assert latest_wins_outbox.get_stats()["preempted_count"] == 1
+        assert latest_wins_outbox.get_stats()["superseded_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_realtime_upload_is_not_interrupted_without_latest_wins(self, outbox):
+        session = make_session()
+        await outbox.enqueue(session, make_feedback(1))
+        uploaded = []
+        upload_started = asyncio.Event()
+
+        async def upload(feedback):
+            if feedback.seqnum == 1:
+                upload_started.set()
+                await asyncio.sleep(0.1)
+            uploaded.append(feedback.seqnum)
+            return feedback.seqnum != 2
+
+        outbox.start(session, upload)
+        await asyncio.wait_for(upload_started.wait(), timeout=5)
+        await outbox.enqueue(session, make_feedback(2))
+        await asyncio.wait_for(outbox.uploader_task, timeout=5)
+
+        assert uploaded == [1, 2]
+        assert outbox.get_stats()["preempted_count"] == 0
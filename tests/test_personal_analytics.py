@@ -0,0 +1,86 @@
+import httpx
+import pytest
+import pytest_asyncio
+import asyncio
+
+from unittest.mock import AsyncMock, Mock
+
+from personal_analytics import PersonalAnalyticsClient, PersonalAnalyticsData
+
+BODY = (
+    b'{"isFocused": 1, "clickTotal": 2, "keyTotal": 3, '
+    b'"movedDistance": 4.5, "scrollDelta": 6.5}'
+)
+
+
+@pytest_asyncio.fixture
+async def pa_server():
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(BODY)}\r\n\r\n".encode()
+                    + BODY
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    server.connections = connections
+    server.url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    yield server
+    server.close()
+    await server.wait_closed()
+
+
+class TestPersonalAnalyticsClient:
+    @pytest.mark.parametrize("timeout_seconds, status_ttl_seconds", [[0, 1], [1, -1]])
+    def test_invalid_parameters(self, timeout_seconds, status_ttl_seconds):
+        with pytest.raises(ValueError):
+            PersonalAnalyticsClient(
+                "http://localhost", timeout_seconds, status_ttl_seconds
+            )
+
+    @pytest.mark.asyncio
+    async def test_connection_is_reused(self, pa_server):
+        client = PersonalAnalyticsClient(pa_server.url)
+        for _ in range(3):
+            data = await client.get_data()
+        assert data == PersonalAnalyticsData(
+            isFocused=1, clickTotal=2, keyTotal=3, movedDistance=4.5, scrollDelta=6.5
+        )
+        assert len(pa_server.connections) == 1
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_availability_is_cached(self, pa_server):
+        client = PersonalAnalyticsClient(pa_server.url, status_ttl_seconds=60)
+        assert await client.is_available()
+        pa_server.close()
+        await pa_server.wait_closed()
+        # The service went away, but the cached status is still used
+        assert await client.is_available()
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_unreachable_service_is_unavailable(self):
+        client = PersonalAnalyticsClient("http://127.0.0.1:1", status_ttl_seconds=0)
+        assert not await client.is_available()
+        await client.aclose()
+
+    @pytest.mark.parametrize(
+        "error", [httpx.DecodingError("Invalid gzip"), RuntimeError("closed")]
+    )
+    @pytest.mark.asyncio
+    async def test_any_error_makes_the_service_unavailable(self, error):
+        client = PersonalAnalyticsClient("http://localhost", status_ttl_seconds=0)
+        client.get_client = Mock(return_value=Mock(get=AsyncMock(side_effect=error)))
+        assert not await client.is_available()
@@ -0,0 +1,93 @@
+import pytest
+import asyncio
+
+from pipeline import PipelineStage
+
+
+class TestPipelineStage:
+    @pytest.mark.parametrize("concurrency, queue_size", [[0, 1], [1, 0]])
+    def test_invalid_parameters(self, concurrency, queue_size):
+        async def handler(item):
+            pass
+
+        with pytest.raises(ValueError):
+            PipelineStage("stage", handler, concurrency, queue_size)
+
+    @pytest.mark.asyncio
+    async def test_single_worker_keeps_order(self):
+        processed = []
+
+        async def handler(item):
+            await asyncio.sleep(0.01 * (3 - item))
+            processed.append(item)
+
+        stage = PipelineStage("stage", handler, queue_size=3)
+        stage.start()
+        for item in range(3):
+            await stage.put(item)
+        await stage.join()
+        await stage.stop()
+        assert processed == [0, 1, 2]
+        assert stage.get_stats()["processed_count"] == 3
+
+    @pytest.mark.asyncio
+    async def test_workers_run_concurrently(self):
+        running = 0
+        max_running = 0
+
+        async def handler(item):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        stage = PipelineStage("stage", handler, concurrency=3, queue_size=3)
+        stage.start()
+        for item in range(3):
+            await stage.put(item)
+        await stage.join()
+        await stage.stop()
+        assert max_running == 3
+
+    @pytest.mark.asyncio
+    async def test_full_queue_applies_backpressure(self):
+        release = asyncio.Event()
+
+        async def handler(item):
+            await release.wait()
+
+        stage = PipelineStage("stage", handler, queue_size=1)
+        stage.start()
+        # One item is being processed and one waits in the queue
+        await stage.put(0)
+        await asyncio.sleep(0)
+        await stage.put(1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(stage.put(2), timeout=0.05)
+        assert stage.get_stats()["queue_depth"] == 1
+
+        release.set()
+        await stage.join()
+        await stage.stop()
+
+    @pytest.mark.asyncio
+    async def test_failing_item_does_not_stop_stage(self):
+        processed = []
+
+        async def handler(item):
+            if item == 0:
+                raise RuntimeError("Something went wrong")
+            processed.append(item)
+
+        stage = PipelineStage("stage", handler, queue_size=2)
+        stage.start()
+        await stage.put(0)
+        await stage.put(1)
+        await stage.join()
+        await stage.stop()
+        assert processed == [1]
+        stats = stage.get_stats()
+        assert stats["failed_count"] == 1
+        assert stats["processed_count"] == 1
+        assert stats["average_seconds"] is not None
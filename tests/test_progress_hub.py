@@ -0,0 +1,87 @@
+import pytest
+import asyncio
+
+from unittest.mock import AsyncMock
+
+from progress_hub import SessionProgressHub
+from services import SessionProgress
+
+
+def make_progress(remaining_time: int, stage: str = "homework") -> SessionProgress:
+    return SessionProgress(stage=stage, remaining_time=remaining_time)
+
+
+class TestSessionProgressHub:
+    @pytest.mark.parametrize("ttl_seconds, poll_seconds", [[-1, 1], [1, 0]])
+    def test_invalid_parameters(self, ttl_seconds, poll_seconds):
+        with pytest.raises(ValueError):
+            SessionProgressHub(AsyncMock(), ttl_seconds, poll_seconds)
+
+    @pytest.mark.asyncio
+    async def test_progress_is_cached(self):
+        fetch = AsyncMock(return_value=make_progress(100))
+        hub = SessionProgressHub(fetch, ttl_seconds=60)
+        assert await hub.get() == make_progress(100)
+        assert await hub.get() == make_progress(100)
+        assert fetch.call_count == 1
+        assert hub.get_stats()["cache_hit_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_progress_is_fetched_again(self):
+        fetch = AsyncMock(side_effect=[make_progress(100), make_progress(99)])
+        hub = SessionProgressHub(fetch, ttl_seconds=0)
+        assert await hub.get() == make_progress(100)
+        assert await hub.get() == make_progress(99)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_coalesced(self):
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return make_progress(100)
+
+        fetch_mock = AsyncMock(side_effect=fetch)
+        hub = SessionProgressHub(fetch_mock, ttl_seconds=60)
+        results = await asyncio.gather(*[hub.get() for _ in range(5)])
+        assert results == [make_progress(100)] * 5
+        assert fetch_mock.call_count == 1
+        assert hub.get_stats()["coalesced_count"] == 4
+
+    @pytest.mark.asyncio
+    async def test_errors_are_cached(self):
+        fetch = AsyncMock(side_effect=RuntimeError("No active session"))
+        hub = SessionProgressHub(fetch, ttl_seconds=60)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await hub.get()
+        assert fetch.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_forgets_progress(self):
+        fetch = AsyncMock(side_effect=[make_progress(100), make_progress(50)])
+        hub = SessionProgressHub(fetch, ttl_seconds=60)
+        await hub.get()
+        hub.invalidate()
+        assert await hub.get() == make_progress(50)
+
+    @pytest.mark.asyncio
+    async def test_subscribers_receive_changes(self):
+        fetch = AsyncMock(
+            side_effect=[make_progress(100), make_progress(100), make_progress(99)]
+            + [make_progress(99)] * 10
+        )
+        hub = SessionProgressHub(fetch, ttl_seconds=0, poll_seconds=0.01)
+        queue = hub.subscribe()
+        assert await asyncio.wait_for(queue.get(), timeout=1) == make_progress(100)
+        assert await asyncio.wait_for(queue.get(), timeout=1) == make_progress(99)
+        hub.unsubscribe(queue)
+        assert hub.poller_task is None
+        assert hub.get_stats()["update_count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_slow_subscriber_only_sees_latest(self):
+        hub = SessionProgressHub(AsyncMock(), ttl_seconds=60)
+        queue = hub.subscribe()
+        hub.publish(make_progress(100))
+        hub.publish(make_progress(99))
+        assert queue.get_nowait() == make_progress(99)
+        hub.unsubscribe(queue)
@@ -0,0 +1,148 @@
+import pytest
+import pytest_asyncio
+import asyncio
+
+from unittest.mock import AsyncMock
+
+from mock_server import SessionProgressServer
+from progress_hub import SessionProgressHub
+from progress_stream import SessionProgressStream, stop_progress_streams
+from services import SessionProgress
+
+
+def parse(progress: dict) -> SessionProgress:
+    if progress.get("status") == "err":
+        raise RuntimeError(progress["message"])
+    return SessionProgress(**progress)
+
+
+async def wait_until(condition, timeout=5) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout=timeout)
+
+
+@pytest_asyncio.fixture
+async def server():
+    server = SessionProgressServer([{"stage": "homework", "remaining_time": 100}])
+    url = await server.start()
+    server.url = url
+    yield server
+    await server.stop()
+
+
+def make_stream(url: str, hub: SessionProgressHub) -> SessionProgressStream:
+    return SessionProgressStream(
+        url,
+        "token",
+        parse,
+        hub,
+        is_over=SessionProgress.is_finished,
+        retry_base_seconds=0.01,
+        retry_max_seconds=0.05,
+    )
+
+
+class TestSessionProgressStream:
+    def test_negative_delay_raises(self):
+        with pytest.raises(ValueError):
+            SessionProgressStream(
+                "ws://localhost", "token", parse, None, retry_base_seconds=-1
+            )
+
+    @pytest.mark.asyncio
+    async def test_pushed_progress_replaces_polling(self, server):
+        fetch = AsyncMock(
+            return_value=SessionProgress(stage="homework", remaining_time=0)
+        )
+        hub = SessionProgressHub(fetch, ttl_seconds=0)
+        stream = make_stream(server.url, hub)
+        stream.start()
+        await wait_until(lambda: hub.get_stats()["push_count"] == 1)
+
+        for _ in range(3):
+            assert await hub.get() == SessionProgress(
+                stage="homework", remaining_time=100
+            )
+        assert fetch.call_count == 0
+        assert server.connections[0].request_headers["Authorization"] == "Bearer token"
+
+        queue = hub.subscribe()
+        server.send({"stage": "survey", "remaining_time": 0})
+        await wait_until(lambda: hub.get_stats()["push_count"] == 2)
+        assert queue.get_nowait() == SessionProgress(stage="survey", remaining_time=0)
+        hub.unsubscribe(queue)
+        stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_pushed_errors_are_raised(self, server):
+        hub = SessionProgressHub(AsyncMock(), ttl_seconds=0)
+        stream = make_stream(server.url, hub)
+        stream.start()
+        await wait_until(lambda: hub.get_stats()["push_count"] == 1)
+        server.send({"status": "err", "message": "No active session"})
+        await wait_until(lambda: hub.get_stats()["push_count"] == 2)
+
+        with pytest.raises(RuntimeError):
+            await hub.get()
+        stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_reconnects_after_the_connection_drops(self, server):
+        server.close_after_updates = True
+        hub = SessionProgressHub(AsyncMock(), ttl_seconds=0)
+        stream = make_stream(server.url, hub)
+        stream.start()
+        await wait_until(lambda: len(server.connections) >= 3)
+        stream.stop()
+        assert stream.get_stats()["connection_count"] >= 3
+        assert not hub.pushing
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_polling_without_server(self, server):
+        url = server.url
+        await server.stop()
+        fetch = AsyncMock(
+            return_value=SessionProgress(stage="homework", remaining_time=5)
+        )
+        hub = SessionProgressHub(fetch, ttl_seconds=0)
+        stream = make_stream(url, hub)
+        stream.start()
+        await wait_until(lambda: stream.get_stats()["failed_connection_count"] >= 2)
+
+        assert await hub.get() == SessionProgress(stage="homework", remaining_time=5)
+        assert fetch.call_count == 1
+        stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_stops_once_the_session_is_over(self, server):
+        fetch = AsyncMock(
+            return_value=SessionProgress(stage="finished", remaining_time=0)
+        )
+        hub = SessionProgressHub(fetch, ttl_seconds=0)
+        stream = make_stream(server.url, hub)
+        stream.start()
+        await wait_until(lambda: hub.get_stats()["push_count"] == 1)
+        server.send({"stage": "finished", "remaining_time": 0})
+        await wait_until(lambda: stream.task.done())
+
+        # No reconnection, and the hub polls again
+        assert len(server.connections) == 1
+        assert not hub.pushing
+        stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_running_streams_are_stopped_on_shutdown(self, server):
+        hub = SessionProgressHub(AsyncMock(), ttl_seconds=0)
+        stream = make_stream(server.url, hub)
+        stream.start()
+        await wait_until(lambda: hub.pushing)
+        task = stream.task
+
+        stop_progress_streams()
+        await asyncio.gather(task, return_exceptions=True)
+        assert task.cancelled()
+        assert stream.task is None
+        assert not hub.pushing
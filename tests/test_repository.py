@@ -60,3 +60,35 @@ class TestRepository:
 
         os.remove(db_path)
         assert not os.path.exists(db_path)
+
+    @pytest.mark.asyncio
+    async def test_last_seqnum_of_the_session(self):
+        db_path = os.getenv("SQLITE_DB_PATH")
+        repo = FeedbackRepository()
+        session = IamSession(
+            token="t",
+            user=User(username="u", role="student"),
+            ip_address="l",
+            session_num=1,
+        )
+        assert await repo.get_last_seqnum(session) == 0
+
+        for seqnum in [1, 2]:
+            await repo.insert_new(
+                Feedback(
+                    seqnum=seqnum,
+                    personal_analytics_data=PaFeedback(
+                        isFocused=1,
+                        numMouseClicks=2,
+                        mouseMoveDistance=2,
+                        mouseScrollDistance=3,
+                        keyboardStrokes=1,
+                    ),
+                    screenshot="s",
+                ),
+                session,
+            )
+        assert await repo.get_last_seqnum(session) == 2
+
+        os.remove(db_path)
+        assert not os.path.exists(db_path)
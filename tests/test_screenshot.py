@@ -0,0 +1,325 @@
+import io
+import os
+
+import pytest
+import numpy as np
+
+from PIL import Image
+from multiprocessing import shared_memory
+from unittest.mock import Mock
+
+from capture_backends import (
+    SyntheticCaptureBackend,
+    create_capture_backend,
+    intersect,
+    parse_region,
+)
+from capture_worker import AsyncScreenCapture
+from frame_buffer import BoxDownscaler, FrameBuffer
+from pydantic import ValidationError
+
+from screenshot import ScreenCapture, EncodingOptions, EncodingStats
+
+
+@pytest.fixture
+def screenshot_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ENV", "TEST")
+    return tmp_path
+
+
+class TestCaptureRegion:
+    def test_intersect(self):
+        a = {"left": 0, "top": 0, "width": 100, "height": 100}
+        b = {"left": 50, "top": -20, "width": 100, "height": 100}
+        assert intersect(a, b) == {"left": 50, "top": 0, "width": 50, "height": 80}
+
+    def test_intersect_without_overlap(self):
+        a = {"left": 0, "top": 0, "width": 100, "height": 100}
+        b = {"left": 100, "top": 0, "width": 100, "height": 100}
+        assert intersect(a, b) is None
+
+    def test_parse_region(self):
+        assert parse_region("10,20,30,40") == {
+            "left": 10,
+            "top": 20,
+            "width": 30,
+            "height": 40,
+        }
+
+    @pytest.mark.parametrize("region", ["10,20,30", "a,b,c,d", "0,0,0,10"])
+    def test_parse_invalid_region(self, region):
+        with pytest.raises(ValueError):
+            parse_region(region)
+
+
+class TestSyntheticCaptureBackend:
+    @pytest.mark.parametrize(
+        "width, height, entropy", [[0, 10, 0], [10, 0, 0], [10, 10, -1], [10, 10, 2]]
+    )
+    def test_invalid_parameters(self, width, height, entropy):
+        with pytest.raises(ValueError):
+            SyntheticCaptureBackend(width, height, entropy)
+
+    def test_frame_size(self):
+        frame = SyntheticCaptureBackend(64, 48).grab()
+        assert frame.size == (64, 48)
+        assert len(frame.raw) == 64 * 48 * 4
+
+    def test_same_seed_gives_same_frames(self):
+        a = SyntheticCaptureBackend(64, 48, entropy=0.5, seed=1)
+        b = SyntheticCaptureBackend(64, 48, entropy=0.5, seed=1)
+        for _ in range(3):
+            assert bytes(a.grab().raw) == bytes(b.grab().raw)
+
+    def test_zero_entropy_gives_identical_frames(self):
+        backend = SyntheticCaptureBackend(64, 48, entropy=0)
+        assert bytes(backend.grab().raw) == bytes(backend.grab().raw)
+
+    def test_region_is_cropped(self):
+        full = SyntheticCaptureBackend(64, 48, seed=1)
+        cropped = SyntheticCaptureBackend(
+            64, 48, seed=1, region={"left": 8, "top": 4, "width": 16, "height": 8}
+        )
+        full_frame = full.grab()
+        cropped_frame = cropped.grab()
+        assert cropped_frame.size == (16, 8)
+        row = 4 * 64 * 4 + 8 * 4
+        assert (
+            bytes(cropped_frame.raw)[: 16 * 4]
+            == bytes(full_frame.raw)[row : row + 16 * 4]
+        )
+
+    def test_region_outside_frame_falls_back_to_full_frame(self):
+        backend = SyntheticCaptureBackend(
+            64, 48, region={"left": 100, "top": 100, "width": 16, "height": 8}
+        )
+        assert backend.grab().size == (64, 48)
+
+    def test_backend_is_selected_from_environment(self, monkeypatch):
+        monkeypatch.setenv("CAPTURE_BACKEND", "synthetic")
+        monkeypatch.setenv("SYNTHETIC_CAPTURE_WIDTH", "32")
+        monkeypatch.setenv("SYNTHETIC_CAPTURE_HEIGHT", "16")
+        assert create_capture_backend().grab().size == (32, 16)
+
+    def test_unknown_backend_raises(self, monkeypatch):
+        monkeypatch.setenv("CAPTURE_BACKEND", "unknown")
+        with pytest.raises(ValueError):
+            create_capture_backend()
+
+
+class TestFrameBuffer:
+    def test_grab_into_matches_grab(self):
+        frame_buffer = FrameBuffer()
+        SyntheticCaptureBackend(64, 48, seed=1).grab_into(frame_buffer)
+        frame = SyntheticCaptureBackend(64, 48, seed=1).grab()
+        assert frame_buffer.size == frame.size
+        assert bytes(frame_buffer.view) == bytes(frame.raw)
+        assert frame_buffer.array.shape == (48, 64, 4)
+
+    def test_grab_into_region(self):
+        region = {"left": 8, "top": 4, "width": 16, "height": 8}
+        frame_buffer = FrameBuffer()
+        SyntheticCaptureBackend(64, 48, seed=1, region=region).grab_into(frame_buffer)
+        frame = SyntheticCaptureBackend(64, 48, seed=1, region=region).grab()
+        assert frame_buffer.size == (16, 8)
+        assert bytes(frame_buffer.view) == bytes(frame.raw)
+
+    def test_buffer_is_reused(self):
+        frame_buffer = FrameBuffer()
+        backend = SyntheticCaptureBackend(64, 48)
+        backend.grab_into(frame_buffer)
+        buffer = frame_buffer.buffer
+        backend.grab_into(frame_buffer)
+        assert frame_buffer.buffer is buffer
+        frame_buffer.set_size(32, 24)
+        assert frame_buffer.buffer is buffer
+        frame_buffer.set_size(128, 96)
+        assert frame_buffer.buffer is not buffer
+
+    def test_fixed_buffer_too_small_raises(self):
+        frame_buffer = FrameBuffer(bytearray(16), allocator=None)
+        frame_buffer.set_size(2, 2)
+        with pytest.raises(ValueError):
+            frame_buffer.set_size(4, 4)
+
+    def test_downscaler_averages_blocks(self):
+        pixels = np.arange(6 * 4 * 4, dtype=np.uint8).reshape(6, 4, 4)
+        reduced = BoxDownscaler().reduce(pixels, 2)
+        expected = pixels.reshape(3, 2, 2, 2, 4).astype(np.uint16).sum(axis=(1, 3)) // 4
+        assert reduced.shape == (3, 2, 4)
+        assert (reduced == expected).all()
+
+    def test_downscaler_reuses_output(self):
+        downscaler = BoxDownscaler()
+        pixels = np.zeros((8, 8, 4), dtype=np.uint8)
+        assert downscaler.reduce(pixels, 2) is downscaler.reduce(pixels, 2)
+
+
+ENCODING_VARIABLES = [
+    "SCREENSHOT_FORMAT",
+    "SCREENSHOT_QUALITY",
+    "SCREENSHOT_MAX_EDGE",
+    "SCREENSHOT_GRAYSCALE",
+    "SCREENSHOT_DELTA",
+    "SCREENSHOT_DELTA_TILE_SIZE",
+    "SCREENSHOT_KEYFRAME_INTERVAL",
+]
+
+
+class TestEncodingOptions:
+    @pytest.fixture(autouse=True)
+    def clean_env(self, monkeypatch):
+        for name in ENCODING_VARIABLES:
+            monkeypatch.delenv(name, raising=False)
+
+    def test_defaults_are_lossless_png(self):
+        options = EncodingOptions.from_env()
+        assert options == EncodingOptions()
+        assert options.format == "png"
+        assert options.max_edge == 0
+        assert not options.grayscale
+        assert options.get_extension() == "png"
+
+    def test_from_env(self, monkeypatch):
+        monkeypatch.setenv("SCREENSHOT_FORMAT", "JPEG")
+        monkeypatch.setenv("SCREENSHOT_QUALITY", "60")
+        monkeypatch.setenv("SCREENSHOT_MAX_EDGE", "1280")
+        monkeypatch.setenv("SCREENSHOT_GRAYSCALE", "True")
+        options = EncodingOptions.from_env()
+        assert options == EncodingOptions(
+            format="jpeg", quality=60, max_edge=1280, grayscale=True
+        )
+        assert options.get_extension() == "jpg"
+
+    @pytest.mark.parametrize(
+        "name, value",
+        [
+            ["SCREENSHOT_FORMAT", "gif"],
+            ["SCREENSHOT_QUALITY", "0"],
+            ["SCREENSHOT_QUALITY", "101"],
+            ["SCREENSHOT_MAX_EDGE", "-1"],
+        ],
+    )
+    def test_invalid_values_raise(self, monkeypatch, name, value):
+        monkeypatch.setenv(name, value)
+        with pytest.raises(ValidationError):
+            EncodingOptions.from_env()
+
+    def test_encoding_stats(self):
+        stats = EncodingStats()
+        assert stats.to_dict()["average_bytes"] is None
+        stats.register(100, 0.1)
+        stats.register(300, 0.3)
+        result = stats.to_dict()
+        assert result["frame_count"] == 2
+        assert result["total_bytes"] == 400
+        assert result["last_bytes"] == 300
+        assert result["average_bytes"] == 200
+        assert result["average_encode_seconds"] == pytest.approx(0.2)
+
+
+class TestScreenCapture:
+    def test_take_screenshot(self, screenshot_env):
+        capture = ScreenCapture(EncodingOptions(), SyntheticCaptureBackend(64, 48))
+        screenshot = capture.take_screenshot()
+        assert Image.open(io.BytesIO(screenshot.data)).size == (64, 48)
+        assert capture.get_timing_stats()["capture_count"] == 1
+
+    def test_backend_is_kept_open_between_captures(self, screenshot_env):
+        backend = SyntheticCaptureBackend(64, 48)
+        backend.close = Mock()
+        capture = ScreenCapture(EncodingOptions(), backend)
+        for _ in range(3):
+            capture.take_screenshot()
+        assert capture.backend is backend
+        assert capture.get_timing_stats()["capture_count"] == 3
+        backend.close.assert_not_called()
+
+        capture.close()
+        backend.close.assert_called_once()
+        assert capture.backend is None
+
+    def test_backend_is_created_on_first_capture(self, screenshot_env, monkeypatch):
+        monkeypatch.setenv("CAPTURE_BACKEND", "synthetic")
+        monkeypatch.setenv("SYNTHETIC_CAPTURE_WIDTH", "32")
+        monkeypatch.setenv("SYNTHETIC_CAPTURE_HEIGHT", "16")
+        capture = ScreenCapture(EncodingOptions())
+        assert capture.backend is None
+        capture.take_screenshot()
+        backend = capture.backend
+        capture.take_screenshot()
+        assert capture.backend is backend
+        capture.close()
+
+    def test_encoding_options(self, screenshot_env):
+        capture = ScreenCapture(
+            EncodingOptions(format="jpeg", max_edge=32, grayscale=True),
+            SyntheticCaptureBackend(64, 48),
+        )
+        screenshot = capture.take_screenshot()
+        img = Image.open(io.BytesIO(screenshot.data))
+        assert screenshot.filepath.endswith(".jpg")
+        assert img.format == "JPEG"
+        assert img.mode == "L"
+        assert img.size == (32, 24)
+
+    def test_max_edge_that_is_not_a_divisor(self, screenshot_env):
+        capture = ScreenCapture(
+            EncodingOptions(max_edge=20), SyntheticCaptureBackend(64, 48)
+        )
+        screenshot = capture.take_screenshot()
+        assert Image.open(io.BytesIO(screenshot.data)).size == (20, 15)
+
+    @pytest.mark.asyncio
+    async def test_async_capture_encodes_in_worker_process(self, screenshot_env):
+        capture = AsyncScreenCapture(
+            ScreenCapture(EncodingOptions(), SyntheticCaptureBackend(64, 48))
+        )
+        try:
+            first = await capture.capture()
+            second = await capture.capture()
+        finally:
+            capture.close()
+        assert Image.open(io.BytesIO(first.data)).size == (64, 48)
+        assert first.data != second.data
+        assert capture.get_timing_stats()["encoding"]["frame_count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_encoder_process_is_restarted_if_it_died(self, screenshot_env):
+        capture = AsyncScreenCapture(
+            ScreenCapture(EncodingOptions(), SyntheticCaptureBackend(64, 48))
+        )
+        try:
+            await capture.capture()
+            encoder = capture.process
+            assert encoder.pid != os.getpid()
+            encoder.kill()
+            encoder.join()
+
+            screenshot = await capture.capture()
+            assert capture.process is not encoder
+            assert capture.process.is_alive()
+        finally:
+            capture.close()
+        assert Image.open(io.BytesIO(screenshot.data)).size == (64, 48)
+
+    @pytest.mark.asyncio
+    async def test_async_capture_is_closed_and_started_again(self, screenshot_env):
+        capture = AsyncScreenCapture(
+            ScreenCapture(EncodingOptions(), SyntheticCaptureBackend(64, 48))
+        )
+        try:
+            await capture.capture()
+            process, shm_name = capture.process, capture.shm.name
+            await capture.aclose()
+            assert not process.is_alive()
+            assert capture.shm is None
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=shm_name)
+
+            # Grabs with a new backend, since closing closes the backend too
+            screenshot = await capture.capture()
+        finally:
+            capture.close()
+        assert Image.open(io.BytesIO(screenshot.data)).format == "PNG"
@@ -1,7 +1,9 @@
+import httpx
 import pytest
 from unittest.mock import Mock, AsyncMock
 
-from services import SessionService
+from feedback import Feedback, PaFeedback
+from services import SessionService, SessionProgress
 from session import IamSession, User
 
 
@@ -26,3 +28,69 @@ class TestSessionService:
         await svc.get_remaining_sessions_seqnum_task
         assert get_remaining_sessions_method.call_count == 1
         assert svc.iam_session.session_num == 1
+
+    @pytest.mark.asyncio
+    async def test_session_progress_is_shared(self):
+        svc = SessionService()
+        svc.progress_hub.fetch = AsyncMock(
+            return_value=SessionProgress(stage="homework", remaining_time=100)
+        )
+        assert await svc.is_session_active()
+        assert (await svc.get_session_progress()).remaining_time == 100
+        assert svc.progress_hub.fetch.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_upload_tracking_rollup(self):
+        svc = SessionService()
+        svc.iam_session = IamSession(
+            token="valid", user=User(username="u", role="s"), ip_address="localhost"
+        )
+        svc.http_client = Mock(post=AsyncMock(return_value=Mock(json=lambda: {})))
+        rollup = Mock(to_records=lambda: [{"user_input_rows": 3}])
+        await svc.upload_tracking_rollup(rollup)
+
+        kwargs = svc.http_client.post.call_args.kwargs
+        assert svc.http_client.post.call_args.args[0].endswith(
+            "/student/u/tracking/rollup"
+        )
+        assert kwargs["json"] == [{"user_input_rows": 3}]
+        assert kwargs["endpoint"] == "tracking_rollup"
+
+    @pytest.mark.asyncio
+    async def test_rejected_feedback_raises(self):
+        svc = SessionService()
+        svc.iam_session = IamSession(
+            token="valid", user=User(username="u", role="s"), ip_address="localhost"
+        )
+        response = httpx.Response(
+            422,
+            json={"status": "err", "message": "invalid"},
+            request=httpx.Request("POST", "http://backend/feedback"),
+        )
+        svc.http_client = Mock(post=AsyncMock(return_value=response))
+        feedback = Feedback(
+            seqnum=2,
+            personal_analytics_data=PaFeedback(
+                isFocused=1,
+                numMouseClicks=0,
+                mouseScrollDistance=0,
+                mouseMoveDistance=0,
+                keyboardStrokes=0,
+            ),
+            screenshot="1.png",
+            unchanged_since=1,
+        )
+        with pytest.raises(httpx.HTTPStatusError):
+            await svc.ingest_feedback(feedback)
+
+    @pytest.mark.asyncio
+    async def test_progress_stream_stops_when_the_session_is_over(self):
+        svc = SessionService()
+        svc.progress_hub.fetch = AsyncMock(
+            return_value=SessionProgress(stage="finished", remaining_time=0)
+        )
+        svc.progress_stream = Mock()
+        stream = svc.progress_stream
+        assert not await svc.is_session_active()
+        stream.stop.assert_called_once()
+        assert svc.progress_stream is None
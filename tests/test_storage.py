@@ -0,0 +1,122 @@
+import os
+import time
+
+import pytest
+
+from session import IamSession, User
+from storage import ScreenshotStorage
+
+
+def make_session(session_num: int | None) -> IamSession:
+    return IamSession(
+        token="t",
+        user=User(username="u", role="student"),
+        ip_address="l",
+        session_num=session_num,
+    )
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_DB_PATH", str(tmp_path / "db.sqlite"))
+    return tmp_path
+
+
+async def write_screenshot(
+    storage: ScreenshotStorage, session: IamSession, seqnum: int, nbytes: int = 100
+) -> str:
+    path = os.path.join(storage.screenshot_dir, f"{session.session_num}-{seqnum}.png")
+    with open(path, "wb") as fp:
+        fp.write(bytes([seqnum % 256]) * nbytes)
+    await storage.register(session, seqnum, path, nbytes)
+    return path
+
+
+class TestScreenshotStorage:
+    def test_raises_if_db_path_not_set(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("SQLITE_DB_PATH", raising=False)
+        with pytest.raises(ValueError):
+            ScreenshotStorage(str(tmp_path))
+
+    def test_budget_cannot_be_negative(self, storage_dir):
+        with pytest.raises(ValueError):
+            ScreenshotStorage(str(storage_dir), max_bytes=-1)
+
+    @pytest.mark.asyncio
+    async def test_compacts_previous_sessions(self, storage_dir):
+        storage = ScreenshotStorage(str(storage_dir))
+        old_path = await write_screenshot(storage, make_session(1), 1)
+        current_path = await write_screenshot(storage, make_session(2), 1)
+
+        await storage.compact(make_session(2))
+
+        assert not os.path.exists(old_path)
+        assert os.path.exists(current_path)
+        assert os.path.exists(storage._get_archive_path("u", 1))
+        assert await storage.read("u", 1, 1) == bytes([1]) * 100
+
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used_uploaded_screenshots(self, storage_dir):
+        storage = ScreenshotStorage(str(storage_dir), max_bytes=250)
+        session = make_session(1)
+        paths = [await write_screenshot(storage, session, i) for i in range(1, 4)]
+        for i in range(1, 4):
+            await storage.mark_uploaded(session, i)
+        # Reading the first screenshot makes the second one the least recently used
+        await storage.read("u", 1, 1)
+
+        await storage.evict()
+
+        assert os.path.exists(paths[0])
+        assert not os.path.exists(paths[1])
+        assert os.path.exists(paths[2])
+
+    @pytest.mark.asyncio
+    async def test_keeps_screenshots_that_were_not_uploaded(self, storage_dir):
+        storage = ScreenshotStorage(str(storage_dir), max_bytes=0)
+        path = await write_screenshot(storage, make_session(1), 1)
+
+        await storage.evict()
+
+        assert os.path.exists(path)
+
+    @pytest.mark.asyncio
+    async def test_evicts_old_screenshots(self, storage_dir):
+        storage = ScreenshotStorage(str(storage_dir), max_age_seconds=0)
+        session = make_session(1)
+        path = await write_screenshot(storage, session, 1)
+        await storage.mark_uploaded(session, 1)
+        time.sleep(0.01)
+
+        await storage.evict()
+
+        assert not os.path.exists(path)
+
+    @pytest.mark.asyncio
+    async def test_evicts_archives_as_a_whole(self, storage_dir):
+        storage = ScreenshotStorage(str(storage_dir), max_bytes=0)
+        session = make_session(1)
+        for i in range(1, 3):
+            await write_screenshot(storage, session, i)
+            await storage.mark_uploaded(session, i)
+        await storage.compact()
+
+        await storage.evict()
+
+        assert not os.path.exists(storage._get_archive_path("u", 1))
+
+    @pytest.mark.asyncio
+    async def test_session_without_number(self, storage_dir):
+        # The session number is not known until the backend sent it
+        storage = ScreenshotStorage(str(storage_dir), max_bytes=0)
+        session = make_session(None)
+        path = await write_screenshot(storage, session, 1)
+        await write_screenshot(storage, session, 1)
+        assert await storage.read("u", None, 1) == bytes([1]) * 100
+
+        await storage.mark_uploaded(session, 1)
+        await storage.evict()
+
+        assert not os.path.exists(path)
+        with pytest.raises(KeyError):
+            await storage.read("u", None, 1)
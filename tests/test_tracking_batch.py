@@ -0,0 +1,155 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from tracking import UserInput, WindowsActivity
+from tracking_batch import TrackingBatch
+
+USER_INPUT_ROWS = [
+    (
+        1,
+        "2024-01-01 10:00:00",
+        "2024-01-01 09:59:00",
+        "2024-01-01 10:00:00",
+        3,
+        1,
+        0,
+        12,
+    ),
+    (
+        2,
+        "2024-01-01 10:01:00.1234567",
+        "2024-01-01 10:00:00",
+        "2024-01-01 10:01:00",
+        0,
+        2,
+        -5,
+        0,
+    ),
+]
+
+WINDOWS_ACTIVITY_ROWS = [
+    (
+        7,
+        "2024-01-01 10:00:00",
+        "2024-01-01 10:00:00",
+        "2024-01-01 10:05:00",
+        "Éditeur – notes",
+        "code.exe",
+    ),
+    (
+        8,
+        "2024-01-01 10:05:00",
+        "2024-01-01 10:05:00",
+        "2024-01-01 10:06:00",
+        "",
+        "explorer.exe",
+    ),
+]
+
+
+class TestTrackingBatch:
+    def test_unknown_table(self):
+        with pytest.raises(ValueError):
+            TrackingBatch.from_rows("unknown", "student", "a.pa.dat", [])
+
+    def test_columns_have_to_match_the_schema(self):
+        with pytest.raises(ValueError):
+            TrackingBatch("user_input", "student", "a.pa.dat", {"id": np.arange(2)})
+
+    def test_columns_have_to_have_the_same_length(self):
+        batch = TrackingBatch.from_rows(
+            "user_input", "student", "a.pa.dat", USER_INPUT_ROWS
+        )
+        columns = dict(batch.columns)
+        columns["keys_total"] = columns["keys_total"][:1]
+        with pytest.raises(ValueError):
+            TrackingBatch("user_input", "student", "a.pa.dat", columns)
+
+    def test_timestamps_are_epoch_microseconds(self):
+        batch = TrackingBatch.from_rows(
+            "user_input", "student", "a.pa.dat", USER_INPUT_ROWS
+        )
+        assert batch.columns["ts_time"].dtype == np.int64
+        assert batch.columns["ts_time"][0] == int(
+            (datetime(2024, 1, 1, 10) - datetime(1970, 1, 1)).total_seconds() * 1e6
+        )
+        assert batch.columns["ts_time"][1] - batch.columns["ts_time"][0] == 60123456
+        assert len(batch) == 2
+        assert batch.last_id == 2
+        assert batch.last_time == "2024-01-01 10:01:00.1234567"
+
+    @pytest.mark.parametrize(
+        "table, rows, model",
+        [
+            ("user_input", USER_INPUT_ROWS, UserInput),
+            ("windows_activity", WINDOWS_ACTIVITY_ROWS, WindowsActivity),
+        ],
+    )
+    def test_same_models_as_the_pydantic_path(self, table, rows, model):
+        batch = TrackingBatch.from_rows(table, "student", "a.pa.dat", rows)
+        fields = [
+            name for name in model.model_fields if name not in ("username", "filename")
+        ]
+        expected = [
+            model(
+                username="student",
+                filename="a.pa.dat",
+                **dict(zip(fields, row)),
+            )
+            for row in rows
+        ]
+        assert batch.to_models() == expected
+
+    @pytest.mark.parametrize(
+        "table, rows",
+        [
+            ("user_input", USER_INPUT_ROWS),
+            ("windows_activity", WINDOWS_ACTIVITY_ROWS),
+            ("windows_activity", []),
+        ],
+    )
+    def test_bytes_round_trip(self, table, rows):
+        batch = TrackingBatch.from_rows(table, "student", "a.pa.dat", rows)
+        decoded = TrackingBatch.from_bytes(batch.to_bytes())
+        assert decoded.table == table
+        assert decoded.username == "student"
+        assert decoded.filename == "a.pa.dat"
+        assert decoded.last_time == batch.last_time
+        assert len(decoded) == len(rows)
+        for name, column in batch.columns.items():
+            assert decoded.columns[name].tolist() == column.tolist()
+
+    def test_bytes_are_compact(self):
+        rows = USER_INPUT_ROWS * 1000
+        data = TrackingBatch.from_rows("user_input", "student", "a.pa.dat", rows)
+        # 8 columns of 8 bytes per row, plus the header
+        assert len(data.to_bytes()) < 8 * 8 * len(rows) + 1024
+
+    def test_invalid_bytes(self):
+        with pytest.raises(ValueError):
+            TrackingBatch.from_bytes(b"not a batch")
+
+    def test_null_values(self):
+        rows = [
+            (1, "2024-01-01 10:00:00", "2024-01-01 10:00:00", None, None, "code.exe"),
+            (2, "2024-01-01 10:01:00", None, "2024-01-01 10:02:00", "notes", None),
+        ]
+        batch = TrackingBatch.from_rows("windows_activity", "student", "a.pa.dat", rows)
+        assert batch.columns["window_name"].tolist() == ["", "notes"]
+        assert batch.columns["process_name"].tolist() == ["code.exe", ""]
+        assert batch.columns["ts_end"][0] == TrackingBatch.NAT
+        assert batch.columns["ts_start"][1] == TrackingBatch.NAT
+        decoded = TrackingBatch.from_bytes(batch.to_bytes())
+        assert decoded.columns["window_name"].tolist() == ["", "notes"]
+        assert decoded.columns["ts_end"].tolist() == batch.columns["ts_end"].tolist()
+
+        user_input = TrackingBatch.from_rows(
+            "user_input",
+            "student",
+            "a.pa.dat",
+            [(1, "2024-01-01 10:00:00", None, None, None, 1, None, 2.5)],
+        )
+        assert user_input.columns["keys_total"].tolist() == [0]
+        assert user_input.columns["scroll_delta"].tolist() == [0]
@@ -0,0 +1,83 @@
+import pytest
+import sqlite3 as sql
+from contextlib import closing
+
+from pa_fixtures import base_dir, create_pa_file, add_rows
+from tracking_extractor import TrackingExtractor
+
+
+def export(extractor: TrackingExtractor) -> list[int]:
+    """Exports the new rows and returns the number of rows of every chunk."""
+    sizes = []
+    for chunk in extractor.iter_new_data():
+        sizes.append(len(chunk.rows))
+        extractor.save_checkpoint(chunk)
+    return sizes
+
+
+class TestTrackingExtractor:
+    def test_missing_database_path_raises(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("SQLITE_DB_PATH", raising=False)
+        with pytest.raises(ValueError):
+            TrackingExtractor(str(tmp_path))
+
+    def test_invalid_chunk_size(self, base_dir):
+        with pytest.raises(ValueError):
+            TrackingExtractor(str(base_dir), chunk_size=0)
+
+    def test_reads_in_bounded_chunks(self, base_dir):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=25, windows_activities=3)
+        (base_dir / "ignored.txt").write_text("")
+        extractor = TrackingExtractor(str(base_dir), chunk_size=10)
+
+        chunks = list(extractor.iter_new_data())
+
+        assert [(chunk.table, len(chunk.rows)) for chunk in chunks] == [
+            ("user_input", 10),
+            ("user_input", 10),
+            ("user_input", 5),
+            ("windows_activity", 3),
+        ]
+        assert chunks[0].rows[0].filename == "a.pa.dat"
+        assert chunks[0].rows[0].keyTotal == 1
+        assert chunks[-1].rows[0].process == "process"
+        assert extractor.get_stats()["rows_read"] == 28
+
+    def test_only_new_rows_are_read_again(self, base_dir):
+        path = base_dir / "a.pa.dat"
+        create_pa_file(path, user_inputs=5)
+        assert export(TrackingExtractor(str(base_dir))) == [5]
+
+        with closing(sql.connect(path)) as conn:
+            add_rows(conn, "user_input", 3, start=6)
+        extractor = TrackingExtractor(str(base_dir))
+        chunks = list(extractor.iter_new_data())
+        assert [row.id for row in chunks[0].rows] == [6, 7, 8]
+
+    def test_unsaved_chunks_are_read_again(self, base_dir):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=5)
+        extractor = TrackingExtractor(str(base_dir), chunk_size=2)
+        first = next(extractor.iter_new_data())
+        extractor.save_checkpoint(first)
+        # The second chunk was read but its export failed
+
+        assert export(TrackingExtractor(str(base_dir), chunk_size=2)) == [2, 1]
+
+    def test_replaced_file_is_read_from_the_start(self, base_dir):
+        path = base_dir / "a.pa.dat"
+        create_pa_file(path, user_inputs=5)
+        export(TrackingExtractor(str(base_dir)))
+
+        path.unlink()
+        with closing(sql.connect(path)) as conn:
+            create_pa_file(path, user_inputs=0)
+            add_rows(conn, "user_input", 7, minute=30)
+        extractor = TrackingExtractor(str(base_dir))
+        assert export(extractor) == [7]
+        assert extractor.get_stats()["reset_count"] == 1
+
+    def test_checkpoints_are_kept_per_file(self, base_dir):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=2)
+        create_pa_file(base_dir / "b.pa.dat", user_inputs=3)
+        assert export(TrackingExtractor(str(base_dir))) == [2, 3]
+        assert export(TrackingExtractor(str(base_dir))) == []
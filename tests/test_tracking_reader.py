@@ -0,0 +1,89 @@
+import pytest
+
+from pa_fixtures import base_dir, create_pa_file
+from tracking_extractor import TrackingExtractor
+from tracking_reader import ParallelTrackingReader, read_tracking_range
+
+
+class TestParallelTrackingReader:
+    def test_invalid_workers(self, base_dir):
+        with pytest.raises(ValueError):
+            ParallelTrackingReader(TrackingExtractor(str(base_dir)), workers=0)
+
+    def test_plan_splits_new_rows_in_id_ranges(self, base_dir):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=25, windows_activities=3)
+        create_pa_file(base_dir / "b.pa.dat", user_inputs=0)
+        extractor = TrackingExtractor(str(base_dir), chunk_size=10)
+        reader = ParallelTrackingReader(extractor, workers=2)
+
+        ranges = [(table, after, until) for _, table, after, until in reader.plan()]
+        assert ranges == [
+            ("user_input", 0, 10),
+            ("user_input", 10, 20),
+            ("user_input", 20, 25),
+            ("windows_activity", 0, 3),
+        ]
+
+    @pytest.mark.parametrize("immutable", [True, False])
+    def test_range_is_read(self, base_dir, immutable):
+        path = base_dir / "a.pa.dat"
+        create_pa_file(path, user_inputs=10)
+        rows, seconds = read_tracking_range(str(path), "user_input", 3, 6, immutable)
+        assert [row[0] for row in rows] == [4, 5, 6]
+        assert seconds >= 0
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_same_chunks_as_the_sequential_extractor(self, base_dir, workers):
+        for name, rows in [("a", 25), ("b", 7), ("c", 12)]:
+            create_pa_file(base_dir / f"{name}.pa.dat", user_inputs=rows)
+        extractor = TrackingExtractor(str(base_dir), chunk_size=5)
+        sequential = [
+            (chunk.filename, chunk.table, chunk.last_id)
+            for chunk in extractor.iter_new_data()
+        ]
+
+        reader = ParallelTrackingReader(extractor, workers=workers)
+        chunks = list(reader.iter_new_data())
+        assert [
+            (chunk.filename, chunk.table, chunk.last_id) for chunk in chunks
+        ] == sequential
+
+        stats = reader.get_stats()
+        assert stats["rows"] == 44
+        assert stats["files"]["a.pa.dat"]["rows"] == 25
+        assert stats["files"]["a.pa.dat"]["rows_per_second"] > 0
+
+    def test_checkpoints_are_honoured(self, base_dir):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=8)
+        extractor = TrackingExtractor(str(base_dir), chunk_size=5)
+        extractor.save_checkpoint(next(extractor.iter_new_data()))
+
+        reader = ParallelTrackingReader(extractor, workers=2)
+        chunks = list(reader.iter_new_data())
+        assert [row.id for row in chunks[0].rows] == [6, 7, 8]
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_batches_match_the_chunks(self, base_dir, workers):
+        create_pa_file(base_dir / "a.pa.dat", user_inputs=12, windows_activities=4)
+        extractor = TrackingExtractor(str(base_dir), chunk_size=5)
+        chunks = list(ParallelTrackingReader(extractor, workers=1).iter_new_data())
+
+        reader = ParallelTrackingReader(extractor, workers=workers)
+        batches = list(reader.iter_new_batches("student"))
+        assert [
+            (batch.filename, batch.table, batch.last_id, batch.last_time)
+            for batch in batches
+        ] == [
+            (chunk.filename, chunk.table, chunk.last_id, chunk.last_time)
+            for chunk in chunks
+        ]
+        assert batches[0].username == "student"
+        assert reader.get_stats()["rows"] == 16
+
+        # The batches move the checkpoints like the chunks
+        extractor.save_checkpoint(batches[0])
+        assert [batch.last_id for batch in reader.iter_new_batches("student")] == [
+            10,
+            12,
+            4,
+        ]
@@ -0,0 +1,144 @@
+import pytest
+
+from tracking_batch import TrackingBatch
+from tracking_rollup import TrackingRollup
+
+TIME = "2024-01-01 10:00:00"
+
+USER_INPUT_ROWS = [
+    (1, TIME, "2024-01-01 10:00:00", "2024-01-01 10:00:30", 3, 1, 0, 12),
+    (2, TIME, "2024-01-01 10:00:30", "2024-01-01 10:01:00", 0, 0, 0, 0),
+    (3, TIME, "2024-01-01 10:01:00", "2024-01-01 10:01:30", 5, 0, -2, 1),
+]
+
+WINDOWS_ACTIVITY_ROWS = [
+    (1, TIME, "2024-01-01 10:00:00", "2024-01-01 10:00:10", "a", "code.exe"),
+    (2, TIME, "2024-01-01 10:00:10", "2024-01-01 10:00:20", "b", "code.exe"),
+    (3, TIME, "2024-01-01 10:01:10", "2024-01-01 10:01:20", "b", "code.exe"),
+    (4, TIME, "2024-01-01 10:02:10", "2024-01-01 10:02:20", "b", "chrome.exe"),
+]
+
+
+def to_batch(table: str, rows: list[tuple]) -> TrackingBatch:
+    return TrackingBatch.from_rows(table, "student", "a.pa.dat", rows)
+
+
+class TestTrackingRollup:
+    def test_invalid_interval(self):
+        with pytest.raises(ValueError):
+            TrackingRollup("student", interval_seconds=0)
+
+    def test_invalid_boundaries(self):
+        with pytest.raises(ValueError):
+            TrackingRollup("student", boundaries=["2024-01-01 10:00:00"])
+        with pytest.raises(ValueError):
+            TrackingRollup(
+                "student", boundaries=["2024-01-01 10:01:00", "2024-01-01 10:00:00"]
+            )
+
+    def test_default_interval_is_a_minute(self, monkeypatch):
+        monkeypatch.delenv("TRACKING_ROLLUP_SECONDS", raising=False)
+        assert TrackingRollup("student").interval == 60 * 10**6
+
+    def test_per_minute_rollup(self):
+        rollup = TrackingRollup("student", interval_seconds=60)
+        # The batches of a file arrive in id order, possibly split
+        rollup.add(to_batch("user_input", USER_INPUT_ROWS[:2]))
+        rollup.add(to_batch("user_input", USER_INPUT_ROWS[2:]))
+        rollup.add(to_batch("windows_activity", WINDOWS_ACTIVITY_ROWS[:2]))
+        rollup.add(to_batch("windows_activity", WINDOWS_ACTIVITY_ROWS[2:]))
+
+        records = rollup.to_records()
+        assert [record["interval_start"] for record in records] == [
+            "2024-01-01T10:00:00",
+            "2024-01-01T10:01:00",
+            "2024-01-01T10:02:00",
+        ]
+        assert records[0]["interval_end"] == "2024-01-01T10:01:00"
+        assert records[0]["user_input_rows"] == 2
+        assert records[0]["keys_total"] == 3
+        assert records[0]["moved_distance_max"] == 12
+        # Only the first row has any input
+        assert records[0]["active_seconds"] == 30
+        assert records[1]["scroll_delta"] == -2
+        assert [record["windows_activity_rows"] for record in records] == [2, 1, 1]
+        assert [record["window_switches"] for record in records] == [1, 0, 1]
+        # No user input in the last minute
+        assert records[2]["user_input_rows"] == 0
+        assert records[2]["keys_total_max"] == 0
+
+        assert rollup.get_stats() == {
+            "rows_added": 7,
+            "intervals": 3,
+            "compression_ratio": 7 / 3,
+        }
+
+    def test_feedback_interval_rollup(self):
+        rollup = TrackingRollup(
+            "student",
+            boundaries=[
+                "2024-01-01 10:00:20",
+                "2024-01-01 10:01:05",
+                "2024-01-01 10:03:00",
+            ],
+        )
+        rollup.add(to_batch("user_input", USER_INPUT_ROWS))
+        rollup.add(to_batch("windows_activity", WINDOWS_ACTIVITY_ROWS))
+
+        records = rollup.to_records()
+        assert [
+            (record["interval_start"], record["interval_end"]) for record in records
+        ] == [
+            ("2024-01-01T10:00:20", "2024-01-01T10:01:05"),
+            ("2024-01-01T10:01:05", "2024-01-01T10:03:00"),
+        ]
+        # The rows starting before the first boundary are left out
+        assert [record["user_input_rows"] for record in records] == [2, 0]
+        assert [record["windows_activity_rows"] for record in records] == [0, 2]
+        assert [record["window_switches"] for record in records] == [0, 1]
+
+    def test_same_totals_as_the_rows(self):
+        rows = [
+            (row_id, TIME, f"2024-01-01 1{row_id % 10}:00:00", TIME, row_id, 1, 0, 0)
+            for row_id in range(1, 1001)
+        ]
+        rollup = TrackingRollup("student", interval_seconds=3600)
+        rollup.add(to_batch("user_input", rows))
+
+        records = rollup.to_records()
+        assert len(records) == 10
+        assert sum(record["keys_total"] for record in records) == sum(range(1, 1001))
+        assert sum(record["user_input_rows"] for record in records) == 1000
+        assert max(record["keys_total_max"] for record in records) == 1000
+
+    def test_rows_with_null_values(self):
+        rollup = TrackingRollup("student", interval_seconds=60)
+        rollup.add(
+            to_batch(
+                "user_input",
+                [
+                    (1, TIME, None, "2024-01-01 10:00:30", 3, 0, 0, 0),
+                    (2, TIME, "2024-01-01 10:00:30", None, None, 2, 0, 0),
+                ],
+            )
+        )
+        rollup.add(
+            to_batch(
+                "windows_activity",
+                [
+                    (1, TIME, "2024-01-01 10:00:00", None, None, "code.exe"),
+                    (2, TIME, "2024-01-01 10:00:10", None, "b", None),
+                ],
+            )
+        )
+
+        # The row without ts_start is left out, the one without ts_end is not
+        # active
+        (record,) = rollup.to_records()
+        assert record["interval_start"] == "2024-01-01T10:00:00"
+        assert record["user_input_rows"] == 1
+        assert record["clicks_total"] == 2
+        assert record["keys_total"] == 0
+        assert record["active_seconds"] == 0
+        assert record["windows_activity_rows"] == 2
+        assert record["window_switches"] == 1